@@ -236,6 +236,48 @@ CACHES = {
 
 APP_CELERY_TASK_MAX_TIME = 30  # seconds
 
+# "fts" or "trigram", see web.models.TitleSearch
+APP_TITLE_SEARCH = os.getenv("TITLE_SEARCH", "fts")
+APP_TRIGRAM_WORD_SIMILARITY_THRESHOLD = 0.6
+
+APP_HN_FETCH_CONCURRENCY = int(os.getenv("HN_FETCH_CONCURRENCY", "20"))
+# requests per second, by platform, Laarc is a small site
+APP_HN_FETCH_RATE = {
+    "h": float(os.getenv("HN_FETCH_RATE", "50")),
+    "a": float(os.getenv("LAARC_FETCH_RATE", "1")),
+}
+
+APP_REDDIT_ARCHIVE_DIR = os.getenv(
+    "REDDIT_ARCHIVE_DIR",
+    "/tmp/discussions_reddit_archive",  # noqa: S108
+)
+APP_REDDIT_ARCHIVE_WORKERS = int(
+    os.getenv("REDDIT_ARCHIVE_WORKERS", str(os.cpu_count() or 1)),
+)
+
+APP_RENORMALIZE_WORKERS = int(
+    os.getenv("RENORMALIZE_WORKERS", str(os.cpu_count() or 1)),
+)
+
+APP_SITEMAP_DIR = os.getenv(
+    "SITEMAP_DIR",
+    str(Path(BASE_DIR) / "sitemaps"),
+)
+# The discussions sitemap is split in 2**APP_SITEMAP_SHARD_BITS files by
+# url_key, changing it regenerates all of them.
+APP_SITEMAP_SHARD_BITS = int(os.getenv("SITEMAP_SHARD_BITS", "8"))
+
+# Each crawler worker holds a database connection while saving, keep it
+# below the pool max_size (3 for the Celery workers, see
+# docker-entrypoint.sh) so the other tasks still get a connection.
+APP_CRAWLER_WORKERS = int(
+    os.getenv(
+        "CRAWLER_WORKERS",
+        str(max(1, DATABASES["default"]["OPTIONS"]["pool"]["max_size"] - 1)),
+    ),
+)
+APP_CRAWLER_RUN_TIME = 10 * 60  # seconds
+
 CELERY_BROKER_URL = os.getenv("REDIS_URL")
 CELERY_RESULT_BACKEND = os.getenv("REDIS_URL")
 
@@ -386,6 +428,12 @@ EMAIL_IMAP_USER = os.getenv("EMAIL_IMAP_USER")
 EMAIL_IMAP_PASSWORD = os.getenv("EMAIL_IMAP_PASSWORD")
 EMAIL_TO_PREFIX = ""
 
+# Emails per second for all the workers, see email_util.Sender.
+# Mentions and weekly emails share the SES sending quota.
+APP_EMAIL_RATE = float(os.getenv("EMAIL_RATE", "59"))
+APP_EMAIL_BURST = int(os.getenv("EMAIL_BURST", "10"))
+APP_WEEKLY_EMAIL_WORKERS = int(os.getenv("WEEKLY_EMAIL_WORKERS", "4"))
+
 STRIPE_PUBLIC_KEY = os.getenv("STRIPE_PUBLIC_KEY")
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")
 STRIPE_PLAN_PRICE_API_ID = os.getenv("STRIPE_PLAN_PRICE_API_ID")
@@ -6,7 +6,7 @@ from django.urls import include, path
 from django.views.decorators.cache import cache_page
 from django.views.generic.base import TemplateView
 
-from web import api_v0, sitemaps
+from web import api_v0, sitemap_shards, sitemaps
 
 from . import settings
 
@@ -31,6 +31,11 @@ urlpatterns = [
         {"sitemaps": sitemaps_dict},
         name="sitemaps",
     ),
+    path("sitemaps/discussions.xml", sitemap_shards.sitemap_index),
+    path(
+        "sitemaps/discussions-<int:shard>.xml.gz",
+        sitemap_shards.sitemap_shard,
+    ),
     path(
         "robots.txt",
         TemplateView.as_view(
@@ -40,6 +45,9 @@ urlpatterns = [
                 "sitemap_url": "https://"
                 + settings.APP_DOMAIN
                 + "/sitemap.xml",
+                "discussions_sitemap_url": "https://"
+                + settings.APP_DOMAIN
+                + "/sitemaps/discussions.xml",
             },
         ),
     ),
@@ -1,5 +1,6 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
 
+import operator
 from dataclasses import dataclass
 from datetime import date
 
@@ -11,7 +12,7 @@ from typing_extensions import override
 
 from web.platform import Platform as SocialPlatform
 
-from . import api_statistics, models, util
+from . import api_statistics, cache_util, models, util
 
 api = NinjaAPI(version="v0")
 api.title = "Discussions and comments API"
@@ -79,6 +80,18 @@ class Message(Schema):
     message: str
 
 
+@cache_util.cached(
+    f"{cache_prefix}:get_discussions",
+    is_empty=operator.not_,
+)
+def __discussions(url, only_relevant_stories):
+    ds, _, _ = models.Discussion.of_url(
+        url,
+        only_relevant_stories=only_relevant_stories,
+    )
+    return list(ds)
+
+
 @api.get(
     "/discussions/url/{path:url}",
     response={200: list[Discussion]},
@@ -93,29 +106,7 @@ def get_discussions(
     """Get all discussions for a given URL."""
     api_statistics.track(request)
 
-    suffix = (url or "").lower().strip()
-    key = f"{cache_prefix}:get_discussions:{only_relevant_stories}:{suffix}"
-    touch_key = "touch:" + key
-
-    ds = cache.get(key)
-
-    timeout = 5 * 60
-
-    if ds:
-        if cache.get(touch_key):
-            _ = cache.touch(key, timeout)
-        return ds
-
-    ds, _, _ = models.Discussion.of_url(
-        url,
-        only_relevant_stories=only_relevant_stories,
-    )
-
-    if ds:
-        cache.set(key, ds, timeout)
-        cache.set(touch_key, 1, timeout=timeout * 3)
-
-    return ds
+    return __discussions(url, only_relevant_stories)
 
 
 @api.api_operation(
@@ -147,32 +138,9 @@ class DiscussionCounts(Schema):
     tags: list[str] = Field(default_factory=list)
 
 
-@api.get(
-    "/discussion_counts/url/{path:url}",
-    response={200: DiscussionCounts},
-    auth=auth_bearer,
-)
-def get_discussion_counts(request: HttpRequest, url: str) -> DiscussionCounts:
-    """Get discussion counts for a given URL."""
-    api_statistics.track(request)
-
-    suffix = (url or "").lower().strip()
-    key = f"{cache_prefix}:get_discussion_counts:{suffix}"
-    touch_key = "touch:" + key
-
-    dcs = cache.get(key)
-
-    timeout = 5 * 60
-
-    if dcs:
-        if cache.get(touch_key):
-            _ = cache.touch(key, timeout)
-        return dcs
-
+def __discussion_counts(url, ds, articles_count):
     dcs = DiscussionCounts()
 
-    ds, _, _ = models.Discussion.of_url(url, only_relevant_stories=True)
-
     dcs.story_url = url
     dcs.discussions_url = util.discussions_url(url)
 
@@ -209,18 +177,35 @@ def get_discussion_counts(request: HttpRequest, url: str) -> DiscussionCounts:
 
     dcs.tags = sorted(set(dcs.tags))
 
-    dcs.articles_count = 0
+    dcs.articles_count = articles_count
+
+    return dcs
+
+
+@cache_util.cached(f"{cache_prefix}:get_discussion_counts")
+def __discussion_counts_of_url(url):
+    ds, _, _ = models.Discussion.of_url(url, only_relevant_stories=True)
+
+    articles_count = 0
     r = models.Resource.by_url(url)
     if r is not None:
         ir = r.inbound_resources()
         if ir is not None:
-            dcs.articles_count = ir.count()
+            articles_count = ir.count()
 
-    if dcs:
-        cache.set(key, dcs, timeout)
-        cache.set(touch_key, 1, timeout=timeout * 3)
+    return __discussion_counts(url, ds, articles_count)
 
-    return dcs
+
+@api.get(
+    "/discussion_counts/url/{path:url}",
+    response={200: DiscussionCounts},
+    auth=auth_bearer,
+)
+def get_discussion_counts(request: HttpRequest, url: str) -> DiscussionCounts:
+    """Get discussion counts for a given URL."""
+    api_statistics.track(request)
+
+    return __discussion_counts_of_url(url)
 
 
 @api.api_operation(
@@ -234,6 +219,63 @@ def options_get_discussion_counts(request: HttpRequest, url: str) -> dict:
     return {}
 
 
+class DiscussionCountsBatch(Schema):
+    urls: list[str] = Field(max_length=500)
+
+
+@api.post(
+    "/discussion_counts/batch",
+    response={200: dict[str, DiscussionCounts]},
+    auth=auth_bearer,
+)
+def get_discussion_counts_batch(
+    request: HttpRequest,
+    batch: DiscussionCountsBatch,
+) -> dict[str, DiscussionCounts]:
+    """Get discussion counts for many URLs (at most 500) at once."""
+    api_statistics.track(request)
+
+    urls = list(dict.fromkeys(batch.urls))
+
+    cached = __discussion_counts_of_url.get_many([(url,) for url in urls])
+    dcs = {args[0]: v for args, v in cached.items()}
+
+    missing = [url for url in urls if url not in dcs]
+    if not missing:
+        return dcs
+
+    discussions = models.Discussion.of_urls(
+        missing,
+        only_relevant_stories=True,
+    )
+    resources = models.Resource.by_urls(missing)
+    articles_counts = models.Resource.inbound_counts(
+        [r.pk for r in resources.values()],
+    )
+
+    computed = {}
+    for url in missing:
+        r = resources.get(url)
+        articles_count = articles_counts.get(r.pk, 0) if r else 0
+        dcs[url] = __discussion_counts(url, discussions[url], articles_count)
+        computed[url,] = dcs[url]
+
+    __discussion_counts_of_url.set_many(computed)
+
+    return dcs
+
+
+@api.api_operation(
+    ["OPTIONS"],
+    "/discussion_counts/batch",
+    response={200: dict[str, DiscussionCounts]},
+    include_in_schema=False,
+)
+def options_get_discussion_counts_batch(request: HttpRequest) -> dict:
+    _ = request
+    return {}
+
+
 class Platform(Schema):
     code: str
     name: str
@@ -16,13 +16,14 @@ logger = logging.getLogger(__name__)
 
 
 def connection_created_signal_handler(sender, connection, **kwargs):
-    _ = (sender, connection, kwargs)
-    # if sender.vendor == 'postgresql':
-    #     connection.cursor().execute("""
-    #     set pg_trgm.similarity_threshold = 0.63;
-    #     set pg_trgm.word_similarity_threshold = 0.90;
-    #     set pg_trgm.strict_word_similarity_threshold = 0.60;
-    #     """)
+    _ = kwargs
+    if sender.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "select set_config('pg_trgm.word_similarity_threshold', "
+                "%s, false)",
+                [str(settings.APP_TRIGRAM_WORD_SIMILARITY_THRESHOLD)],
+            )
 
     # set statement_timeout = 600000;
 
@@ -35,9 +36,9 @@ class WebConfig(AppConfig):
         from web import topics  # noqa: PLC0415
 
         for topic_key, topic in topics.topics.items():
-            topic[
-                "email"
-            ] = f"{settings.EMAIL_TO_PREFIX}weekly_{topic_key}@discu.eu"
+            topic["email"] = (
+                f"{settings.EMAIL_TO_PREFIX}weekly_{topic_key}@discu.eu"
+            )
             topic["from_email"] = formataddr(
                 (
                     f"{topic['name']} Weekly",
@@ -113,10 +114,14 @@ class WebConfig(AppConfig):
     def __set_up_signals(cls):
         from . import (  # noqa: PLC0415
             mention,
+            statistics,
+            story,
             stripe_util,
         )
 
         _ = mention
+        _ = statistics
+        _ = story
         _ = stripe_util
 
     @override
@@ -0,0 +1,225 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import collections
+import functools
+import importlib
+import logging
+import time
+from collections.abc import Callable
+from typing import Any
+
+from celery import shared_task
+from django.core.cache import cache
+from django_redis import get_redis_connection
+from redis.exceptions import LockError
+
+logger = logging.getLogger(__name__)
+
+metrics_key = "discussions:cache_util:metrics"
+
+__registry: dict[str, "Cached"] = {}
+
+
+def __default_key(*args, **kwargs):
+    values = [*args, *(v for _, v in sorted(kwargs.items()))]
+    return ":".join(str(v).lower().strip() for v in values)
+
+
+class Cached:
+    """Cache the results of a function.
+
+    Entries are fresh for `timeout` seconds. For `stale_timeout` seconds
+    after that the old value is still served while a Celery task
+    recomputes it. Concurrent misses of the same key are coalesced with
+    a Redis lock so that only one caller computes the value, the others
+    wait up to `lock_wait` seconds for it. Values for which `is_empty`
+    returns True are cached only for `empty_timeout` seconds.
+
+    Arguments of the function must be serializable by Celery.
+    """
+
+    def __init__(
+        self,
+        f: Callable,
+        prefix: str,
+        *,
+        timeout: int,
+        stale_timeout: int,
+        empty_timeout: int,
+        is_empty: Callable[[Any], bool] | None,
+        key: Callable[..., str],
+        lock_wait: float,
+    ) -> None:
+        self.f = f
+        self.name = f"{f.__module__}:{f.__qualname__}"
+        self.prefix = prefix
+        self.timeout = timeout
+        self.stale_timeout = stale_timeout
+        self.empty_timeout = empty_timeout
+        self.is_empty = is_empty
+        self.key_suffix = key
+        self.lock_wait = lock_wait
+        _ = functools.update_wrapper(self, f)
+
+    def __call__(self, *args, **kwargs):
+        key = self.key(*args, **kwargs)
+        entry = cache.get(key)
+        if entry is not None:
+            value, event = self.__value(key, entry, args, kwargs)
+            self.__count(event)
+            return value
+
+        lock = cache.lock(
+            key + ":lock",
+            timeout=60,
+            blocking_timeout=self.lock_wait,
+        )
+        try:
+            locked = lock.acquire()
+        except LockError:
+            locked = False
+
+        if not locked:
+            # The value is taking too long, compute it without caching.
+            self.__count("miss")
+            return self.f(*args, **kwargs)
+
+        try:
+            entry = cache.get(key)
+            if entry is not None:
+                self.__count("coalesced")
+                return entry[2]
+
+            self.__count("miss")
+            return self.refresh(*args, **kwargs)
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                logger.debug("cache_util: lock expired: %s", key)
+
+    def key(self, *args, **kwargs):
+        suffix = self.key_suffix(*args, **kwargs)
+        return f"cache_util:{self.prefix}:{suffix}"
+
+    def refresh(self, *args, **kwargs):
+        """Compute and cache the value unconditionally."""
+        value = self.f(*args, **kwargs)
+        self.set(value, *args, **kwargs)
+        return value
+
+    def set(self, value, *args, **kwargs):
+        self.set_many({args: value}, kwargs)
+
+    def set_many(self, values, kwargs=None):
+        """Cache many values at once, values maps args tuples to values."""
+        kwargs = kwargs or {}
+        entries = {}
+        empty_entries = {}
+        now = time.time()
+        for args, value in values.items():
+            key = self.key(*args, **kwargs)
+            if self.is_empty and self.is_empty(value):
+                empty_entries[key] = (now + self.empty_timeout, True, value)
+            else:
+                entries[key] = (now + self.timeout, False, value)
+
+        if entries:
+            _ = cache.set_many(entries, self.timeout + self.stale_timeout)
+        if empty_entries:
+            _ = cache.set_many(empty_entries, self.empty_timeout)
+
+    def get_many(self, args_list, kwargs=None):
+        """Cached values for many calls, as a dict from args tuple to value.
+
+        Calls not in the cache are missing from the result.
+        """
+        kwargs = kwargs or {}
+        keys = {self.key(*args, **kwargs): args for args in args_list}
+        entries = cache.get_many(keys.keys())
+        values = {}
+        events = []
+        for key, args in keys.items():
+            if key in entries:
+                values[args], event = self.__value(
+                    key,
+                    entries[key],
+                    args,
+                    kwargs,
+                )
+                events.append(event)
+            else:
+                events.append("miss")
+        self.__count(*events)
+        return values
+
+    def __value(self, key, entry, args, kwargs):
+        """Value of the cache entry and its event, see __count."""
+        soft_expires_at, empty, value = entry
+        if soft_expires_at > time.time():
+            return value, "empty_hit" if empty else "hit"
+
+        if cache.add(key + ":refresh", 1, timeout=60):
+            try:
+                refresh_cached.delay(self.name, args, kwargs)
+            except Exception:
+                logger.warning("cache_util: refresh failed", exc_info=True)
+        return value, "stale"
+
+    def __count(self, *events):
+        """Add events to the metrics, in a single round trip to Redis."""
+        if not events:
+            return
+        try:
+            r = get_redis_connection("default")
+            with r.pipeline(transaction=False) as pipe:
+                for event, n in collections.Counter(events).items():
+                    _ = pipe.hincrby(metrics_key, f"{self.prefix}:{event}", n)
+                _ = pipe.execute()
+        except Exception:
+            logger.debug("cache_util: metrics failed", exc_info=True)
+
+
+def cached(
+    prefix: str,
+    *,
+    timeout: int = 5 * 60,
+    stale_timeout: int = 10 * 60,
+    empty_timeout: int = 60,
+    is_empty: Callable[[Any], bool] | None = None,
+    key: Callable[..., str] = __default_key,
+    lock_wait: float = 5,
+) -> Callable[[Callable], Cached]:
+    """Decorator, see Cached."""
+
+    def decorator(f):
+        c = Cached(
+            f,
+            prefix,
+            timeout=timeout,
+            stale_timeout=stale_timeout,
+            empty_timeout=empty_timeout,
+            is_empty=is_empty,
+            key=key,
+            lock_wait=lock_wait,
+        )
+        __registry[c.name] = c
+        return c
+
+    return decorator
+
+
+def metrics() -> dict[str, int]:
+    """Hit/miss counters by key prefix and event."""
+    r = get_redis_connection("default")
+    return {k.decode(): int(v) for k, v in r.hgetall(metrics_key).items()}
+
+
+@shared_task(ignore_result=True)
+def refresh_cached(name, args, kwargs):
+    module, _, _ = name.partition(":")
+    _ = importlib.import_module(module)
+    c = __registry.get(name)
+    if c is None:
+        logger.warning(f"cache_util: unknown function {name}")
+        return
+    _ = c.refresh(*args, **kwargs)
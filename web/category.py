@@ -76,12 +76,34 @@ class Category(IntegerChoices):
             path = (u.path or "").strip()
             host = (u.host or "").strip()
 
-        path_components = [p for p in path.split("/") if p]
-
         title = title or ""
         tags = set(normalize_tags(story_tags, platform, title, url))
         title_tokens = normalize_title(title, platform, url, tags).split()
 
+        return cls.from_normalized(
+            title,
+            url,
+            host,
+            path,
+            title_tokens,
+            tags,
+            platform,
+        )
+
+    @classmethod
+    def from_normalized(
+        cls,
+        title: str,
+        url: str,
+        host: str,
+        path: str,
+        title_tokens: list[str],
+        tags: set[str],
+        platform: Platform,
+    ) -> Self:
+        """Like derive, with the URL parsed and tags and title normalized."""
+        path_components = [p for p in path.split("/") if p]
+
         for f in derive_functions:
             cat = f(platform, title_tokens, host, path_components, tags)
             if cat:
@@ -1,5 +1,9 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import collections
+import concurrent.futures
 import datetime
+import heapq
+import itertools
 import logging
 import time
 from enum import Enum
@@ -7,18 +11,21 @@ from functools import total_ordering
 from http import HTTPStatus
 from typing import Self
 
+import celery
 import cleanurl
 import urllib3
 from celery import shared_task
+from django.db import connection, transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.utils import timezone
 from django_redis import get_redis_connection
+from typing_extensions import override
 
-from discussions.settings import APP_CELERY_TASK_MAX_TIME
+from discussions import settings
 from web import celery_util
 
-from . import extract, http, models, tags, title
+from . import extract, http, ingest, models, tags, title, worker
 
 logger = logging.getLogger(__name__)
 
@@ -53,6 +60,154 @@ queue_names = {
 }
 
 redis_host_semaphore = redis_prefix + "semaphore:host"
+redis_stats = redis_prefix + "stats"
+
+# URL -> time after which the URL can be queued again.
+redis_seen = redis_prefix + "seen"
+# URL -> priority of the URLs waiting in the queues.
+redis_queued = redis_prefix + "queued"
+
+# same as the one week in fetch
+refetch_after = 7 * 24 * 60 * 60
+# queued URLs that got lost can be queued again after this
+queued_ttl = 24 * 60 * 60
+# popped URLs whose fetch got lost can be queued again after this, see
+# _mark_fetched
+in_flight_ttl = 60 * 60
+# superseded queue entries dropped by a single _pop at most
+max_skipped = 1000
+
+# KEYS: seen, queued, queues ordered by priority
+# ARGV: url, priority, now, queued_ttl
+__enqueue_script = """
+local url = ARGV[1]
+local priority = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+
+local expires_at = redis.call('ZSCORE', KEYS[1], url)
+if expires_at and tonumber(expires_at) > now then
+    local queued = redis.call('HGET', KEYS[2], url)
+    if not queued or priority >= tonumber(queued) then
+        return 0
+    end
+else
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[4]), url)
+end
+
+redis.call('HSET', KEYS[2], url, priority)
+redis.call('RPUSH', KEYS[3 + priority], url)
+return 1
+"""
+
+# KEYS: seen, queued, queues ordered by priority
+# ARGV: count, now, in_flight_ttl, max_skipped
+# Returns url1, priority1, url2, priority2...
+__pop_script = """
+local count = tonumber(ARGV[1])
+local now = tonumber(ARGV[2])
+local skipped = tonumber(ARGV[4])
+local result = {}
+
+for i = 3, #KEYS do
+    local priority = i - 3
+    while count > 0 and skipped > 0 do
+        local url = redis.call('LPOP', KEYS[i])
+        if not url then
+            break
+        end
+
+        local queued = redis.call('HGET', KEYS[2], url)
+        local take = false
+        if queued then
+            -- otherwise it was promoted to a higher priority queue
+            take = tonumber(queued) == priority
+        else
+            -- URLs queued before the dedup filter existed
+            local expires_at = redis.call('ZSCORE', KEYS[1], url)
+            take = not expires_at or tonumber(expires_at) <= now
+        end
+
+        if take then
+            redis.call('HDEL', KEYS[2], url)
+            redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), url)
+            table.insert(result, url)
+            table.insert(result, priority)
+            count = count - 1
+        else
+            skipped = skipped - 1
+        end
+    end
+end
+
+return result
+"""
+
+
+def __queue_keys():
+    return [
+        redis_seen,
+        redis_queued,
+        *(n for _, n in sorted(queue_names.items())),
+    ]
+
+
+def _enqueue(r, url, priority=Priority.normal):
+    """Queue url unless it is already queued or was recently fetched.
+
+    If url is already queued with a lower priority it is promoted.
+    r can be a pipeline.
+    """
+    script = get_redis_connection().register_script(__enqueue_script)
+    return script(
+        keys=__queue_keys(),
+        args=[url, priority.value, int(time.time()), queued_ttl],
+        client=r,
+    )
+
+
+def _pop(r, count):
+    """Pop up to count URLs from the queues, highest priority first.
+
+    The URLs are seen for in_flight_ttl seconds, call _mark_fetched once
+    they are fetched. At most max_skipped superseded entries are
+    dropped, so fewer than count URLs can be returned even if the queues
+    are not empty.
+    """
+    script = r.register_script(__pop_script)
+    result = script(
+        keys=__queue_keys(),
+        args=[count, int(time.time()), in_flight_ttl, max_skipped],
+    )
+    return [
+        (str(url, "utf-8"), Priority(int(p)))
+        for url, p in zip(result[0::2], result[1::2], strict=True)
+    ]
+
+
+def _requeue(r, urls, *, head=True):
+    """Put URLs popped but not fetched back in the queues.
+
+    They go back at the head of the queues, or at the tail if head is
+    False.
+    """
+    expires_at = int(time.time()) + queued_ttl
+    with r.pipeline(transaction=False) as pipe:
+        for url, priority in reversed(urls) if head else urls:
+            pipe.zadd(redis_seen, {url: expires_at})
+            pipe.hset(redis_queued, url, priority.value)
+            if head:
+                pipe.lpush(queue_names[priority], url)
+            else:
+                pipe.rpush(queue_names[priority], url)
+        _ = pipe.execute()
+
+
+def _mark_fetched(r, urls):
+    """Don't queue the fetched URLs again for refetch_after seconds."""
+    if not urls:
+        return
+    expires_at = int(time.time()) + refetch_after
+    _ = r.zadd(redis_seen, dict.fromkeys(urls, expires_at))
 
 
 @shared_task(ignore_result=True)
@@ -63,29 +218,10 @@ def add_to_queue(
     if not url:
         return
     r = get_redis_connection()
-    r.rpush(queue_names.get(priority), url)
-
-
-def sempaphore_green(url):
-    try:
-        u = urllib3.util.parse_url(url)
-    except ValueError:
-        u = None
-
-    if not u or not u.host:
-        logger.debug(f"get_semaphore: parse error: {url}: {u}")
-        return True
-
-    r = get_redis_connection()
-
-    s = r.get(redis_host_semaphore + ":" + u.host)
-    if s:
-        return False
+    _ = _enqueue(r, url, priority)
 
-    return True
 
-
-def __set_semaphore(url: str, timeout: int = 60) -> None:
+def _set_semaphore(url: str, timeout: int = 60) -> None:
     try:
         u = urllib3.util.parse_url(url)
     except ValueError:
@@ -154,22 +290,8 @@ def fetch(url):
     return resource
 
 
-def process_next() -> bool:
-    r = get_redis_connection()
-    priority = Priority.normal
-    url = None
-    for p, n in sorted(queue_names.items()):
-        url = r.lpop(n)
-        if url:
-            priority = p
-            break
-
-    if not url:
-        logger.debug("process_next: no url from queue")
-        return True
-
-    url = str(url, "utf-8")
-
+def _host(url: str) -> str | None:
+    """Host of url or None if the URL must not be crawled."""
     if url.startswith(
         (
             "https://streamja.com",
@@ -177,63 +299,300 @@ def process_next() -> bool:
             "https://www.reddit.com/r/",
         ),
     ):
-        return False
+        return None
+
+    try:
+        u = urllib3.util.parse_url(url)
+    except ValueError:
+        logger.warning("crawler:  failed to parse url: %s", url, exc_info=True)
+        return None
 
-    if not sempaphore_green(url):
-        logger.debug(f"process_next: semaphore red: {url}")
-        if priority <= Priority.medium:
-            priority = priority.lower()
-        add_to_queue(url, priority=priority)
-        return False
+    if u.scheme not in {"http", "https"}:
+        logger.warning("crawler: scheme not processed: %s", url)
+        return None
+
+    return u.host or None
 
-    timeout = 15
 
+def _politeness_timeout(url: str) -> int:
+    """Seconds to wait before fetching again from the host of url."""
     if url.startswith("https://github.com"):
-        timeout = 3
+        return 3
 
     if url.startswith(("https://twitter.com", "https://www.twitter.com")):
-        timeout = 3
+        return 3
+
+    return 15
 
+
+def _fetch(url: str) -> None:
     try:
-        u = urllib3.util.parse_url(url)
-        if u.scheme not in {"http", "https"}:
-            logger.warning("crawler: scheme not processed: %s", url)
-            return False
-    except ValueError:
-        logger.warning("crawler:  failed to parse url: %s", url, exc_info=True)
-        return False
+        _ = fetch(url)
+    finally:
+        # return the connection of this thread to the pool
+        connection.close()
+
+
+class Engine:
+    """Fetch the queued URLs with a pool of threads.
+
+    URLs are moved from the Redis queues to a queue per host. A heap
+    orders the hosts by the time they can be fetched from again, so a
+    slow or busy host only delays its own URLs. A host queue holds at
+    most max_backlog // workers URLs, so that a few hosts with many
+    queued URLs can't fill the backlog, their other URLs are left in
+    Redis.
+    """
+
+    report_interval = 60  # seconds
+    # wait between fills that left URLs in Redis
+    refill_interval = 10  # seconds
+
+    def __init__(
+        self,
+        workers: int,
+        max_backlog: int | None = None,
+    ) -> None:
+        self.workers = workers
+        self.max_backlog = max_backlog or workers * 100
+        self.max_per_host = max(1, self.max_backlog // workers)
+        self.fill_after = 0.0
+        # host -> heap of (priority, sequence, url)
+        self.hosts: dict[str, list[tuple[int, int, str]]] = {}
+        # heap of (ready at, host), a host is in it at most once
+        self.ready: list[tuple[float, str]] = []
+        self.scheduled: set[str] = set()
+        self.busy: set[str] = set()
+        self.backlog = 0
+        self.sequence = itertools.count()
+        self.fetched = 0
+        self.started_at = time.monotonic()
+
+    @override
+    def __str__(self) -> str:
+        return (
+            f"crawler engine: {self.fetched} fetched, "
+            f"{self.backlog} queued in {len(self.hosts)} hosts"
+        )
 
-    __set_semaphore(url, timeout=timeout)
+    def add(self, url: str, priority: Priority = Priority.normal) -> None:
+        host = _host(url)
+        if not host:
+            return
+
+        queue = self.hosts.setdefault(host, [])
+        heapq.heappush(queue, (priority.value, next(self.sequence), url))
+        self.backlog += 1
+        self.__schedule(host, time.monotonic())
+
+    def __schedule(self, host, ready_at):
+        if host in self.scheduled or host in self.busy:
+            return
+        if not self.hosts.get(host):
+            return
+        heapq.heappush(self.ready, (ready_at, host))
+        self.scheduled.add(host)
+
+    def __fill(self, r):
+        """Move URLs from the Redis queues to the host queues."""
+        count = self.max_backlog - self.backlog
+        if count <= 0 or time.monotonic() < self.fill_after:
+            return
+
+        full = []
+        for url, priority in _pop(r, count):
+            host = _host(url)
+            if host and len(self.hosts.get(host, ())) >= self.max_per_host:
+                full.append((url, priority))
+            else:
+                self.add(url, priority)
+
+        if full:
+            # behind the URLs of the other hosts
+            _requeue(r, full, head=False)
+            self.fill_after = time.monotonic() + self.refill_interval
+
+    def __next(self, r, now):
+        """Pop a URL of a host that is ready, None if there is none."""
+        while self.ready and self.ready[0][0] <= now:
+            _, host = heapq.heappop(self.ready)
+            self.scheduled.discard(host)
+
+            ttl = r.ttl(redis_host_semaphore + ":" + host)
+            if ttl > 0:
+                # some other crawler is fetching from this host
+                self.__schedule(host, now + ttl)
+                continue
+
+            queue = self.hosts[host]
+            _, _, url = heapq.heappop(queue)
+            if not queue:
+                del self.hosts[host]
+            self.backlog -= 1
+            return host, url
 
-    _ = fetch(url)
+        return None
 
-    return False
+    def __requeue(self, r):
+        """Give the URLs not fetched back to the Redis queues."""
+        urls = sorted(u for queue in self.hosts.values() for u in queue)
+        _requeue(r, [(url, Priority(p)) for p, _, url in urls])
+        self.hosts = {}
+        self.ready = []
+        self.scheduled = set()
+        self.backlog = 0
+
+    def stats(self, r):
+        elapsed = max(time.monotonic() - self.started_at, 1)
+        stats = {
+            "fetched": self.fetched,
+            "fetches_per_second": round(self.fetched / elapsed, 2),
+            "backlog": self.backlog,
+            "hosts": len(self.hosts),
+        }
+        for priority, name in queue_names.items():
+            stats[f"queue:{priority.name}"] = r.llen(name)
+        stats["seen"] = r.zcard(redis_seen)
+        stats["queued"] = r.hlen(redis_queued)
+
+        largest = sorted(
+            self.hosts.items(),
+            key=lambda hq: len(hq[1]),
+            reverse=True,
+        )
+        for host, queue in largest[:10]:
+            stats[f"host:{host}"] = len(queue)
+
+        return stats
+
+    def __report(self, r):
+        _ = r.zremrangebyscore(redis_seen, "-inf", int(time.time()))
+        stats = self.stats(r)
+        with r.pipeline() as pipe:
+            pipe.delete(redis_stats)
+            pipe.hset(redis_stats, mapping=stats)
+            _ = pipe.execute()
+        logger.info(f"{self}: {stats}")
+
+    def run(self, task: celery.Task, deadline: float) -> None:
+        """Crawl until the monotonic deadline or a graceful exit."""
+        r = get_redis_connection()
+        in_flight = {}
+        last_report = time.monotonic()
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix="crawler",
+        ) as executor:
+            while time.monotonic() < deadline:
+                if self.backlog < self.max_backlog // 2:
+                    self.__fill(r)
+
+                now = time.monotonic()
+                while len(in_flight) < self.workers:
+                    n = self.__next(r, now)
+                    if n is None:
+                        break
+                    host, url = n
+                    timeout = _politeness_timeout(url)
+                    _set_semaphore(url, timeout=timeout)
+                    self.busy.add(host)
+                    f = executor.submit(_fetch, url)
+                    in_flight[f] = (host, url, now + timeout)
+
+                wait = 1.0
+                if self.ready:
+                    wait = min(wait, max(self.ready[0][0] - now, 0.01))
+
+                if in_flight:
+                    done, _ = concurrent.futures.wait(
+                        in_flight,
+                        timeout=wait,
+                        return_when=concurrent.futures.FIRST_COMPLETED,
+                    )
+                else:
+                    done = set()
+                    time.sleep(wait)
+
+                for f in done:
+                    host, url, ready_at = in_flight.pop(f)
+                    self.busy.discard(host)
+                    self.fetched += 1
+                    # failed fetches too, they wait like the others
+                    _mark_fetched(r, [url])
+                    if f.exception():
+                        logger.warning(
+                            "crawler: fetch failed: %s",
+                            url,
+                            exc_info=f.exception(),
+                        )
+                    self.__schedule(host, ready_at)
+
+                if time.monotonic() > last_report + self.report_interval:
+                    self.__report(r)
+                    last_report = time.monotonic()
+                    if worker.graceful_exit(task):
+                        logger.info("crawler: graceful exit")
+                        break
+
+        # leaving the executor waits for the fetches still in flight
+        self.fetched += len(in_flight)
+        _mark_fetched(r, [url for _, url, _ in in_flight.values()])
+
+        self.__requeue(r)
+        self.__report(r)
+
+
+def stats() -> dict[str, str]:
+    """Statistics of the last crawler run."""
+    r = get_redis_connection()
+    return {
+        str(k, "utf-8"): str(v, "utf-8")
+        for k, v in r.hgetall(redis_stats).items()
+    }
 
 
-@shared_task(ignore_result=True)
-def process():
-    start_time = time.monotonic()
+@shared_task(bind=True, ignore_result=True)
+def process(self):
+    if celery_util.task_is_running(self.request.task, [self.request.id]):
+        return
 
-    while time.monotonic() - start_time <= APP_CELERY_TASK_MAX_TIME:
-        stop = process_next()
-        if stop:
-            break
+    engine = Engine(settings.APP_CRAWLER_WORKERS)
+    engine.run(self, time.monotonic() + settings.APP_CRAWLER_RUN_TIME)
+
+
+def __discussion_priority(discussion):
+    priority = Priority.normal
+    days_ago = timezone.now() - datetime.timedelta(days=14)
+    one_year_ago = timezone.now() - datetime.timedelta(days=365)
+    if discussion.created_at:
+        if discussion.created_at < one_year_ago:
+            priority = Priority.low
+        elif discussion.created_at < days_ago:
+            priority = Priority.medium
+
+    return priority
 
 
 @receiver(post_save, sender=models.Discussion)
 def process_discussion(sender, instance, created, **kwargs):
     _ = (sender, kwargs)
     if created and instance.story_url:
-        priority = Priority.normal
-        days_ago = timezone.now() - datetime.timedelta(days=14)
-        one_year_ago = timezone.now() - datetime.timedelta(days=365)
-        if instance.created_at:
-            if instance.created_at < one_year_ago:
-                priority = Priority.low
-            elif instance.created_at < days_ago:
-                priority = Priority.medium
+        add_to_queue(
+            instance.story_url,
+            priority=__discussion_priority(instance),
+        )
+
 
-        add_to_queue(instance.story_url, priority=priority)
+@receiver(ingest.discussions_saved)
+def process_discussions(sender, discussions, created, **kwargs):
+    _ = (sender, discussions, kwargs)
+    r = get_redis_connection()
+    with r.pipeline(transaction=False) as pipe:
+        for d in created:
+            if d.story_url:
+                _ = _enqueue(pipe, d.story_url, __discussion_priority(d))
+        _ = pipe.execute()
 
 
 @shared_task(bind=True, ignore_result=True)
@@ -253,6 +612,73 @@ def populate_queue(self, comment_count=10, score=10, days=3):
         add_to_queue(d.story_url, priority=Priority.low)
 
 
+def __anchor_attribute(value):
+    # same conversion as saving a list (like rel) in a TextField
+    return str(value or "")
+
+
+def save_links(resource, outbound_links):
+    """Make the Link rows of resource match its outbound links.
+
+    All the links are resolved with a single query and only the links
+    added or removed since the last extraction are written.
+    """
+    hrefs = {link.get("href") for link in outbound_links} - {None, ""}
+    # TODO: ignore relative and #id urls
+    # xojoc: todo: call add_to_queue for unknown URLs? so next time the
+    # relationship is created?
+    to_by_url = models.Resource.by_urls(hrefs)
+
+    wanted = collections.Counter()
+    for link in outbound_links:
+        to = to_by_url.get(link.get("href"))
+        if not to or to.pk == resource.pk:
+            continue
+
+        key = (
+            to.pk,
+            __anchor_attribute(link.get("title")),
+            __anchor_attribute(link.text),
+            __anchor_attribute(link.get("rel")),
+        )
+        wanted[key] += 1
+
+    removed = []
+    existing = models.Link.objects.filter(from_resource=resource).values_list(
+        "pk",
+        "to_resource_id",
+        "anchor_title",
+        "anchor_text",
+        "anchor_rel",
+    )
+    for pk, *fields in existing:
+        key = tuple(fields)
+        if wanted[key] > 0:
+            wanted[key] -= 1
+        else:
+            removed.append(pk)
+
+    added = [
+        models.Link(
+            from_resource=resource,
+            to_resource_id=to_pk,
+            anchor_title=anchor_title,
+            anchor_text=anchor_text,
+            anchor_rel=anchor_rel,
+        )
+        for (to_pk, anchor_title, anchor_text, anchor_rel), count in (
+            wanted.items()
+        )
+        for _ in range(count)
+    ]
+
+    with transaction.atomic():
+        if removed:
+            _ = models.Link.objects.filter(pk__in=removed).delete()
+        if added:
+            _ = models.Link.objects.bulk_create(added)
+
+
 @shared_task(ignore_result=True)
 def extract_html(resource):
     if isinstance(resource, int):
@@ -284,34 +710,7 @@ def extract_html(resource):
     html_structure = extract.structure(html, resource.story_url)
     resource.title = html_structure.title
 
-    resource.links.clear()
-    for link in html_structure.outbound_links:
-        href = link.get("href")
-        if not href:
-            continue
-
-        # TODO: ignore relative and #id urls
-
-        to = models.Resource.by_url(href)
-        if not to:
-            # xojoc: todo: call add_to_queue? so next time the relationship is created?
-            continue
-
-        if to.pk == resource.pk:
-            continue
-
-        anchor_title = link.get("title")
-        anchor_text = link.text
-        anchor_rel = link.get("rel")
-
-        link_db = models.Link(
-            from_resource=resource,
-            to_resource=to,
-            anchor_title=anchor_title,
-            anchor_text=anchor_text,
-            anchor_rel=anchor_rel,
-        )
-        link_db.save()
+    save_links(resource, html_structure.outbound_links)
 
     resource.normalized_title = title.normalize(resource.title)
     resource.normalized_tags = tags.normalize(
@@ -320,3 +719,16 @@ def extract_html(resource):
     )
 
     resource.save()
+
+
+@shared_task(bind=True, ignore_result=True)
+def train_content_dictionary(self):
+    """New zstd dictionary for the contents saved from now on."""
+    if celery_util.task_is_running(self.request.task, [self.request.id]):
+        return
+
+    d = models.ZstdDictionary.train()
+    if d is None:
+        logger.info("crawler: not enough contents for a zstd dictionary")
+        return
+    logger.info(f"crawler: trained zstd dictionary {d}")
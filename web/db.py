@@ -1,18 +1,25 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import collections
+import copy
 import datetime
+import itertools
 import logging
 import random
 import time
 
 from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 
 from web import (
     celery_util,
     crawler,
     email_util,
+    ingest,
     mastodon_api,
     models,
+    normalize,
     rank,
     topics,
     twitter_api,
@@ -22,83 +29,178 @@ from web import (
 logger = logging.getLogger(__name__)
 
 
+# Fields set by Discussion.pre_save
+__RENORMALIZED_FIELDS = (
+    "title",
+    "_platform",
+    "tags",
+    "scheme_of_story_url",
+    "schemeless_story_url",
+    "canonical_story_url",
+    "canonical_redirect_url",
+    "url_key",
+    "schemeless_url_key",
+    "normalized_title",
+    "normalized_tags",
+    "_category",
+)
+
+__renormalize_checkpoint_key = "discussions:db:renormalize:last_pk"
+__renormalize_done_key = "discussions:db:renormalize:done"
+
+
+def __renormalize_chunk(discussions):
+    """Run pre_save in a worker process.
+
+    Return the discussions whose normalized fields changed, the same
+    discussions as they were before pre_save and the primary keys of the
+    ones that only need the new version stamp.
+    """
+    dirty = []
+    previous = []
+    clean = []
+    for d in discussions:
+        before = copy.copy(d)
+        d.pre_save()
+        if any(
+            getattr(before, f) != getattr(d, f) for f in __RENORMALIZED_FIELDS
+        ):
+            dirty.append(d)
+            previous.append(before)
+        else:
+            clean.append(d.pk)
+    return dirty, previous, clean
+
+
+def __renormalize_chunks(last_pk, chunk_size):
+    while True:
+        chunk = list(
+            models.Discussion.objects.filter(pk__gt=last_pk)
+            .exclude(normalizer_version=normalize.VERSION)
+            .order_by("pk")[:chunk_size],
+        )
+        if not chunk:
+            return
+        last_pk = chunk[-1].pk
+        yield last_pk, chunk
+
+
+def __queue_missing_resources(discussions):
+    urls = {d.story_url for d in discussions if d.story_url}
+    if not urls:
+        return
+    resources = models.Resource.by_urls(urls)
+    for url in urls - resources.keys():
+        crawler.add_to_queue(url, crawler.Priority.very_low)
+
+
+def __save_renormalized(dirty, previous, clean):
+    """Write the results of __renormalize_chunk."""
+    # entry_updated_at is the watermark of the statistics rollups
+    now = timezone.now()
+    for d in dirty:
+        d.entry_updated_at = now
+    _ = models.Discussion.objects.bulk_update(
+        dirty,
+        [
+            *__RENORMALIZED_FIELDS,
+            "normalizer_version",
+            "entry_updated_at",
+        ],
+    )
+    _ = models.Discussion.objects.filter(pk__in=clean).update(
+        normalizer_version=normalize.VERSION,
+    )
+    # stories, topic weeks, etc. of the discussions, before and after
+    _ = ingest.discussions_saved.send(
+        sender=models.Discussion,
+        discussions=dirty,
+        created=[],
+        previous_urls={d.canonical_story_url for d in previous},
+        previous=previous,
+    )
+    __queue_missing_resources(dirty)
+
+
 @shared_task(bind=True, ignore_result=True)
 def worker_update_discussions(self):
+    """Renormalize the discussions stamped with an old normalize.VERSION.
+
+    Rows are read in primary key order and normalized in parallel by
+    APP_RENORMALIZE_WORKERS processes. The last primary key written is
+    checkpointed, so that after a graceful exit the next run resumes
+    from there.
+    """
     time.sleep(random.randint(10, 30))  # noqa: S311
     if celery_util.task_is_running(self.request.task, [self.request.id]):
         return
-    start_time = time.monotonic()
-    count_dirty = 0
-    count_dirty_resource = 0
-    seven_days_ago = timezone.now() - datetime.timedelta(days=7)
-    stories = models.Discussion.objects.filter(
-        entry_updated_at__lte=seven_days_ago,
-    ).order_by()
 
-    logger.info(f"db update discussions START: count {stories.count()}")
-
-    dirty_stories = []
-
-    def __update(dirty_stories):
-        updated_count = models.Discussion.objects.bulk_update(
-            dirty_stories,
-            ["canonical_story_url", "normalized_tags", "normalized_title"],
-        )
-        logger.info(f"db update discussions: updated: {updated_count}")
-        dirty_stories[:] = []
+    if cache.get(__renormalize_done_key) == normalize.VERSION:
+        return
 
-    last_checkpoint = time.monotonic()
+    start_time = time.monotonic()
+    workers = settings.APP_RENORMALIZE_WORKERS
+    chunk_size = 1000
+    count_dirty = 0
+    count_clean = 0
+    last_pk = ""
+    checkpoint = cache.get(__renormalize_checkpoint_key)
+    if checkpoint and checkpoint[0] == normalize.VERSION:
+        last_pk = checkpoint[1]
 
-    for story in stories.iterator(chunk_size=10_000):
-        dirty = False
+    logger.info(
+        "db update discussions START: version %s from %r",
+        normalize.VERSION,
+        last_pk,
+    )
 
-        if story.story_url:
-            resource = models.Resource.by_url(story.story_url)
-            if resource is None:
-                crawler.add_to_queue(
-                    story.story_url,
-                    crawler.Priority.very_low,
+    with worker.process_pool(workers) as executor:
+        chunks = __renormalize_chunks(last_pk, chunk_size)
+        pending = collections.deque()
+        completed = True
+
+        while True:
+            for end, chunk in itertools.islice(
+                chunks,
+                workers * 2 - len(pending),
+            ):
+                pending.append(
+                    (end, executor.submit(__renormalize_chunk, chunk)),
                 )
 
-        canonical_story_url = story.canonical_story_url
-        normalized_title = story.normalized_title
-        normalized_tags = story.normalized_tags
-        category = story.category
-
-        story.pre_save()
-
-        if (
-            story.canonical_story_url != canonical_story_url
-            or story.normalized_title != normalized_title
-            or story.normalized_tags != normalized_tags
-            or story.category != category
-        ):
-            dirty = True
+            if not pending:
+                break
 
-        if dirty:
-            count_dirty += 1
-            dirty_stories.append(story)
+            # keep the order so the checkpoint only moves forward
+            end, future = pending.popleft()
+            dirty, previous, clean = future.result()
 
-        batch_size = 1000
+            __save_renormalized(dirty, previous, clean)
 
-        if len(dirty_stories) >= batch_size:
-            __update(dirty_stories)
+            count_dirty += len(dirty)
+            count_clean += len(clean)
+            cache.set(
+                __renormalize_checkpoint_key,
+                (normalize.VERSION, end),
+                timeout=None,
+            )
 
-        if time.monotonic() > last_checkpoint + 60:
             if worker.graceful_exit(self):
-                logger.info("update discussions: graceful exit")
+                logger.info("update discussions: graceful exit at %r", end)
+                for _, future in pending:
+                    _ = future.cancel()
+                completed = False
                 break
 
-            last_checkpoint = time.monotonic()
-
-    if len(dirty_stories) > 0:
-        __update(dirty_stories)
+    if completed:
+        cache.set(__renormalize_done_key, normalize.VERSION, timeout=None)
 
-    logger.info(f"db update discussions: total dirty: {count_dirty}")
     logger.info(
-        f"db update discussions: total resource dirty: {count_dirty_resource}",
+        "db update discussions END: dirty %s, clean %s in %.1fs",
+        count_dirty,
+        count_clean,
+        time.monotonic() - start_time,
     )
-    logger.info(f"db update discussions END: {time.monotonic() - start_time}")
 
 
 @shared_task(bind=True, ignore_result=True)
@@ -109,9 +211,11 @@ def worker_update_resources(self):
     last_checkpoint = time.monotonic()
 
     seven_days_ago = timezone.now() - datetime.timedelta(days=7)
-    resources = models.Resource.objects.filter(
-        last_processed__lte=seven_days_ago,
-    ).order_by()
+    resources = (
+        models.Resource.objects.filter(last_processed__lte=seven_days_ago)
+        .select_related("content")
+        .order_by()
+    )
 
     logger.info(f"db update resources START: count {resources.count()}")
 
@@ -130,33 +234,19 @@ def worker_update_resources(self):
 
 @shared_task(ignore_result=True)
 def update_pagerank():
-    g = rank.links_to_graph()
-    pagerank = rank.pagerank(g)
-
-    total_updated_count = 0
-    resources = []
-
-    def __update(resources):
-        if not resources:
-            return
-        updated_count = models.Resource.objects.bulk_update(
-            resources,
-            ["pagerank"],
-        )
-        nonlocal total_updated_count
-        total_updated_count += updated_count
-        resources[:] = []
-
-    for pk, pr in pagerank.items():
-        resources.append(models.Resource(pk=pk, pagerank=pr))
-
-        batch_size = 2000
-        if len(resources) >= batch_size:
-            __update(resources)
+    start_time = time.monotonic()
 
-    __update(resources)
+    src, dst = rank.links_to_arrays()
+    nodes, src, dst = rank.compact(src, dst)
+    x0 = rank.previous_pagerank(nodes)
+    scores, iterations = rank.pagerank_csr(len(nodes), src, dst, x0=x0)
+    updated_count = rank.write_pagerank(nodes, scores)
 
-    logger.info(f"update_pagerank: updated: {total_updated_count}")
+    logger.info(
+        f"update_pagerank: {len(nodes)} resources, {len(src)} links, "
+        f"{iterations} iterations, updated: {updated_count}, "
+        f"{time.monotonic() - start_time:.1f}s",
+    )
 
 
 @shared_task(ignore_result=True)
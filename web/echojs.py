@@ -10,12 +10,26 @@ from django.core.cache import cache
 
 from web.platform import Platform
 
-from . import celery_util, http, models, worker
+from . import celery_util, http, ingest, models, worker
 
 logger = logging.getLogger(__name__)
 
-
-def __process_item(item: dict[str, str | int], platform: Platform) -> None:
+# Echo JS has no tags, keep the stored ones
+__update_fields = ingest.update_fields(
+    "created_at",
+    "scheme_of_story_url",
+    "schemeless_story_url",
+    "title",
+    "comment_count",
+    "score",
+)
+
+
+def __process_item(
+    item: dict[str, str | int],
+    platform: Platform,
+    batch: ingest.DiscussionBatch,
+) -> None:
     platform_id = f"{platform.value}{item.get('id')}"
 
     if item.get("ctime"):
@@ -43,16 +57,16 @@ def __process_item(item: dict[str, str | int], platform: Platform) -> None:
 
     score = int(item.get("up", 0)) - int(item.get("down", 0))
 
-    _ = models.Discussion.objects.update_or_create(
-        pk=platform_id,
-        defaults={
-            "comment_count": int(item.get("comments", 0)),
-            "score": score,
-            "created_at": created_at,
-            "scheme_of_story_url": scheme,
-            "schemeless_story_url": url,
-            "title": item.get("title"),
-        },
+    batch.add(
+        models.Discussion(
+            platform_id=platform_id,
+            comment_count=int(item.get("comments", 0)),
+            score=score,
+            created_at=created_at,
+            scheme_of_story_url=scheme,
+            schemeless_story_url=url,
+            title=item.get("title"),
+        ),
     )
 
 
@@ -93,8 +107,9 @@ def __worker_fetch(task: celery.Task, platform: Platform) -> None:
                 current_index = 0
                 break
 
-            for item in j.get("news"):
-                __process_item(item, platform)
+            with ingest.DiscussionBatch(__update_fields) as batch:
+                for item in j.get("news"):
+                    __process_item(item, platform, batch)
 
             time.sleep(10)
 
@@ -1,14 +1,120 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
 import logging
+import time
 
 from celery import shared_task
 from django.conf import settings
-from django.core.mail import send_mail as django_send_mail
+from django.core.mail import (
+    EmailMessage,
+    get_connection,
+    send_mail as django_send_mail,
+)
+from django_redis import get_redis_connection
 
 from . import util
 
 logger = logging.getLogger(__name__)
 
+redis_rate_bucket = "discussions:email_util:rate_bucket"
+
+# KEYS: bucket
+# ARGV: rate per second, burst
+# The time of the Redis server is used, the clocks of the workers can
+# differ.
+__rate_bucket_script = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call("TIME")
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "updated_at")
+local tokens = tonumber(bucket[1]) or burst
+local updated_at = tonumber(bucket[2]) or now
+
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "updated_at", tostring(now))
+redis.call("EXPIRE", KEYS[1], math.ceil(burst / rate) + 1)
+
+return tostring(wait)
+"""
+
+
+def _take_token(rate: float, burst: int) -> float:
+    """Take a token from the global email budget.
+
+    Return 0 if the token was taken, otherwise the seconds to wait
+    before trying again.
+    """
+    r = get_redis_connection()
+    script = r.register_script(__rate_bucket_script)
+    wait = script(keys=[redis_rate_bucket], args=[rate, burst])
+    return float(wait)
+
+
+class Sender:
+    """Send many emails through a single SMTP connection.
+
+    Sending is throttled by a token bucket shared by all the workers,
+    see settings.APP_EMAIL_RATE.
+    """
+
+    def __init__(self) -> None:
+        self.connection = get_connection()
+
+    def __enter__(self):
+        _ = self.connection.open()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _ = (exc_type, exc_value, traceback)
+        self.connection.close()
+
+    def send_message(self, message: EmailMessage) -> None:
+        """Send message when the rate budget allows it.
+
+        Errors are raised, the connection is reopened by the next send.
+        """
+        while wait := _take_token(
+            settings.APP_EMAIL_RATE,
+            settings.APP_EMAIL_BURST,
+        ):
+            time.sleep(wait)
+
+        _ = self.connection.open()
+        message.connection = self.connection
+        try:
+            _ = message.send()
+        except Exception:
+            self.connection.close()
+            raise
+
+    def send(
+        self,
+        subject: str,
+        body: str,
+        from_email: str,
+        to_emails: list[str],
+    ) -> bool:
+        """Send an email, return False if it could not be sent."""
+        if util.is_dev():
+            subject = "[DEV] " + subject
+
+        message = EmailMessage(subject, body, from_email, to_emails)
+        try:
+            self.send_message(message)
+        except Exception:
+            logger.warning(f"email: send failed: {to_emails}", exc_info=True)
+            return False
+        return True
+
 
 @shared_task(
     ignore_result=True,
@@ -1,21 +1,43 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import asyncio
 import datetime
+import itertools
 import logging
 import os
 import time
 
 import cleanurl
-import requests
+import httpx
+from asgiref.sync import sync_to_async
 from celery import shared_task
+from django.conf import settings
 from django.core.cache import cache
 from django.db.models import Q
 from django.utils import timezone
 from django_redis import get_redis_connection
 
-from web import archiveis, celery_util, http, models, util, worker
+from web import (
+    archiveis,
+    celery_util,
+    http,
+    ingest,
+    models,
+    util,
+    worker,
+)
 
 logger = logging.getLogger(__name__)
 
+__update_fields = ingest.update_fields(
+    "created_at",
+    "scheme_of_story_url",
+    "schemeless_story_url",
+    "title",
+    "comment_count",
+    "score",
+    "tags",
+)
+
 cache_prefix = "discussions:hn:"
 
 
@@ -72,7 +94,7 @@ def _url_from_selftext(selftext, title=None):
     return None
 
 
-def __process_item(platform, item, redis=None, skip_timeout=0):
+def __process_item(platform, item, batch, redis=None, skip_timeout=0):
     if not item:
         return
 
@@ -133,17 +155,17 @@ def __process_item(platform, item, redis=None, skip_timeout=0):
             scheme = u.scheme
             url = u.schemeless_url
 
-    _ = models.Discussion.objects.update_or_create(
-        pk=platform_id,
-        defaults={
-            "comment_count": item.get("descendants") or 0,
-            "score": item.get("score") or 0,
-            "created_at": created_at,
-            "scheme_of_story_url": scheme,
-            "schemeless_story_url": url,
-            "title": item.get("title"),
-            "tags": tags,
-        },
+    batch.add(
+        models.Discussion(
+            platform_id=platform_id,
+            comment_count=item.get("descendants") or 0,
+            score=item.get("score") or 0,
+            created_at=created_at,
+            scheme_of_story_url=scheme,
+            schemeless_story_url=url,
+            title=item.get("title"),
+            tags=tags,
+        ),
     )
 
     if skip_timeout > 0:
@@ -154,41 +176,161 @@ def __process_item(platform, item, redis=None, skip_timeout=0):
         )
 
 
-def __fetch_item(platform, item_id, client=None):
-    if not client:
-        client = http.client(with_cache=False)
+def __process_items(platform, items, skip_timeouts=None):
+    skip_timeouts = skip_timeouts or {}
+    redis = get_redis_connection("default")
+    with (
+        redis.pipeline(transaction=False) as pipe,
+        ingest.DiscussionBatch(__update_fields) as batch,
+    ):
+        for item in items:
+            __process_item(
+                platform,
+                item,
+                batch,
+                redis=pipe,
+                skip_timeout=skip_timeouts.get(item.get("id"), 0),
+            )
+        _ = pipe.execute()
 
-    if cache.get(__cache_skip_prefix(platform) + str(item_id)):
-        return None
 
-    bu = __base_url(platform)
+def __filter_item_ids(platform, item_ids, redis):
+    """Remove comments and items that were recently fetched."""
+    with redis.pipeline(transaction=False) as pipe:
+        for item_id in item_ids:
+            pipe.sismember(__redis_comment_set_key(platform), item_id)
+        is_comment = pipe.execute()
+
+    skip = cache.get_many(
+        [__cache_skip_prefix(platform) + str(i) for i in item_ids],
+    )
+
+    return [
+        item_id
+        for item_id, comment in zip(item_ids, is_comment, strict=True)
+        if not comment
+        and __cache_skip_prefix(platform) + str(item_id) not in skip
+    ]
 
+
+async def __fetch_item(platform, item_id, client):
+    bu = __base_url(platform)
     try:
-        return client.get(f"{bu}/v0/item/{item_id}.json", timeout=11.05).json()
-    except requests.exceptions.RequestException:
-        time.sleep(3)
+        r = await client.get(f"{bu}/v0/item/{item_id}.json")
+        return r.json()
+    except (httpx.HTTPError, ValueError):
         logger.warning("fetch_item", exc_info=True)
         return None
 
 
-def __fetch_process_item(platform, item_id, client, redis, skip_timeout=0):
-    if redis.sismember(__redis_comment_set_key(platform), item_id):
-        return
+async def __fetch_process_items_async(
+    platform,
+    item_ids,
+    skip_timeouts,
+    deadline,
+):
+    concurrency = settings.APP_HN_FETCH_CONCURRENCY
+    rate = settings.APP_HN_FETCH_RATE.get(platform, 1)
+    if util.is_dev():
+        rate = 0.1
+    batch_size = 100
+
+    redis = get_redis_connection("default")
+    process = sync_to_async(__process_items, thread_sensitive=True)
+
+    item_ids = iter(item_ids)
+    chunk, to_fetch = [], []
+    pending = set()
+    batch = []
+    write = None
+    consumed, fetched = 0, 0
+
+    async with http.async_client(
+        max_connections=concurrency,
+        rate_per_host=rate,
+    ) as client:
+        while True:
+            while len(pending) < concurrency and (
+                not deadline or time.monotonic() < deadline
+            ):
+                if not to_fetch:
+                    chunk = list(itertools.islice(item_ids, batch_size))
+                    if not chunk:
+                        break
+                    consumed += len(chunk)
+                    to_fetch = __filter_item_ids(platform, chunk, redis)
+                    continue
+
+                pending.add(
+                    asyncio.create_task(
+                        __fetch_item(platform, to_fetch.pop(0), client),
+                    ),
+                )
+
+            if not pending:
+                break
+
+            done, pending = await asyncio.wait(
+                pending,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for t in done:
+                item = t.result()
+                if item:
+                    fetched += 1
+                    batch.append(item)
+
+            if len(batch) >= batch_size:
+                if write:
+                    await write
+                write = asyncio.create_task(
+                    process(platform, batch, skip_timeouts),
+                )
+                batch = []
 
-    item = __fetch_item(platform, item_id, client=client)
-    if item:
-        __process_item(platform, item, redis=redis, skip_timeout=skip_timeout)
-        t = 1
-        if platform == "h":
-            t = 0.1
-        if util.is_dev():
-            t = 10
-        time.sleep(t)
+        if write:
+            await write
+        if batch:
+            await process(platform, batch, skip_timeouts)
+
+    if to_fetch:
+        # stopped by the deadline, resume from the first item not fetched
+        consumed -= len(chunk) - chunk.index(to_fetch[0])
+
+    return consumed, fetched
+
+
+def __fetch_process_items(platform, item_ids, skip_timeouts=None, deadline=0):
+    """Fetch and process item_ids concurrently until deadline.
+
+    Return how many item IDs were consumed.
+    """
+    start_time = time.monotonic()
+
+    consumed, fetched = asyncio.run(
+        __fetch_process_items_async(
+            platform,
+            item_ids,
+            skip_timeouts,
+            deadline,
+        ),
+    )
+
+    elapsed = time.monotonic() - start_time
+    logger.info(
+        "hn %s fetch: %s items fetched out of %s in %.1fs (%.1f items/s)",
+        platform,
+        fetched,
+        consumed,
+        elapsed,
+        fetched / elapsed if elapsed else 0,
+    )
+
+    return consumed
 
 
 def __worker_fetch(task, platform):
     client = http.client(with_cache=False)
-    redis = get_redis_connection()
 
     cache_current_item_key = f"discussions:hn:{platform}:current_item"
 
@@ -237,26 +379,22 @@ def __worker_fetch(task, platform):
 
             queue_loops_c = 0
 
-        # logger.info(
-
         queue_loops_c += 1
 
-        end = time.monotonic() + 60
-        while time.monotonic() < end and queue:
-            (item_id, nth) = queue.pop(0)
-            logger.debug(f"hn {platform} fetch: {item_id}, {nth}")
-
-            skip_timeout = 0
-            if queue_loops_c > queue_max_loops:
-                skip_timeout = 60 * (nth / 10 + skip_timeout_weight)
-
-            __fetch_process_item(
-                platform,
-                item_id,
-                client,
-                redis,
-                skip_timeout,
-            )
+        skip_timeouts = {}
+        if queue_loops_c > queue_max_loops:
+            skip_timeouts = {
+                item_id: 60 * (nth / 10 + skip_timeout_weight)
+                for item_id, nth in queue
+            }
+
+        consumed = __fetch_process_items(
+            platform,
+            [item_id for item_id, _ in queue],
+            skip_timeouts=skip_timeouts,
+            deadline=time.monotonic() + 60,
+        )
+        queue = queue[consumed:]
 
         if worker.graceful_exit(task):
             logger.info(f"hn {platform} fetch: graceful exit")
@@ -266,14 +404,14 @@ def __worker_fetch(task, platform):
             max_item = client.get(f"{bu}/v0/maxitem.json").content
             max_item = int(max_item)
 
-        end = time.monotonic() + 60
-        while time.monotonic() < end:
-            __fetch_process_item(platform, current_item, client, redis)
-            current_item += 1
-            if current_item > max_item:
-                current_item = 1
-                max_item = 0
-                break
+        current_item += __fetch_process_items(
+            platform,
+            range(current_item, max_item + 1),
+            deadline=time.monotonic() + 60,
+        )
+        if current_item > max_item:
+            current_item = 1
+            max_item = 0
 
         cache.set(cache_current_item_key, current_item, timeout=None)
 
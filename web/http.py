@@ -1,9 +1,12 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import asyncio
 import logging
 import time
+from collections import defaultdict
 
 import bs4
 import cachecontrol
+import httpx
 import minify_html
 import requests
 import requests.hooks
@@ -86,6 +89,58 @@ def client(*, with_cache=False, with_retries=True):
     return client
 
 
+class AsyncTokenBucket:
+    """Allow on average `rate` acquisitions per second.
+
+    Bursts of up to `capacity` acquisitions are let through at once.
+    Must be used from a single event loop.
+    """
+
+    def __init__(self, rate: float, capacity: float | None = None) -> None:
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity,
+                self.tokens + (now - self.updated_at) * self.rate,
+            )
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+def async_client(
+    *,
+    max_connections: int = 20,
+    rate_per_host: float = 10,
+    with_retries: bool = True,
+) -> httpx.AsyncClient:
+    """Return an async client rate limited with a token bucket per host."""
+    buckets = defaultdict(lambda: AsyncTokenBucket(rate_per_host))
+
+    async def rate_limit(request: httpx.Request) -> None:
+        await buckets[request.url.host].acquire()
+
+    return httpx.AsyncClient(
+        headers={"User-Agent": settings.USERAGENT},
+        timeout=httpx.Timeout(11.05, connect=7.05),
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+        ),
+        transport=httpx.AsyncHTTPTransport(retries=3 if with_retries else 0),
+        event_hooks={"request": [rate_limit]},
+        follow_redirects=True,
+    )
+
+
 def _rate_limit(r, host):
     if r.get("discussions:rate_limit:" + host):
         time.sleep(2)
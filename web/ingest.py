@@ -0,0 +1,130 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import logging
+
+from django.db import transaction
+from django.dispatch import Signal
+from typing_extensions import override
+
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# Sent after each batch is written, instead of post_save.
+# Arguments: discussions (all the discussions of the batch), created
+# (the ones that were not in the database before), previous_urls (the
+# canonical_story_url of the others before the batch) and previous (the
+# others as they were before the batch, with only PREVIOUS_FIELDS
+# loaded).
+discussions_saved = Signal()
+
+# Fields loaded in the previous discussions of discussions_saved.
+PREVIOUS_FIELDS = (
+    "_platform",
+    "schemeless_story_url",
+    "canonical_story_url",
+    "normalized_tags",
+    "created_at",
+)
+
+# Fields set by Discussion.pre_save, always overwritten.
+NORMALIZED_FIELDS = (
+    "_platform",
+    "canonical_story_url",
+    "url_key",
+    "schemeless_url_key",
+    "normalized_title",
+    "normalized_tags",
+    "_category",
+    "normalizer_version",
+    "entry_updated_at",
+)
+
+
+def update_fields(*fields: str) -> tuple[str, ...]:
+    """update_fields of a DiscussionBatch whose ingester fills fields.
+
+    Fields an ingester doesn't fill must not be listed, or the upsert
+    would reset them.
+    """
+    return (*fields, *NORMALIZED_FIELDS)
+
+
+class DiscussionBatch:
+    """Accumulate discussions and upsert them in bulk.
+
+    The batch is written when it reaches `size` discussions and when
+    the context manager exits. Only `update_fields` (see update_fields)
+    are overwritten for discussions already in the database. Pass
+    pre_save=False if the discussions were already normalized with
+    Discussion.pre_save.
+    """
+
+    def __init__(
+        self,
+        update_fields,
+        size=500,
+        *,
+        pre_save=True,
+    ):
+        self.size = size
+        self.update_fields = update_fields
+        self.pre_save = pre_save
+        self.discussions = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _ = (exc_type, exc_value, traceback)
+        self.flush()
+
+    @override
+    def __str__(self) -> str:
+        return f"DiscussionBatch: {len(self.discussions)}/{self.size}"
+
+    def add(self, discussion: models.Discussion) -> None:
+        self.discussions[discussion.platform_id] = discussion
+        if len(self.discussions) >= self.size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.discussions:
+            return
+
+        discussions = list(self.discussions.values())
+        self.discussions = {}
+
+        if self.pre_save:
+            for d in discussions:
+                d.pre_save()
+
+        with transaction.atomic():
+            existing = {
+                d.pk: d
+                for d in models.Discussion.objects.filter(
+                    pk__in=[d.pk for d in discussions],
+                ).only(*PREVIOUS_FIELDS)
+            }
+
+            _ = models.Discussion.objects.bulk_create(
+                discussions,
+                update_conflicts=True,
+                unique_fields=["platform_id"],
+                update_fields=self.update_fields,
+            )
+
+        created = [d for d in discussions if d.pk not in existing]
+
+        logger.debug(
+            "ingest: %s discussions, %s new",
+            len(discussions),
+            len(created),
+        )
+
+        _ = discussions_saved.send(
+            sender=models.Discussion,
+            discussions=discussions,
+            created=created,
+            previous_urls={d.canonical_story_url for d in existing.values()},
+            previous=list(existing.values()),
+        )
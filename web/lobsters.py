@@ -14,17 +14,31 @@ from django.core.cache import cache
 
 from web.platform import Platform
 
-from . import celery_util, http, models, worker
+from . import celery_util, http, ingest, models, worker
 
 logger = logging.getLogger(__name__)
 
+__update_fields = ingest.update_fields(
+    "created_at",
+    "scheme_of_story_url",
+    "schemeless_story_url",
+    "title",
+    "comment_count",
+    "score",
+    "tags",
+)
+
 # TODO: handle merged stories
 # story has been merged:
 # e.g.: https://lobste.rs/stories/dnfxpk.json and
 #       https://lobste.rs/s/7bbyke.json
 
 
-def process_item(item: dict[str, Any], platform: Platform) -> None:
+def process_item(
+    item: dict[str, Any],
+    platform: Platform,
+    batch: ingest.DiscussionBatch,
+) -> None:
     platform_id = f"{platform.value}{item.get('short_id')}"
 
     created_at = datetime.datetime.fromisoformat(item.get("created_at"))
@@ -41,31 +55,18 @@ def process_item(item: dict[str, Any], platform: Platform) -> None:
             scheme = u.scheme
             url = u.schemeless_url
 
-    try:
-        discussion = models.Discussion.objects.get(pk=platform_id)
-        discussion.comment_count = item.get("comment_count") or 0
-        discussion.score = item.get("score") or 0
-        discussion.created_at = created_at
-        discussion.scheme_of_story_url = scheme
-        discussion.schemeless_story_url = url
-        discussion.title = item.get("title")
-        discussion.tags = item.get("tags")
-        discussion.save()
-    except models.Discussion.DoesNotExist:
-        try:  # noqa: SIM105
-            models.Discussion(
-                platform_id=platform_id,
-                comment_count=item.get("comment_count") or 0,
-                score=item.get("score") or 0,
-                created_at=created_at,
-                scheme_of_story_url=scheme,
-                schemeless_story_url=url,
-                title=item.get("title"),
-                tags=item.get("tags"),
-            ).save()
-        except Exception:  # noqa: S110, BLE001
-            # TODO: remove
-            pass
+    batch.add(
+        models.Discussion(
+            platform_id=platform_id,
+            comment_count=item.get("comment_count") or 0,
+            score=item.get("score") or 0,
+            created_at=created_at,
+            scheme_of_story_url=scheme,
+            schemeless_story_url=url,
+            title=item.get("title"),
+            tags=item.get("tags"),
+        ),
+    )
 
 
 def __worker_fetch(task: celery.Task, platform: Platform) -> None:
@@ -105,8 +106,9 @@ def __worker_fetch(task: celery.Task, platform: Platform) -> None:
                 current_page = 0
                 break
 
-            for item in r.json():
-                process_item(item, platform)
+            with ingest.DiscussionBatch(__update_fields) as batch:
+                for item in r.json():
+                    process_item(item, platform, batch)
 
             django.db.connections.close_all()
             time.sleep(2 * 60)
@@ -11,10 +11,20 @@ from django.utils.timezone import make_aware
 from django_redis import get_redis_connection
 
 from discussions.settings import APP_CELERY_TASK_MAX_TIME
-from web import celery_util, http, models, util
+from web import celery_util, http, ingest, models, util
 
 logger = logging.getLogger(__name__)
 
+__update_fields = ingest.update_fields(
+    "created_at",
+    "scheme_of_story_url",
+    "schemeless_story_url",
+    "title",
+    "comment_count",
+    "score",
+    "tags",
+)
+
 # http://lambda-the-ultimate.org/node?from=0
 
 
@@ -40,7 +50,11 @@ def __filter_story_url(a):
     )
 
 
-def process_item(item: bs4.BeautifulSoup, platform_prefix: str) -> None:
+def process_item(
+    item: bs4.BeautifulSoup,
+    platform_prefix: str,
+    batch: ingest.DiscussionBatch,
+) -> None:
     try:
         slug = item.select_one(".title a").get("href").strip()
     except AttributeError:
@@ -131,18 +145,7 @@ def process_item(item: bs4.BeautifulSoup, platform_prefix: str) -> None:
         scheme = u.scheme
         url = u.schemeless_url
 
-    try:
-        discussion = models.Discussion.objects.get(pk=platform_id)
-
-        discussion.comment_count = comment_count
-        discussion.score = score
-        discussion.created_at = created_at
-        discussion.scheme_of_story_url = scheme
-        discussion.schemeless_story_url = url
-        discussion.title = title
-        discussion.tags = tags
-        discussion.save()
-    except models.Discussion.DoesNotExist:
+    batch.add(
         models.Discussion(
             platform_id=platform_id,
             comment_count=comment_count,
@@ -152,7 +155,8 @@ def process_item(item: bs4.BeautifulSoup, platform_prefix: str) -> None:
             schemeless_story_url=url,
             title=title,
             tags=tags,
-        ).save()
+        ),
+    )
 
 
 def fetch_discussions(current_page, platform_prefix, base_url):
@@ -176,8 +180,9 @@ def fetch_discussions(current_page, platform_prefix, base_url):
         ):
             raise EndOfPagesError
 
-        for item in h.find_all("div", "node"):
-            process_item(item, platform_prefix)
+        with ingest.DiscussionBatch(__update_fields) as batch:
+            for item in h.find_all("div", "node"):
+                process_item(item, platform_prefix, batch)
 
         current_page += 1
 
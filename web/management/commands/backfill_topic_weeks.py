@@ -0,0 +1,36 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import time
+
+from django.core.management.base import BaseCommand
+from typing_extensions import override
+
+from web import models, topics, weekly
+
+
+class Command(BaseCommand):
+    help = "Recompute the TopicWeek rows of all the weeks of the topics."
+
+    @override
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "topics",
+            nargs="*",
+            help="Topics to recompute, all of them by default.",
+        )
+
+    @override
+    def handle(self, *args, **options):
+        for topic in options["topics"] or topics.topics:
+            if topic not in topics.topics:
+                self.stderr.write(f"unknown topic {topic}")
+                continue
+
+            start = time.monotonic()
+            weekly.refresh_topic_weeks(topic)
+            weeks = models.TopicWeek.objects.filter(
+                topic=topic,
+                story_count__gt=0,
+            ).count()
+            self.stdout.write(
+                f"{topic}: {weeks} weeks in {time.monotonic() - start:.1f}s",
+            )
@@ -0,0 +1,71 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import time
+from functools import partial
+
+import igraph as ig
+import numpy as np
+from django.core.management.base import BaseCommand
+from typing_extensions import override
+
+from web import rank
+
+
+class Command(BaseCommand):
+    help = "Compare the networkx, igraph and CSR PageRank paths on Link."
+
+    def __time(self, name, f):
+        start = time.perf_counter()
+        result = f()
+        self.stdout.write(f"{name}: {time.perf_counter() - start:.2f}s")
+        return result
+
+    @override
+    def handle(self, *args, **options):
+        src, dst = self.__time("csr: load", rank.links_to_arrays)
+        nodes, src, dst = self.__time(
+            "csr: compact",
+            lambda: rank.compact(src, dst),
+        )
+        if len(nodes) == 0:
+            self.stdout.write("no links")
+            return
+        self.stdout.write(f"{len(nodes)} resources, {len(src)} links")
+
+        scores, iterations = self.__time(
+            "csr: pagerank",
+            lambda: rank.pagerank_csr(len(nodes), src, dst),
+        )
+        x0 = rank.previous_pagerank(nodes)
+        _, warm_iterations = self.__time(
+            "csr: pagerank warm start",
+            lambda: rank.pagerank_csr(len(nodes), src, dst, x0=x0),
+        )
+        self.stdout.write(
+            f"csr: {iterations} iterations, "
+            f"{warm_iterations} with warm start",
+        )
+
+        g = self.__time("networkx: load", rank.links_to_graph)
+        nx_scores = self.__time(
+            "networkx: pagerank",
+            partial(rank.pagerank, g),
+        )
+        nx_scores = np.array([nx_scores[n] for n in nodes.tolist()])
+        self.stdout.write(
+            f"networkx: max difference {np.abs(nx_scores - scores).max():.2e}",
+        )
+        del g
+
+        # use the compacted ids, links_to_igraph makes a vertex for every
+        # id up to the largest one
+        _ = self.__time("igraph: load", rank.links_to_igraph)
+        ig_g = ig.Graph(
+            n=len(nodes),
+            edges=np.column_stack([src, dst]).tolist(),
+            directed=True,
+        )
+        ig_scores = self.__time("igraph: pagerank", ig_g.pagerank)
+        self.stdout.write(
+            "igraph: max difference "
+            f"{np.abs(np.array(ig_scores) - scores).max():.2e}",
+        )
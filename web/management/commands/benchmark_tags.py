@@ -0,0 +1,40 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import time
+
+from django.core.management.base import BaseCommand
+from typing_extensions import override
+
+from web import models, tags
+
+
+class Command(BaseCommand):
+    help = "Time tags.normalize on the most recent discussions."
+
+    @override
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=10_000)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    @override
+    def handle(self, *args, **options):
+        discussions = list(
+            models.Discussion.objects.order_by("-created_at")[
+                : options["count"]
+            ],
+        )
+        if not discussions:
+            self.stdout.write("no discussions")
+            return
+
+        best = None
+        for _ in range(options["repeat"]):
+            start = time.perf_counter()
+            for d in discussions:
+                _ = tags.normalize(d.tags, d.platform, d.title, d.story_url)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        self.stdout.write(
+            f"{len(discussions)} discussions: {best:.2f}s, "
+            f"{best / len(discussions) * 1e6:.0f}us per discussion",
+        )
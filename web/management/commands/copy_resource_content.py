@@ -0,0 +1,71 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from typing_extensions import override
+
+from web import models
+
+checkpoint_key = "discussions:copy_resource_content:last_pk"
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy the page bodies left in web_resource.clean_html to "
+        "ResourceContent. Resumes from the last batch copied."
+    )
+
+    @override
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the checkpoint and start from the first resource.",
+        )
+
+    @override
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        last_pk = 0 if options["restart"] else cache.get(checkpoint_key, 0)
+        dictionary_id = models.ZstdDictionary.latest_pk()
+        count = 0
+
+        while True:
+            rows = list(
+                models.Resource.objects.filter(pk__gt=last_pk)
+                .exclude(legacy_clean_html="")
+                .order_by("pk")
+                .values_list("pk", "legacy_clean_html")[
+                    : options["batch_size"]
+                ],
+            )
+            if not rows:
+                break
+
+            # contents written since the deploy are newer, keep them
+            _ = models.ResourceContent.objects.bulk_create(
+                [
+                    models.ResourceContent(
+                        resource_id=pk,
+                        data=models.ResourceContent.compress(
+                            html,
+                            dictionary_id,
+                        ),
+                        dictionary_id=dictionary_id,
+                        size=len(html.encode()),
+                    )
+                    for pk, html in rows
+                ],
+                ignore_conflicts=True,
+            )
+
+            last_pk = rows[-1][0]
+            count += len(rows)
+            cache.set(checkpoint_key, last_pk, timeout=None)
+            self.stdout.write(f"{count} resources, last {last_pk}")
+
+        self.stdout.write(
+            f"copied {count} resources in {time.monotonic() - start:.1f}s",
+        )
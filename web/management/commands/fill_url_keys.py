@@ -0,0 +1,74 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from typing_extensions import override
+
+from web import models, util
+
+checkpoint_key = "discussions:fill_url_keys:last_pk"
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the url_key and schemeless_url_key of the discussions and "
+        "resources saved before they were added. Resumes from the last "
+        "batch filled."
+    )
+
+    @override
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            help="Ignore the checkpoint and start from the first row.",
+        )
+
+    @override
+    def handle(self, *args, **options):
+        # key field -> URL field
+        fields = {
+            models.Discussion: {
+                "url_key": "canonical_story_url",
+                "schemeless_url_key": "schemeless_story_url",
+            },
+            models.Resource: {
+                "url_key": "canonical_url",
+                "schemeless_url_key": "url",
+            },
+        }
+        for model, model_fields in fields.items():
+            self._fill(model, model_fields, **options)
+
+    def _fill(self, model, fields, *, batch_size, restart, **_):
+        # in Python, SQL lower() depends on the collation and can differ
+        # from the str.lower() of util.url_key
+        start = time.monotonic()
+        key = f"{checkpoint_key}:{model.__name__}"
+        last_pk = 0 if restart else cache.get(key, 0)
+        count = 0
+
+        while True:
+            rows = list(
+                model.objects.filter(pk__gt=last_pk)
+                .only(*fields.values())
+                .order_by("pk")[:batch_size],
+            )
+            if not rows:
+                break
+
+            for row in rows:
+                for k, url in fields.items():
+                    setattr(row, k, util.url_key(getattr(row, url)))
+
+            _ = model.objects.bulk_update(rows, list(fields))
+            last_pk = rows[-1].pk
+            count += len(rows)
+            cache.set(key, last_pk, timeout=None)
+
+        self.stdout.write(
+            f"{model.__name__}: {count} rows in "
+            f"{time.monotonic() - start:.1f}s",
+        )
@@ -1,7 +1,10 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
 import datetime
+import itertools
 import logging
 import re
+import secrets
+from collections.abc import Iterable, Iterator
 from email.utils import formataddr
 from functools import reduce
 from operator import or_
@@ -10,26 +13,26 @@ from typing import Any
 import cleanurl
 import django.template.loader as template_loader
 from celery import shared_task
-from django.db.models import Q
-from django.db.models.signals import post_save
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.utils import timezone
 
-from web import email_util, models, title
+from web import celery_util, email_util, ingest, models, title, worker
 
 logger = logging.getLogger(__name__)
 
 
-def discussions(
-    rule: models.Mention,
-    pk: models.Discussion.pk = None,
-) -> list[models.Discussion]:
+def _rule_keywords(rule: models.Mention) -> list[str]:
     keywords = rule.keywords or []
     if rule.keyword and not rule.keywords:
         keywords = [rule.keyword]
-    for i, k in enumerate(keywords):
-        keywords[i] = title.normalize(k, stem=False)
+    return [title.normalize(k, stem=False) for k in keywords]
 
+
+def _rule_base_urls(rule: models.Mention) -> tuple[str, str, str]:
+    """The URL prefix of the rule, its generic and its canonical form."""
     rurl = rule.base_url or ""
     if rurl:
         rurl = "//" + rurl
@@ -44,6 +47,17 @@ def discussions(
     if ccu:
         cbase_url = ccu.schemeless_url
 
+    return rule.base_url or "", base_url, cbase_url
+
+
+def discussions(
+    rule: models.Mention,
+    pk: models.Discussion.pk = None,
+    pks: list[models.Discussion.pk] | None = None,
+) -> list[models.Discussion]:
+    keywords = _rule_keywords(rule)
+    _, base_url, cbase_url = _rule_base_urls(rule)
+
     subreddits_exclude = rule.subreddits_exclude or []
 
     ago = timezone.now() - datetime.timedelta(days=365)
@@ -77,18 +91,27 @@ def discussions(
 
     if keywords:
         ds = ds.filter(
-            reduce(or_, [Q(normalized_title__icontains=k) for k in keywords]),
+            # normalized titles and keywords are lowercase, contains
+            # can use the trigram index unlike icontains
+            reduce(or_, [Q(normalized_title__contains=k) for k in keywords]),
         )
 
     if pk:
         ds = ds.filter(pk=pk)
 
+    if pks is not None:
+        ds = ds.filter(pk__in=pks)
+
     if subreddits_exclude:
         ds = ds.exclude(Q(_platform="r") & Q(tags__overlap=subreddits_exclude))
 
     dsa = []
 
-    for d in ds.order_by("-created_at")[:15]:
+    ds = ds.order_by("-created_at")
+    if pks is None:
+        ds = ds[:15]
+
+    for d in ds:
         if not keywords:
             dsa.append(d)
             continue
@@ -112,16 +135,215 @@ def discussions(
     return dsa
 
 
-def __matching_rules(instance: models.Discussion) -> list[models.Mention]:
-    rules = (
-        models.Mention.objects.filter(disabled=False)
-        .filter(min_comments__lte=instance.comment_count)
-        .filter(min_score__lte=instance.score)
-        .exclude(exclude_platforms__contains=[instance.platform])
-        .exclude(mentionnotification__discussion=instance)
-    )
+_regex_metachars = frozenset(".^$*+?{}[]\\|()")
+
+__rules_version_key = "discussions:mention:rules_version"
+
+
+def _words(text: str) -> set[str]:
+    return set(re.findall(r"\w+", text))
+
+
+def _bits(mask: int) -> Iterator[int]:
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class _Rule:
+    """A Mention with its keywords and URL prefixes already normalized."""
+
+    def __init__(self, rule: models.Mention) -> None:
+        self.pk = rule.pk
+        self.min_comments = rule.min_comments
+        self.min_score = rule.min_score
+        self.keywords = _rule_keywords(rule)
+        self.patterns = []
+        for k in self.keywords:
+            try:
+                self.patterns.append(re.compile(r"\b" + k + r"\b"))
+            except re.error:
+                logger.debug(f"mention: bad keyword {k!r} in rule {rule.pk}")
+        self.base_urls = []
+        if rule.base_url:
+            self.base_urls = [u for u in _rule_base_urls(rule) if u]
+
+    def matches(self, d: models.Discussion, ago: datetime.datetime) -> bool:
+        if d.comment_count < self.min_comments:
+            return False
+        if d.score is None or d.score < self.min_score:
+            return False
+        if not d.created_at or d.created_at <= ago:
+            return False
+
+        if self.base_urls:
+            urls = [
+                u for u in (d.schemeless_story_url, d.canonical_story_url) if u
+            ]
+            if not any(u.startswith(b) for u in urls for b in self.base_urls):
+                return False
+
+        if self.keywords:
+            normalized_title = (d.normalized_title or "").lower()
+            if not any(k in normalized_title for k in self.keywords):
+                return False
+            t = " ".join((d.title or "").lower().split())
+            if not any(
+                p.search(d.normalized_title or "") or p.search(t)
+                for p in self.patterns
+            ):
+                return False
+
+        return True
+
+
+class RuleIndex:
+    """Match discussions against all the enabled Mention rules in memory.
+
+    Rules with keywords are found through an inverted index from the
+    words of their keywords, rules with only a URL prefix through a
+    trie of their prefixes. Sets of rules are bitsets over the rule
+    positions, so that excluded platforms and subreddits are removed
+    with a single mask. The candidates are then checked with the same
+    conditions as `discussions`.
+    """
+
+    def __init__(
+        self,
+        rules: Iterable[models.Mention],
+        version: str | None = None,
+    ) -> None:
+        self.version = version
+        self.rules: list[_Rule] = []
+        self.by_word: dict[str, int] = {}
+        self.url_trie: dict = {}
+        self.always = 0
+        self.exclude_platform: dict[str, int] = {}
+        self.exclude_subreddit: dict[str, int] = {}
+
+        for rule in rules:
+            self.__add(rule)
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def __add(self, rule: models.Mention) -> None:
+        bit = 1 << len(self.rules)
+        r = _Rule(rule)
+        self.rules.append(r)
+
+        for p in rule.exclude_platforms or []:
+            self.exclude_platform[p] = self.exclude_platform.get(p, 0) | bit
+        for s in rule.subreddits_exclude or []:
+            self.exclude_subreddit[s] = self.exclude_subreddit.get(s, 0) | bit
+
+        if r.keywords:
+            for k in r.keywords:
+                word = self.__index_word(k)
+                if word is None:
+                    self.always |= bit
+                else:
+                    self.by_word[word] = self.by_word.get(word, 0) | bit
+        elif r.base_urls:
+            for u in r.base_urls:
+                node = self.url_trie
+                for c in u:
+                    node = node.setdefault(c, {})
+                node[None] = node.get(None, 0) | bit
+        else:
+            self.always |= bit
+
+    @staticmethod
+    def __index_word(keyword):
+        """A word that a title must have for keyword to match it.
+
+        If keyword starts and ends with a word character and has no
+        regex metacharacters, each of its words is a whole word of the
+        titles it matches with \\b boundaries. Otherwise None.
+        """
+        if not keyword or _regex_metachars & set(keyword):
+            return None
+        if not re.match(r"\w", keyword) or not re.match(r"\w", keyword[-1]):
+            return None
+        return max(re.findall(r"\w+", keyword), key=len)
+
+    def __url_candidates(self, url):
+        mask = 0
+        node = self.url_trie
+        for c in url:
+            node = node.get(c)
+            if node is None:
+                break
+            mask |= node.get(None, 0)
+        return mask
+
+    def match(self, d: models.Discussion) -> list[int]:
+        """Primary keys of the rules matching discussion d."""
+        candidates = self.always
+        for url in (d.schemeless_story_url, d.canonical_story_url):
+            if url:
+                candidates |= self.__url_candidates(url)
+
+        words = _words(d.normalized_title or "")
+        words |= _words((d.title or "").lower())
+        for w in words:
+            candidates |= self.by_word.get(w, 0)
+
+        platform = d._platform  # noqa: SLF001
+        candidates &= ~self.exclude_platform.get(platform, 0)
+        if platform == "r":
+            for t in d.tags or []:
+                candidates &= ~self.exclude_subreddit.get(t, 0)
+
+        ago = timezone.now() - datetime.timedelta(days=365)
+        return [
+            self.rules[i].pk
+            for i in _bits(candidates)
+            if self.rules[i].matches(d, ago)
+        ]
+
+
+__rule_index = RuleIndex([])
+
+
+def rule_index() -> RuleIndex:
+    """The index of the enabled rules, rebuilt when a rule changes."""
+    global __rule_index  # noqa: PLW0603
+    version = cache.get(__rules_version_key)
+    if version is None or version != __rule_index.version:
+        if version is None:
+            _ = cache.add(
+                __rules_version_key,
+                secrets.token_hex(8),
+                timeout=None,
+            )
+            version = cache.get(__rules_version_key)
+        __rule_index = RuleIndex(
+            models.Mention.objects.filter(disabled=False).order_by("pk"),
+            version,
+        )
+    return __rule_index
+
+
+@receiver(post_save, sender=models.Mention)
+@receiver(post_delete, sender=models.Mention)
+def rules_changed(sender, instance, **kwargs):
+    _ = (sender, instance, kwargs)
+    cache.set(__rules_version_key, secrets.token_hex(8), timeout=None)
 
-    return [r for r in rules if discussions(r, instance.pk)]
+
+def __matching_rules(instance: models.Discussion) -> list[int]:
+    rules = rule_index().match(instance)
+    if not rules:
+        return []
+
+    notified = set(
+        models.MentionNotification.objects.filter(
+            discussion=instance,
+        ).values_list("mention", flat=True),
+    )
+    return [r for r in rules if r not in notified]
 
 
 def __process_mentions(
@@ -144,11 +366,48 @@ def __process_mentions(
 
     for r in matched_rules:
         models.MentionNotification.objects.create(
-            mention=r,
+            mention_id=r,
             discussion=instance,
         )
 
 
+def __process_mentions_batch(ds: list[models.Discussion]) -> None:
+    three_days_ago = timezone.now() - datetime.timedelta(days=3)
+    ds = [d for d in ds if d.created_at and d.created_at >= three_days_ago]
+    if not ds:
+        return
+
+    index = rule_index()
+    matches = [(r, d) for d in ds for r in index.match(d)]
+    if not matches:
+        return
+
+    notified = set(
+        models.MentionNotification.objects.filter(
+            discussion__in=[d.pk for d in ds],
+        ).values_list("mention", "discussion"),
+    )
+
+    notifications = [
+        models.MentionNotification(mention_id=r, discussion=d)
+        for r, d in matches
+        if (r, d.pk) not in notified
+    ]
+
+    _ = models.MentionNotification.objects.bulk_create(notifications)
+
+
+@receiver(ingest.discussions_saved)
+def process_mentions_batch(
+    sender: models.Discussion,
+    discussions: list[models.Discussion],
+    created: list[models.Discussion],
+    **kwargs: Any,
+) -> None:
+    _ = (sender, created, kwargs)
+    __process_mentions_batch(discussions)
+
+
 @receiver(post_save, sender=models.Discussion)
 def process_mentions(
     sender: models.Discussion,
@@ -160,12 +419,13 @@ def process_mentions(
     __process_mentions(sender, instance, created=created, **kwargs)
 
 
-def __render_mention_notification(m):
+def __render_mention_digest(user, notifications):
+    discussions = {n.discussion.pk: n.discussion for n in notifications}
+    rules = {n.mention.pk: n.mention for n in notifications}
     ctx = {
-        "user": m.mention.user,
-        "discussions": [m.discussion],
-        "discussion": m.discussion,
-        "mention_rule": m.mention,
+        "user": user,
+        "discussions": list(discussions.values()),
+        "mention_rules": list(rules.values()),
     }
     return template_loader.render_to_string(
         "web/mention_email_digest.txt",
@@ -173,33 +433,71 @@ def __render_mention_notification(m):
     )
 
 
-@shared_task(ignore_result=True)
-def email_notification():
-    mentions = (
+def __digest_subject(notifications):
+    count = len({n.discussion.pk for n in notifications})
+    if count == 1:
+        return f"[Discu] New discussion for you ({notifications[0].mention})"
+    return f"[Discu] {count} new discussions for you"
+
+
+@shared_task(bind=True, ignore_result=True)
+def email_notification(self):
+    """Send each user a digest of their pending notifications.
+
+    Users receive at most `max_emails` digests every `window_minutes`
+    minutes, the remaining notifications wait for the next run.
+    """
+    if celery_util.task_is_running(self.request.task, [self.request.id]):
+        return
+
+    max_emails = 3
+    window_minutes = 15
+
+    pending = (
         models.MentionNotification.objects.filter(email_sent=False)
         .exclude(discussion__isnull=True)
         .exclude(mention__isnull=True)
         .exclude(mention__user__isnull=True)
-        .order_by("entry_created_at")
+        .select_related("discussion", "mention", "mention__user")
+        .order_by("mention__user", "entry_created_at")
     )
 
-    for m in mentions:
-        if not m.discussion:
-            continue
-        if not m.mention.user:
-            continue
-
-        if m.mention.user.notifications_sent(15) >= 3:
-            continue
+    since = timezone.now() - datetime.timedelta(minutes=window_minutes)
+    emails_sent = dict(
+        models.MentionNotification.objects.filter(email_sent=True)
+        .filter(email_sent_at__gte=since)
+        .values_list("mention__user")
+        .annotate(emails=Count("email_sent_at", distinct=True))
+        .order_by(),
+    )
 
-        text_content = __render_mention_notification(m)
+    sent = 0
+    with email_util.Sender() as sender:
+        for user_pk, ns in itertools.groupby(
+            pending,
+            key=lambda n: n.mention.user_id,
+        ):
+            if emails_sent.get(user_pk, 0) >= max_emails:
+                continue
+
+            notifications = list(ns)
+            user = notifications[0].mention.user
+            if sender.send(
+                __digest_subject(notifications),
+                __render_mention_digest(user, notifications),
+                formataddr(("Discu Mentions", "mentions@discu.eu")),
+                [user.email],
+            ):
+                # marked right away, a later failure must not send the
+                # digest again. All the notifications of a digest share
+                # email_sent_at, see CustomUser.notifications_sent
+                _ = models.MentionNotification.objects.filter(
+                    pk__in=[n.pk for n in notifications],
+                ).update(email_sent=True, email_sent_at=timezone.now())
+                sent += len(notifications)
+
+            if worker.graceful_exit(self):
+                logger.info("mention email: graceful exit")
+                break
 
-        email_util.send(
-            f"[Discu] New discussion for you ({m.mention})",
-            text_content,
-            formataddr(("Discu Mentions", "mentions@discu.eu")),
-            m.mention.user.email,
-        )
-        m.email_sent = True
-        m.email_sent_at = timezone.now()
-        m.save()
+    logger.info(f"mention email: {sent} notifications sent")
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:08
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('web', '0099_remove_databag_id_alter_databag_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Story',
+            fields=[
+                ('canonical_url', models.CharField(max_length=100000, primary_key=True, serialize=False)),
+                ('story_url', models.CharField(max_length=100000)),
+                ('title', models.CharField(max_length=2048)),
+                ('total_comments', models.IntegerField(default=0)),
+                ('total_score', models.IntegerField(default=0)),
+                ('total_discussions', models.IntegerField(default=0)),
+                ('all_comments', models.IntegerField(default=0)),
+                ('first_discussion_at', models.DateTimeField(null=True)),
+                ('last_discussion_at', models.DateTimeField(null=True)),
+                ('normalized_tags', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(blank=True, max_length=255), blank=True, size=None)),
+                ('platforms', django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=1), blank=True, size=None)),
+                ('entry_created_at', models.DateTimeField(auto_now_add=True)),
+                ('entry_updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='discussion',
+            name='story',
+            field=models.ForeignObject(from_fields=['canonical_story_url'], null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='discussions', to='web.story', to_fields=['canonical_url']),
+        ),
+        migrations.AddField(
+            model_name='resource',
+            name='story',
+            field=models.ForeignObject(from_fields=['canonical_url'], null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='resources', to='web.story', to_fields=['canonical_url']),
+        ),
+    ]
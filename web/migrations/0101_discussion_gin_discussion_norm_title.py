@@ -0,0 +1,22 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:16
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("web", "0100_story"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="discussion",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["normalized_title"],
+                name="gin_discussion_norm_title",
+                opclasses=["gin_trgm_ops"],
+            ),
+        ),
+    ]
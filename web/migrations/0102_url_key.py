@@ -0,0 +1,57 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("web", "0101_discussion_gin_discussion_norm_title"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="discussion",
+            name="url_key",
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="discussion",
+            name="schemeless_url_key",
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="resource",
+            name="url_key",
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name="resource",
+            name="schemeless_url_key",
+            field=models.BigIntegerField(null=True),
+        ),
+        # the keys of the existing rows are filled by fill_url_keys
+        migrations.AddIndex(
+            model_name="discussion",
+            index=models.Index(fields=["url_key"], name="index_url_key"),
+        ),
+        migrations.AddIndex(
+            model_name="discussion",
+            index=models.Index(
+                fields=["schemeless_url_key"], name="index_schemeless_url_key"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="resource",
+            index=models.Index(
+                fields=["url_key"], name="index_resource_url_key"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="resource",
+            index=models.Index(
+                fields=["schemeless_url_key"],
+                name="index_resource_su_key",
+            ),
+        ),
+    ]
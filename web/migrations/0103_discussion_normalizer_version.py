@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("web", "0102_url_key"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="discussion",
+            name="normalizer_version",
+            field=models.CharField(blank=True, max_length=16),
+        ),
+    ]
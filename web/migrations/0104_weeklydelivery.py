@@ -0,0 +1,58 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("web", "0103_discussion_normalizer_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WeeklyDelivery",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("topic", models.CharField(max_length=255)),
+                ("year", models.IntegerField()),
+                ("week", models.IntegerField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("sent", "Sent"), ("failed", "Failed")],
+                        max_length=10,
+                    ),
+                ),
+                ("attempts", models.IntegerField(default=0)),
+                ("error", models.TextField(blank=True)),
+                ("sent_at", models.DateTimeField(blank=True, null=True)),
+                ("entry_created_at", models.DateTimeField(auto_now_add=True)),
+                ("entry_updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "subscriber",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="web.subscriber",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("subscriber", "topic", "year", "week"),
+                        name="unique_weekly_delivery",
+                    )
+                ],
+            },
+        ),
+    ]
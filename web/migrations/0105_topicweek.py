@@ -0,0 +1,40 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("web", "0104_weeklydelivery"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TopicWeek",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("topic", models.CharField(max_length=255)),
+                ("year", models.IntegerField()),
+                ("week", models.IntegerField()),
+                ("story_count", models.IntegerField(default=0)),
+                ("entry_updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("topic", "year", "week"),
+                        name="unique_topic_week",
+                    )
+                ],
+            },
+        ),
+    ]
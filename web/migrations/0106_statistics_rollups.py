@@ -0,0 +1,88 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("web", "0105_topicweek"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DomainDayStatistics",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("domain", models.CharField(max_length=100000)),
+                ("day", models.DateField(null=True)),
+                ("discussion_count", models.IntegerField(default=0)),
+                ("comment_count", models.BigIntegerField(default=0)),
+                ("entry_updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="PlatformDayStatistics",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("_platform", models.CharField(max_length=1)),
+                ("day", models.DateField(null=True)),
+                ("discussion_count", models.IntegerField(default=0)),
+                ("comment_count", models.BigIntegerField(default=0)),
+                ("oldest_discussion", models.DateTimeField(null=True)),
+                ("newest_discussion", models.DateTimeField(null=True)),
+                ("entry_updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="discussion",
+            index=models.Index(
+                fields=["entry_updated_at"],
+                name="web_discuss_entry_u_23a37d_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="domaindaystatistics",
+            index=models.Index(
+                fields=["day"], name="web_domaind_day_66ccde_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="domaindaystatistics",
+            constraint=models.UniqueConstraint(
+                fields=("domain", "day"),
+                name="unique_domain_day",
+                nulls_distinct=False,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="platformdaystatistics",
+            index=models.Index(
+                fields=["day"], name="web_platfor_day_729a49_idx"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="platformdaystatistics",
+            constraint=models.UniqueConstraint(
+                fields=("_platform", "day"),
+                name="unique_platform_day",
+                nulls_distinct=False,
+            ),
+        ),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.1.2 on 2026-10-18 19:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("web", "0106_statistics_rollups"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ZstdDictionary",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("data", models.BinaryField()),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ResourceContent",
+            fields=[
+                (
+                    "resource",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="content",
+                        serialize=False,
+                        to="web.resource",
+                    ),
+                ),
+                ("data", models.BinaryField()),
+                ("size", models.IntegerField(default=0)),
+                ("entry_updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "dictionary",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.PROTECT,
+                        to="web.zstddictionary",
+                    ),
+                ),
+            ],
+        ),
+        # data is already compressed
+        migrations.RunSQL(
+            "alter table web_resourcecontent "
+            "alter column data set storage external",
+            migrations.RunSQL.noop,
+        ),
+        # the column is kept until copy_resource_content has copied the
+        # page bodies to ResourceContent
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.RenameField(
+                    model_name="resource",
+                    old_name="clean_html",
+                    new_name="legacy_clean_html",
+                ),
+                migrations.AlterField(
+                    model_name="resource",
+                    name="legacy_clean_html",
+                    field=models.TextField(db_column="clean_html", default=""),
+                ),
+            ],
+        ),
+    ]
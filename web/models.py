@@ -1,7 +1,10 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
 import contextlib
 import datetime
+import functools
+import itertools
 import json
+import operator
 import secrets
 import urllib
 import urllib.parse
@@ -10,6 +13,7 @@ from typing import TYPE_CHECKING, Any, Self
 
 import cleanurl
 import django.template.loader as template_loader
+import zstandard
 from dateutil import parser as dateutil_parser
 from django import forms
 from django.conf import settings
@@ -20,10 +24,11 @@ from django.contrib.postgres.search import (
     SearchQuery,
     SearchRank,
     SearchVectorField,
+    TrigramWordSimilarity,
 )
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
-from django.db.models import OuterRef, Q, Subquery, Sum, Value
+from django.db.models import Count, F, Q, Value
 from django.db.models.functions import Coalesce, Round, Upper
 from django.utils import timezone
 from django_stubs_ext.db.models import TypedModelMeta
@@ -36,10 +41,11 @@ from web.platform import Platform
 from . import (
     email_util,
     extract,
-    tags,
+    normalize,
     title,
     topics,
     twitter_api,
+    util,
 )
 
 if TYPE_CHECKING:
@@ -71,6 +77,11 @@ class _CustomArrayField(postgres_fields.ArrayField):
             super().validate(value, model_instance)
 
 
+class TitleSearch(models.TextChoices):
+    FTS = "fts", "Full text search"
+    TRIGRAM = "trigram", "Trigram word similarity"
+
+
 class Discussion(models.Model):
     """Threads and posts on various platforms with metadata.
 
@@ -102,6 +113,10 @@ class Discussion(models.Model):
         blank=True,
         null=True,
     )
+    url_key = models.BigIntegerField(null=True)
+    """Hash of canonical_story_url, see util.url_key"""
+    schemeless_url_key = models.BigIntegerField(null=True)
+    """Hash of schemeless_story_url, see util.url_key"""
 
     title = models.CharField(max_length=2048)
     normalized_title = models.CharField(max_length=2048, blank=True)
@@ -123,17 +138,37 @@ class Discussion(models.Model):
 
     _category = models.IntegerField(default=Category.ARTICLE.value)
 
+    normalizer_version = models.CharField(max_length=16, blank=True)
+    """normalize.VERSION used for the normalized fields"""
+
     archived = models.BooleanField(default=False)
 
+    story = models.ForeignObject(
+        "Story",
+        on_delete=models.DO_NOTHING,
+        from_fields=["canonical_story_url"],
+        to_fields=["canonical_url"],
+        null=True,
+        related_name="discussions",
+    )
+
     tweet_set: models.Manager["Tweet"]
     mastodonpost_set: models.Manager["MastodonPost"]
 
     entry_created_at = models.DateTimeField(auto_now_add=True)
     entry_updated_at = models.DateTimeField(auto_now=True)
 
+    # canonical_story_url as loaded from or last saved to the database
+    _saved_canonical_story_url: str | None = None
+
     class Meta(TypedModelMeta):
         indexes: Sequence[models.Index] = [
             GinIndex(name="gin_discussion_vec_title", fields=["title_vector"]),
+            GinIndex(
+                name="gin_discussion_norm_title",
+                fields=["normalized_title"],
+                opclasses=["gin_trgm_ops"],
+            ),
             models.Index(
                 OpClass(
                     Upper("schemeless_story_url"),
@@ -151,7 +186,13 @@ class Discussion(models.Model):
                 fields=["canonical_redirect_url"],
                 opclasses=["varchar_pattern_ops"],
             ),
+            models.Index(name="index_url_key", fields=["url_key"]),
+            models.Index(
+                name="index_schemeless_url_key",
+                fields=["schemeless_url_key"],
+            ),
             models.Index(fields=["created_at"]),
+            models.Index(fields=["entry_updated_at"]),
         ]
 
     @override
@@ -162,6 +203,25 @@ class Discussion(models.Model):
     def save(self, *args, **kwargs):
         self.pre_save()
         super().save(*args, **kwargs)
+        self._saved_canonical_story_url = self.canonical_story_url
+
+    @classmethod
+    @override
+    def from_db(cls, db, field_names, values):
+        d = super().from_db(db, field_names, values)
+        # not loaded if deferred
+        url = d.__dict__.get("canonical_story_url")
+        d._saved_canonical_story_url = url  # noqa: SLF001
+        return d
+
+    @property
+    def saved_canonical_story_url(self):
+        """canonical_story_url currently stored in the database.
+
+        Known only for discussions loaded from the database. Differs from
+        canonical_story_url when pre_save changes it, until save().
+        """
+        return self._saved_canonical_story_url
 
     def pre_save(self):
         self.title = self.title or ""
@@ -171,15 +231,26 @@ class Discussion(models.Model):
         if not self._platform:
             self._platform = self.platform_id[0]
 
-        if self.schemeless_story_url:
-            u = cleanurl.cleanurl("//" + self.schemeless_story_url)
-            if u:
-                self.canonical_story_url = u.schemeless_url
-            else:
-                self.canonical_story_url = None
+        self.tags = self.tags or []
 
-        if not self.canonical_story_url:
-            self.canonical_story_url = self.schemeless_story_url
+        ns = normalize.normalize_story(
+            self.title,
+            self.scheme_of_story_url,
+            self.schemeless_story_url,
+            self.tags,
+            self.platform,
+            url_max_len=2700,
+        )
+
+        if self.schemeless_story_url:
+            self.scheme_of_story_url = ns.scheme
+            self.schemeless_story_url = ns.schemeless_url
+            self.canonical_story_url = ns.canonical_url
+        else:
+            if not self.canonical_story_url:
+                self.canonical_story_url = self.schemeless_story_url
+            if not self.canonical_story_url:
+                self.scheme_of_story_url = None
 
         if self.canonical_redirect_url in {
             self.canonical_story_url,
@@ -187,45 +258,13 @@ class Discussion(models.Model):
         }:
             self.canonical_redirect_url = None
 
-        url_max_len = 2700
-        if (
-            self.schemeless_story_url
-            and len(self.schemeless_story_url) > url_max_len
-        ):
-            self.schemeless_story_url = None
-        if (
-            self.canonical_story_url
-            and len(self.canonical_story_url) > url_max_len
-        ):
-            self.canonical_story_url = None
-        if not self.schemeless_story_url and not self.canonical_story_url:
-            self.scheme_of_story_url = None
-
-        self.tags = self.tags or []
-
-        self.normalized_title = title.normalize(
-            self.title,
-            self.platform,
-            (self.story_url or ""),
-            self.tags,
-            stem=False,
-        )
-
-        self.normalized_tags = tags.normalize(
-            self.tags,
-            self.platform,
-            self.title,
-            (self.story_url or ""),
-        )
+        self.url_key = util.url_key(self.canonical_story_url)
+        self.schemeless_url_key = util.url_key(self.schemeless_story_url)
 
-        self.normalized_tags = sorted(self.normalized_tags or [])
-
-        self._category = Category.derive(
-            self.title,
-            self.canonical_story_url or "",
-            self.normalized_tags,
-            self.platform,
-        ).value
+        self.normalized_title = ns.title
+        self.normalized_tags = list(ns.tags)
+        self._category = ns.category.value
+        self.normalizer_version = normalize.VERSION
 
     @property
     def platform(self):
@@ -277,14 +316,9 @@ class Discussion(models.Model):
     def discussion_url(self):
         return self.platform.thread_url(self.id, self.subreddit)
 
-    @classmethod
-    def of_url(cls, url, *, only_relevant_stories=True):
-        if not url:
-            return cls.objects.none(), "", ""
-
-        seven_days_ago = timezone.now() - datetime.timedelta(days=7)
-        min_comments = 2
-
+    @staticmethod
+    def story_urls(url):
+        """Generic and canonical schemeless URL of url, for lookups."""
         cleaned_url = cleanurl.cleanurl(url)
         cu = cleaned_url.schemeless_url if cleaned_url else ""
         cleaned_url = cleanurl.cleanurl(
@@ -295,12 +329,49 @@ class Discussion(models.Model):
         )
         url = cleaned_url.schemeless_url if cleaned_url else ""
 
-        ds = (
-            cls.objects.filter(schemeless_story_url__iexact=url)
-            | cls.objects.filter(schemeless_story_url__iexact=cu)
-            | cls.objects.filter(canonical_story_url=cu)
+        return url, cu
+
+    @staticmethod
+    def _story_filter(url, cu):
+        """Discussions whose story is url or its canonical form cu.
+
+        The keys select the rows through their indexes, the URLs are
+        compared again since different URLs can have the same key.
+        Rows whose keys are not filled yet, see fill_url_keys, are
+        matched by URL alone.
+        """
+        filters = []
+        for u in dict.fromkeys([url, cu]):
+            if u:
+                filters += [
+                    Q(schemeless_url_key=util.url_key(u))
+                    & Q(schemeless_story_url__iexact=u),
+                    Q(schemeless_url_key__isnull=True)
+                    & Q(schemeless_story_url__iexact=u),
+                ]
+        if cu:
+            filters += [
+                Q(url_key=util.url_key(cu)) & Q(canonical_story_url=cu),
+                Q(url_key__isnull=True) & Q(canonical_story_url=cu),
+            ]
+
+        return functools.reduce(operator.or_, filters, Q(pk__in=[]))
+
+    def is_story_of(self, url, cu):
+        """Whether the discussion is matched by _story_filter(url, cu)."""
+        schemeless = (self.schemeless_story_url or "").lower()
+        return bool(
+            (cu and self.canonical_story_url == cu)
+            or (schemeless and schemeless in {url.lower(), cu.lower()}),
         )
 
+    @classmethod
+    def __of_stories(cls, q, *, only_relevant_stories):
+        seven_days_ago = timezone.now() - datetime.timedelta(days=7)
+        min_comments = 2
+
+        ds = cls.objects.filter(q)
+
         ds = ds.exclude(schemeless_story_url__isnull=True)
         ds = ds.exclude(schemeless_story_url="")
 
@@ -313,17 +384,81 @@ class Discussion(models.Model):
 
         ds = ds.annotate(word_similarity=Value(99))
 
-        ds = ds.order_by(
+        return ds.order_by(
             "_platform",
             "-word_similarity",
             "-created_at",
             "-platform_id",
         )
 
+    @classmethod
+    def of_url(cls, url, *, only_relevant_stories=True):
+        if not url:
+            return cls.objects.none(), "", ""
+
+        url, cu = cls.story_urls(url)
+
+        ds = cls.__of_stories(
+            cls._story_filter(url, cu),
+            only_relevant_stories=only_relevant_stories,
+        )
+
         return ds, cu, cu
 
     @classmethod
-    def of_url_or_title(cls, url_or_title):
+    def of_urls(cls, urls, *, only_relevant_stories=True):
+        """Like of_url but for many URLs with a single query.
+
+        Returns a dict from each URL to the list of its discussions.
+        """
+        story_urls = {url: cls.story_urls(url) for url in urls if url}
+        urls_by_key = {}
+        for url, story_url in story_urls.items():
+            for u in story_url:
+                urls_by_key.setdefault(util.url_key(u), set()).add(url)
+        _ = urls_by_key.pop(None, None)
+
+        discussions = {url: [] for url in urls}
+        if not urls_by_key:
+            return discussions
+
+        # probe the keys with a single query, then recheck the URLs as
+        # in _story_filter
+        keys = list(urls_by_key.keys())
+        story_url_set = list(set().union(*story_urls.values()) - {""})
+        ds = cls.__of_stories(
+            Q(url_key__in=keys)
+            | Q(schemeless_url_key__in=keys)
+            | Q(url_key__isnull=True, canonical_story_url__in=story_url_set)
+            | Q(
+                schemeless_url_key__isnull=True,
+                schemeless_story_url__in=story_url_set,
+            ),
+            only_relevant_stories=only_relevant_stories,
+        )
+
+        for d in ds:
+            # the keys may not be filled yet, see fill_url_keys
+            keys = {
+                util.url_key(d.canonical_story_url),
+                util.url_key(d.schemeless_story_url),
+            }
+            for url in set().union(*(urls_by_key.get(k, ()) for k in keys)):
+                if d.is_story_of(*story_urls[url]):
+                    discussions[url].append(d)
+
+        return discussions
+
+    @classmethod
+    def of_url_or_title(cls, url_or_title, title_search=None):
+        """Discussions of the URL or with a title similar to url_or_title.
+
+        Titles are searched with full text search or by trigram word
+        similarity, see TitleSearch. By default settings.APP_TITLE_SEARCH
+        is used.
+        """
+        title_search = TitleSearch(title_search or settings.APP_TITLE_SEARCH)
+
         if not url_or_title:
             return cls.objects.none(), "", ""
 
@@ -345,11 +480,7 @@ class Discussion(models.Model):
         u = cleanurl.cleanurl(url_or_title)
         cu = u.schemeless_url if u else ""
 
-        ds = (
-            cls.objects.filter(schemeless_story_url__iexact=url)
-            | cls.objects.filter(schemeless_story_url__iexact=cu)
-            | cls.objects.filter(canonical_story_url=cu)
-        )
+        ds = cls.objects.filter(cls._story_filter(url, cu))
 
         ds = ds.exclude(schemeless_story_url__isnull=True)
         ds = ds.exclude(schemeless_story_url="")
@@ -407,16 +538,25 @@ class Discussion(models.Model):
 
             if len(query) > 1:
                 q = title.normalize(query, stem=False)
-                psq = SearchQuery(q, search_type="plain")
-
-                base = cls.objects
-                if ts is not None:
-                    base = ts
 
-                ts = base.annotate(
-                    search_rank=Round(SearchRank("title_vector", psq), 2),
-                )
-                ts = ts.filter(title_vector=psq)
+                if ts is None:
+                    ts = cls.objects.all()
+
+                if title_search == TitleSearch.TRIGRAM:
+                    # %> uses the trigram index on normalized_title
+                    ts = ts.filter(normalized_title__trigram_word_similar=q)
+                    ts = ts.annotate(
+                        search_rank=Round(
+                            TrigramWordSimilarity(q, "normalized_title"),
+                            2,
+                        ),
+                    )
+                else:
+                    psq = SearchQuery(q, search_type="plain")
+                    ts = ts.annotate(
+                        search_rank=Round(SearchRank("title_vector", psq), 2),
+                    )
+                    ts = ts.filter(title_vector=psq)
             elif ts is not None:
                 ts = ts.annotate(search_rank=Value(1))
 
@@ -432,7 +572,7 @@ class Discussion(models.Model):
                 ts = ts.exclude(schemeless_story_url__isnull=True)
                 ts = ts.exclude(schemeless_story_url="")
 
-                ts = ts[:40]
+                ts = ts.order_by("-search_rank", "-created_at")[:40]
 
         if ts is not None:
             ds = ds.union(ts)
@@ -453,6 +593,152 @@ class Discussion(models.Model):
         ).delete()
 
 
+class Story(models.Model):
+    """Aggregated metadata of all the discussions of a story.
+
+    Discussions are grouped by canonical_story_url. Except for
+    all_comments, only the relevant ones (see MIN_COMMENTS and MIN_SCORE)
+    are taken into account.
+    """
+
+    MIN_COMMENTS = 2
+    MIN_SCORE = 1
+    DISCUSSION_FIELDS = (
+        "canonical_story_url",
+        "scheme_of_story_url",
+        "schemeless_story_url",
+        "title",
+        "comment_count",
+        "score",
+        "created_at",
+        "normalized_tags",
+        "_platform",
+    )
+
+    canonical_url = models.CharField(primary_key=True, max_length=100_000)
+    story_url = models.CharField(max_length=100_000)
+    title = models.CharField(max_length=2048)
+
+    total_comments = models.IntegerField(default=0)
+    total_score = models.IntegerField(default=0)
+    total_discussions = models.IntegerField(default=0)
+    all_comments = models.IntegerField(default=0)
+    """Comments of all the discussions, relevant or not"""
+
+    first_discussion_at = models.DateTimeField(null=True)
+    last_discussion_at = models.DateTimeField(null=True)
+
+    normalized_tags = postgres_fields.ArrayField(
+        models.CharField(max_length=255, blank=True),
+        blank=True,
+    )
+    platforms = postgres_fields.ArrayField(
+        models.CharField(max_length=1),
+        blank=True,
+    )
+
+    entry_created_at = models.DateTimeField(auto_now_add=True)
+    entry_updated_at = models.DateTimeField(auto_now=True)
+
+    @override
+    def __str__(self) -> str:
+        return f"{self.canonical_url}"
+
+    @staticmethod
+    def story_discussions():
+        return Discussion.objects.exclude(
+            canonical_story_url__isnull=True,
+        ).exclude(canonical_story_url="")
+
+    @classmethod
+    def is_relevant(cls, discussion):
+        score = discussion["score"]
+        return (
+            discussion["comment_count"] >= cls.MIN_COMMENTS
+            and score is not None
+            and score >= cls.MIN_SCORE
+        )
+
+    @classmethod
+    def from_discussions(cls, canonical_url, discussions):
+        relevant = [d for d in discussions if cls.is_relevant(d)]
+        top = max(
+            relevant or discussions,
+            key=operator.itemgetter("comment_count"),
+        )
+        created_at = [d["created_at"] for d in relevant if d["created_at"]]
+
+        return cls(
+            canonical_url=canonical_url,
+            story_url=f"{top['scheme_of_story_url']}://"
+            f"{top['schemeless_story_url']}",
+            title=top["title"],
+            total_comments=sum(d["comment_count"] for d in relevant),
+            total_score=sum(d["score"] for d in relevant),
+            total_discussions=len(relevant),
+            all_comments=sum(d["comment_count"] for d in discussions),
+            first_discussion_at=min(created_at, default=None),
+            last_discussion_at=max(created_at, default=None),
+            normalized_tags=sorted(
+                {t for d in relevant for t in d["normalized_tags"] or []},
+            ),
+            platforms=sorted({d["_platform"] for d in relevant}),
+        )
+
+    @classmethod
+    def upsert(cls, stories):
+        _ = cls.objects.bulk_create(
+            stories,
+            update_conflicts=True,
+            unique_fields=["canonical_url"],
+            update_fields=[
+                "story_url",
+                "title",
+                "total_comments",
+                "total_score",
+                "total_discussions",
+                "all_comments",
+                "first_discussion_at",
+                "last_discussion_at",
+                "normalized_tags",
+                "platforms",
+                "entry_updated_at",
+            ],
+        )
+
+    @classmethod
+    def refresh(cls, canonical_urls):
+        """Recompute the stories of canonical_urls.
+
+        Stories left without discussions are deleted.
+        """
+        canonical_urls = {u for u in canonical_urls if u}
+        if not canonical_urls:
+            return
+
+        discussions = (
+            cls.story_discussions()
+            .filter(canonical_story_url__in=canonical_urls)
+            .values(*cls.DISCUSSION_FIELDS)
+            .order_by("canonical_story_url")
+        )
+
+        stories = [
+            cls.from_discussions(url, list(ds))
+            for url, ds in itertools.groupby(
+                discussions,
+                key=operator.itemgetter("canonical_story_url"),
+            )
+        ]
+
+        cls.upsert(stories)
+
+        _ = cls.objects.filter(
+            canonical_url__in=canonical_urls
+            - {s.canonical_url for s in stories},
+        ).delete()
+
+
 class StatisticsDecoder(json.JSONDecoder):
     def __init__(self):
         json.JSONDecoder.__init__(self, object_hook=self.dict_to_object)
@@ -532,6 +818,64 @@ class Statistics(models.Model):
         }
 
 
+class PlatformDayStatistics(models.Model):
+    """Discussions with a story URL per platform and day of creation.
+
+    Rollup of Discussion maintained by statistics.discussions_statistics.
+    """
+
+    _platform = models.CharField(max_length=1)
+    day = models.DateField(null=True)
+    discussion_count = models.IntegerField(default=0)
+    comment_count = models.BigIntegerField(default=0)
+    oldest_discussion = models.DateTimeField(null=True)
+    newest_discussion = models.DateTimeField(null=True)
+
+    entry_updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta(TypedModelMeta):
+        constraints: Sequence[models.BaseConstraint] = [
+            models.UniqueConstraint(
+                fields=["_platform", "day"],
+                name="unique_platform_day",
+                nulls_distinct=False,
+            ),
+        ]
+        indexes: Sequence[models.Index] = [models.Index(fields=["day"])]
+
+    @override
+    def __str__(self) -> str:
+        return f"{self._platform} {self.day}: {self.discussion_count}"
+
+
+class DomainDayStatistics(models.Model):
+    """Discussions with at least 2 comments per domain and day of creation.
+
+    Rollup of Discussion maintained by statistics.discussions_statistics.
+    """
+
+    domain = models.CharField(max_length=100_000)
+    day = models.DateField(null=True)
+    discussion_count = models.IntegerField(default=0)
+    comment_count = models.BigIntegerField(default=0)
+
+    entry_updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta(TypedModelMeta):
+        constraints: Sequence[models.BaseConstraint] = [
+            models.UniqueConstraint(
+                fields=["domain", "day"],
+                name="unique_domain_day",
+                nulls_distinct=False,
+            ),
+        ]
+        indexes: Sequence[models.Index] = [models.Index(fields=["day"])]
+
+    @override
+    def __str__(self) -> str:
+        return f"{self.domain} {self.day}: {self.discussion_count}"
+
+
 class Tweet(models.Model):
     tweet_id = models.BigIntegerField(primary_key=True, null=False)
     bot_name = models.CharField(max_length=255)
@@ -585,6 +929,12 @@ class MastodonPost(models.Model):
         super().save(*args, **kwargs)
 
 
+class ResourceManager(models.Manager["Resource"]):
+    @override
+    def get_queryset(self):
+        return super().get_queryset().defer("legacy_clean_html")
+
+
 class Resource(models.Model):
     TITLE_MAX_LEN = 2048
 
@@ -599,6 +949,10 @@ class Resource(models.Model):
     )
 
     canonical_url = models.CharField(max_length=100_000, blank=True)
+    url_key = models.BigIntegerField(null=True)
+    """Hash of canonical_url, see util.url_key"""
+    schemeless_url_key = models.BigIntegerField(null=True)
+    """Hash of url, see util.url_key"""
 
     title = models.CharField(max_length=2048)
     normalized_title = models.CharField(
@@ -616,7 +970,8 @@ class Resource(models.Model):
         blank=True,
     )
 
-    clean_html = models.TextField()
+    legacy_clean_html = models.TextField(db_column="clean_html", default="")
+    """Page body before ResourceContent, see copy_resource_content"""
 
     excerpt = models.TextField()
 
@@ -635,6 +990,17 @@ class Resource(models.Model):
 
     pagerank = models.FloatField(default=0, null=False)
 
+    story = models.ForeignObject(
+        Story,
+        on_delete=models.DO_NOTHING,
+        from_fields=["canonical_url"],
+        to_fields=["canonical_url"],
+        null=True,
+        related_name="resources",
+    )
+
+    objects = ResourceManager()
+
     class Meta(TypedModelMeta):
         indexes: Sequence[models.Index] = [
             models.Index(
@@ -647,6 +1013,11 @@ class Resource(models.Model):
                 fields=["canonical_url"],
                 opclasses=["varchar_pattern_ops"],
             ),
+            models.Index(name="index_resource_url_key", fields=["url_key"]),
+            models.Index(
+                name="index_resource_su_key",
+                fields=["schemeless_url_key"],
+            ),
         ]
 
     @override
@@ -658,6 +1029,10 @@ class Resource(models.Model):
         self._pre_save()
         super().save(*args, **kwargs)
 
+        if self._clean_html_changed:
+            ResourceContent.store(self, self._clean_html)
+            self._clean_html_changed = False
+
     def _pre_save(self):
         self.tags = self.tags or []
         self.title = self.title or ""
@@ -665,35 +1040,48 @@ class Resource(models.Model):
         self.title = self.title.replace("\x00", "")
         self.title = self.title[: self.TITLE_MAX_LEN]
 
+        ns = normalize.normalize_story(
+            self.title,
+            self.scheme,
+            self.url,
+            self.tags,
+            None,
+        )
+
         if self.url:
-            u = cleanurl.cleanurl("//" + self.url)
-            if u:
-                self.canonical_url = u.schemeless_url
-            else:
-                self.canonical_url = None
+            self.canonical_url = ns.canonical_url
 
         if not self.canonical_url:
             self.canonical_url = self.url
 
-        self.normalized_title = title.normalize(
-            self.title,
-            None,
-            (self.story_url or ""),
-            self.tags,
-            stem=False,
-        )
+        self.url_key = util.url_key(self.canonical_url)
+        self.schemeless_url_key = util.url_key(self.url)
 
-        self.normalized_tags = (
-            tags.normalize(
-                self.tags,
-                None,
-                self.title,
-                (self.story_url or ""),
-            )
-            or []
-        )
+        self.normalized_title = ns.title
+        self.normalized_tags = list(ns.tags)
 
-        self.clean_html = self.clean_html or ""
+    # clean_html is stored compressed in ResourceContent, loaded lazily
+    _clean_html: str | None = None
+    _clean_html_changed = False
+
+    @property
+    def clean_html(self) -> str:
+        if self._clean_html is None:
+            self._clean_html = ""
+            if self.pk:
+                try:
+                    self._clean_html = self.content.html
+                except ResourceContent.DoesNotExist:
+                    # not copied yet
+                    self._clean_html = self.legacy_clean_html
+
+        return self._clean_html
+
+    @clean_html.setter
+    def clean_html(self, html):
+        self._clean_html = html or ""
+        self._clean_html_changed = True
+        self.legacy_clean_html = ""
 
     @property
     def complete_url(self):
@@ -715,24 +1103,101 @@ class Resource(models.Model):
         if not cu or not su:
             return None
 
+        return cls.objects.filter(cls._url_filter(su, cu)).first()
+
+    @staticmethod
+    def _url_filter(su, cu):
+        """Resources of su or cu, see Discussion._story_filter."""
+        su, cu = su.schemeless_url, cu.schemeless_url
         return (
-            cls.objects.filter(url=su.schemeless_url)
-            | cls.objects.filter(url=cu.schemeless_url)
-            | cls.objects.filter(canonical_url=cu.schemeless_url)
-        ).first()
+            (Q(schemeless_url_key=util.url_key(su)) & Q(url=su))
+            | (Q(schemeless_url_key=util.url_key(cu)) & Q(url=cu))
+            | (Q(url_key=util.url_key(cu)) & Q(canonical_url=cu))
+            | Q(schemeless_url_key__isnull=True, url__in=[su, cu])
+            | Q(url_key__isnull=True, canonical_url=cu)
+        )
+
+    def is_resource_of(self, su, cu):
+        """Whether the resource is matched by _url_filter(su, cu)."""
+        return self.url in {
+            su.schemeless_url,
+            cu.schemeless_url,
+        } or self.canonical_url == cu.schemeless_url
+
+    @classmethod
+    def by_urls(cls, urls):
+        """Like by_url but for many URLs with a single query.
+
+        Returns a dict from URL to resource, URLs without a resource
+        are missing.
+        """
+        cleaned_urls = {}
+        for url in urls:
+            if not url:
+                continue
+            cu = cleanurl.cleanurl(url)
+            su = cleanurl.cleanurl(
+                url,
+                generic=True,
+                respect_semantics=True,
+                host_remap=False,
+            )
+            if cu and su:
+                cleaned_urls[url] = (su, cu)
+
+        keys = {
+            util.url_key(u.schemeless_url)
+            for su_cu in cleaned_urls.values()
+            for u in su_cu
+        } - {None}
+        if not keys:
+            return {}
+
+        # probe the keys with a single query, then recheck the URLs as
+        # in _url_filter
+        urls = list(
+            {u.schemeless_url for su_cu in cleaned_urls.values() for u in su_cu},
+        )
+        resources = {}
+        for r in cls.objects.filter(
+            Q(url_key__in=list(keys))
+            | Q(schemeless_url_key__in=list(keys))
+            | Q(schemeless_url_key__isnull=True, url__in=urls)
+            | Q(url_key__isnull=True, canonical_url__in=urls),
+        ):
+            # the keys may not be filled yet, see fill_url_keys
+            for k in {util.url_key(r.canonical_url), util.url_key(r.url)}:
+                resources.setdefault(k, []).append(r)
+
+        by_url = {}
+        for url, (su, cu) in cleaned_urls.items():
+            candidates = (
+                r
+                for u in (su, cu)
+                for r in resources.get(util.url_key(u.schemeless_url), [])
+            )
+            r = next((r for r in candidates if r.is_resource_of(su, cu)), None)
+            if r:
+                by_url[url] = r
+
+        return by_url
+
+    @classmethod
+    def inbound_counts(cls, resources):
+        """Number of inbound resources for each resource, by id."""
+        counts = (
+            Link.objects.filter(to_resource__in=resources)
+            .values("to_resource")
+            .annotate(count=Count("from_resource", distinct=True))
+            .values_list("to_resource", "count")
+        )
+        return dict(counts)
 
     def outbound_resources(self):
         ols = self.links.all().distinct()
         ols = ols.annotate(
             discussions_comment_count=Coalesce(
-                Subquery(
-                    Discussion.objects.filter(
-                        canonical_story_url=OuterRef("canonical_url"),
-                    )
-                    .values("canonical_story_url")
-                    .annotate(comment_count=Sum("comment_count"))
-                    .values("comment_count"),
-                ),
+                F("story__all_comments"),
                 Value(0),
             ),
         )
@@ -743,14 +1208,7 @@ class Resource(models.Model):
         ils = self.inbound_link.all().distinct()
         ils = ils.annotate(
             discussions_comment_count=Coalesce(
-                Subquery(
-                    Discussion.objects.filter(
-                        canonical_story_url=OuterRef("canonical_url"),
-                    )
-                    .values("canonical_story_url")
-                    .annotate(comment_count=Sum("comment_count"))
-                    .values("comment_count"),
-                ),
+                F("story__all_comments"),
                 Value(0),
             ),
         )
@@ -805,6 +1263,111 @@ class Resource(models.Model):
         return author
 
 
+class ZstdDictionary(models.Model):
+    """Zstandard dictionary trained on ResourceContent, never modified."""
+
+    data = models.BinaryField()
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @override
+    def __str__(self) -> str:
+        return f"{self.pk}: {len(self.data)} bytes"
+
+    @classmethod
+    def latest_pk(cls):
+        return cls.objects.order_by("-pk").values_list("pk", flat=True).first()
+
+    @classmethod
+    def train(cls, sample_count=2_000, size=112_640):
+        """Train a new dictionary on the most recent contents.
+
+        Return None if there are not enough contents to train one.
+        """
+        contents = ResourceContent.objects.order_by("-entry_updated_at")
+        samples = [c.html.encode() for c in contents[:sample_count].iterator()]
+        try:
+            data = zstandard.train_dictionary(size, samples).as_bytes()
+        except zstandard.ZstdError:
+            return None
+        return cls.objects.create(data=data)
+
+
+@functools.lru_cache(maxsize=16)
+def _zstd_dictionary(pk):
+    data = ZstdDictionary.objects.get(pk=pk).data
+    d = zstandard.ZstdCompressionDict(bytes(data))
+    d.precompute_compress(level=ResourceContent.COMPRESSION_LEVEL)
+    return d
+
+
+class ResourceContent(models.Model):
+    """Page body of a Resource compressed with zstd, see Resource.clean_html.
+
+    Kept out of web_resource so that resource queries don't read it.
+    """
+
+    COMPRESSION_LEVEL = 9
+
+    resource = models.OneToOneField(
+        Resource,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="content",
+    )
+    data = models.BinaryField()
+    dictionary = models.ForeignKey(
+        ZstdDictionary,
+        on_delete=models.PROTECT,
+        null=True,
+    )
+    size = models.IntegerField(default=0)
+    """Uncompressed size in bytes"""
+
+    entry_updated_at = models.DateTimeField(auto_now=True)
+
+    @override
+    def __str__(self) -> str:
+        return f"{self.resource_id}: {len(self.data)}/{self.size} bytes"
+
+    @property
+    def html(self) -> str:
+        d = None
+        if self.dictionary_id:
+            d = _zstd_dictionary(self.dictionary_id)
+        return (
+            zstandard.ZstdDecompressor(dict_data=d)
+            .decompress(bytes(self.data))
+            .decode()
+        )
+
+    @staticmethod
+    def compress(html, dictionary_id):
+        d = None
+        if dictionary_id:
+            d = _zstd_dictionary(dictionary_id)
+        return zstandard.ZstdCompressor(
+            level=ResourceContent.COMPRESSION_LEVEL,
+            dict_data=d,
+        ).compress(html.encode())
+
+    @classmethod
+    def store(cls, resource, html):
+        if not html:
+            _ = cls.objects.filter(resource=resource).delete()
+            return
+
+        dictionary_id = ZstdDictionary.latest_pk()
+        _ = cls.objects.update_or_create(
+            resource=resource,
+            defaults={
+                "data": cls.compress(html, dictionary_id),
+                "dictionary_id": dictionary_id,
+                "size": len(html.encode()),
+            },
+        )
+
+
 class Link(models.Model):
     from_resource = models.ForeignKey(
         Resource,
@@ -1029,6 +1592,64 @@ class Subscriber(models.Model):
         self.weeks_clicked = (self.weeks_clicked or []) + [f"{year}{week}"]
 
 
+class WeeklyDelivery(models.Model):
+    """Delivery of the weekly digest of a week to a subscriber."""
+
+    class Status(models.TextChoices):
+        SENT = "sent"
+        FAILED = "failed"
+
+    subscriber = models.ForeignKey(Subscriber, on_delete=models.CASCADE)
+    topic = models.CharField(max_length=255)
+    year = models.IntegerField()
+    week = models.IntegerField()
+    status = models.CharField(max_length=10, choices=Status.choices)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    entry_created_at = models.DateTimeField(auto_now_add=True)
+    entry_updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta(TypedModelMeta):
+        constraints: Sequence[models.BaseConstraint] = [
+            models.UniqueConstraint(
+                fields=["subscriber", "topic", "year", "week"],
+                name="unique_weekly_delivery",
+            ),
+        ]
+
+    @override
+    def __str__(self) -> str:
+        return (
+            f"{self.subscriber_id} {self.topic} {self.week}/{self.year}: "
+            f"{self.status}"
+        )
+
+
+class TopicWeek(models.Model):
+    """Number of stories of a topic in an ISO week, see weekly.base_query."""
+
+    topic = models.CharField(max_length=255)
+    year = models.IntegerField()
+    week = models.IntegerField()
+    story_count = models.IntegerField(default=0)
+
+    entry_updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta(TypedModelMeta):
+        constraints: Sequence[models.BaseConstraint] = [
+            models.UniqueConstraint(
+                fields=["topic", "year", "week"],
+                name="unique_topic_week",
+            ),
+        ]
+
+    @override
+    def __str__(self) -> str:
+        return f"{self.topic} {self.week}/{self.year}: {self.story_count}"
+
+
 class CustomUser(AbstractUser):
     premium_active = models.BooleanField(default=False)
     premium_active_from = models.DateTimeField(blank=True, null=True)
@@ -1099,13 +1720,17 @@ class CustomUser(AbstractUser):
         return 2
 
     def notifications_sent(self, last_minutes=15):
+        """Mention emails sent in the last minutes.
+
+        The notifications of the same digest have the same email_sent_at.
+        """
         t = timezone.now() - datetime.timedelta(minutes=last_minutes)
         ns = (
             MentionNotification.objects.filter(mention__user__pk=self.pk)
             .filter(email_sent=True)
             .filter(email_sent_at__gte=t)
         )
-        return ns.count()
+        return ns.values("email_sent_at").distinct().count()
 
 
 class AD(models.Model):
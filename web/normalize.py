@@ -0,0 +1,145 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import dataclasses
+import functools
+import hashlib
+import importlib.metadata
+
+import cleanurl
+
+from web import tags as web_tags, title as web_title
+from web.category import Category
+from web.platform import Platform
+
+# Bump when a change to the tag, title or category rules or to this
+# module changes the normalized fields of existing discussions.
+RULES_VERSION = 1
+
+
+def __version():
+    h = hashlib.sha1(usedforsecurity=False)
+    h.update(str(RULES_VERSION).encode())
+    h.update(importlib.metadata.version("cleanurl").encode())
+    return h.hexdigest()[:16]
+
+
+# Changes with RULES_VERSION and with the version of cleanurl, stored in
+# Discussion.normalizer_version to find the rows to renormalize.
+VERSION = __version()
+
+
+@dataclasses.dataclass(frozen=True)
+class NormalizedStory:
+    """URL, title, tags and category of a story after normalization.
+
+    scheme and schemeless_url are None if the URL was dropped because too
+    long.
+    """
+
+    scheme: str | None
+    schemeless_url: str | None
+    canonical_url: str | None
+    title: str
+    tags: tuple[str, ...]
+    category: Category
+
+    @property
+    def story_url(self) -> str | None:
+        if not self.scheme or not self.schemeless_url:
+            return None
+
+        return f"{self.scheme}://{self.schemeless_url}"
+
+
+def normalize_story(
+    title: str | None,
+    scheme: str | None,
+    schemeless_url: str | None,
+    tags: list[str] | None,
+    platform: Platform | None,
+    *,
+    url_max_len: int | None = None,
+) -> NormalizedStory:
+    """Normalize a story, parsing its URL and title only once.
+
+    Results are memoized, the same story is normalized many times by
+    ingestion, the weekly digests and the periodic renormalization.
+    """
+    return __normalize_story(
+        title or "",
+        scheme,
+        schemeless_url,
+        tuple(sorted(set(tags or []))),
+        platform,
+        url_max_len,
+    )
+
+
+@functools.lru_cache(maxsize=20_000)
+def __normalize_story(
+    title,
+    scheme,
+    schemeless_url,
+    tags,
+    platform,
+    url_max_len,
+):
+    u = None
+    canonical_url = None
+    if schemeless_url:
+        u = cleanurl.cleanurl("//" + schemeless_url)
+        canonical_url = u.schemeless_url if u else None
+
+    if not canonical_url:
+        canonical_url = schemeless_url
+
+    if url_max_len:
+        if schemeless_url and len(schemeless_url) > url_max_len:
+            schemeless_url = None
+        if canonical_url and len(canonical_url) > url_max_len:
+            canonical_url = None
+
+    if not schemeless_url and not canonical_url:
+        scheme = None
+
+    story_url = ""
+    if scheme and schemeless_url:
+        story_url = f"{scheme}://{schemeless_url}"
+
+    normalized_title = web_title.normalize(
+        title,
+        platform,
+        story_url,
+        stem=False,
+    )
+
+    normalized_tags = web_tags.from_normalized(
+        tags,
+        platform,
+        title,
+        normalized_title,
+        u if story_url else None,
+    )
+
+    host, path = "", ""
+    if u and canonical_url:
+        host = (u.hostname or "").strip()
+        path = (u.path or "").strip()
+
+    category = Category.from_normalized(
+        title,
+        canonical_url or "",
+        host,
+        path,
+        normalized_title.split(),
+        set(normalized_tags),
+        platform,
+    )
+
+    return NormalizedStory(
+        scheme=scheme,
+        schemeless_url=schemeless_url,
+        canonical_url=canonical_url,
+        title=normalized_title,
+        tags=tuple(sorted(normalized_tags)),
+        category=category,
+    )
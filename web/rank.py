@@ -1,10 +1,18 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import itertools
+import logging
+
 import igraph as ig
 import matplotlib.pyplot as plt
 import networkx as nx
+import numpy as np
+from django.db import connection, transaction
+from scipy import sparse
 
 from web import models
 
+logger = logging.getLogger(__name__)
+
 
 def plot(g):
     nx.draw(g)
@@ -50,4 +58,113 @@ def links_to_igraph():
 
 
 def pagerank(g):
-    return nx.pagerank_scipy(g)
+    return nx.pagerank(g)
+
+
+def _stream_pairs(queryset, dtypes, chunk_size):
+    """Columns of a values_list queryset of pairs as two NumPy arrays."""
+    firsts, seconds = [], []
+    rows = queryset.iterator(chunk_size=chunk_size)
+    for chunk in itertools.batched(rows, chunk_size):
+        first, second = zip(*chunk, strict=True)
+        firsts.append(np.fromiter(first, dtype=dtypes[0], count=len(chunk)))
+        seconds.append(np.fromiter(second, dtype=dtypes[1], count=len(chunk)))
+
+    if not firsts:
+        return np.empty(0, dtypes[0]), np.empty(0, dtypes[1])
+    return np.concatenate(firsts), np.concatenate(seconds)
+
+
+def links_to_arrays(chunk_size=100_000):
+    """Source and target resource ids of all the links."""
+    links = models.Link.objects.values_list(
+        "from_resource_id",
+        "to_resource_id",
+    ).order_by()
+    return _stream_pairs(links, (np.int64, np.int64), chunk_size)
+
+
+def compact(src, dst):
+    """Map resource ids to 0..n-1 and drop duplicate links.
+
+    Returns the sorted resource ids (the nodes) and the links as node
+    indexes.
+    """
+    nodes, inverse = np.unique(np.concatenate([src, dst]), return_inverse=True)
+    src, dst = inverse[: len(src)], inverse[len(src) :]
+
+    edges = np.unique(src * len(nodes) + dst)
+    return nodes, edges // len(nodes), edges % len(nodes)
+
+
+def previous_pagerank(nodes, chunk_size=100_000):
+    """Stored pagerank of nodes, to warm start pagerank_csr."""
+    ids, scores = _stream_pairs(
+        models.Resource.objects.filter(pagerank__gt=0)
+        .values_list("id", "pagerank")
+        .order_by(),
+        (np.int64, np.float64),
+        chunk_size,
+    )
+
+    x = np.zeros(len(nodes))
+    if len(nodes) == 0:
+        return x
+
+    i = np.searchsorted(nodes, ids).clip(max=len(nodes) - 1)
+    found = nodes[i] == ids
+    x[i[found]] = scores[found]
+    return x
+
+
+def pagerank_csr(n, src, dst, *, x0=None, alpha=0.85, tol=1e-6, max_iter=100):
+    """PageRank of a graph of n nodes by power iteration.
+
+    Same results as networkx.pagerank: dangling nodes link to all the
+    nodes and iteration stops when the L1 change is below n * tol.
+    Returns the scores and the number of iterations.
+    """
+    if n == 0:
+        return np.empty(0), 0
+
+    out_degree = np.bincount(src, minlength=n).astype(np.float64)
+    # column stochastic transition matrix, stored by row for M @ x
+    m = sparse.csr_matrix(
+        (1 / out_degree[src], (dst, src)),
+        shape=(n, n),
+    )
+    dangling = out_degree == 0
+
+    x = np.full(n, 1 / n) if x0 is None or x0.sum() <= 0 else x0 / x0.sum()
+
+    for i in range(1, max_iter + 1):
+        last = x
+        x = alpha * (m @ last + last[dangling].sum() / n) + (1 - alpha) / n
+        if np.abs(x - last).sum() < n * tol:
+            return x, i
+
+    logger.warning(f"pagerank: not converged after {max_iter} iterations")
+    return x, max_iter
+
+
+def write_pagerank(nodes, scores):
+    """Store scores in Resource.pagerank, return the rows changed."""
+    table = models.Resource._meta.db_table  # noqa: SLF001
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "create temporary table pagerank_update "
+            "(id bigint primary key, pagerank double precision) "
+            "on commit drop",
+        )
+        with cursor.copy(
+            "copy pagerank_update (id, pagerank) from stdin",
+        ) as c:
+            for row in zip(nodes.tolist(), scores.tolist(), strict=True):
+                c.write_row(row)
+
+        cursor.execute(
+            f"update {table} r set pagerank = u.pagerank "  # noqa: S608
+            "from pagerank_update u "
+            "where r.id = u.id and r.pagerank is distinct from u.pagerank",
+        )
+        return cursor.rowcount
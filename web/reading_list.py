@@ -2,6 +2,7 @@
 import logging
 
 from web import models, topics
+from web.category import Category
 
 logger = logging.getLogger(__name__)
 
@@ -11,45 +12,32 @@ def get_reading_list(topic, category):
     if not t:
         return None
 
-    tags = "".join(t.get("tags", set()))
+    tags = list(t.get("tags", set()))
     platform = t.get("platform", "")
 
-    subquery_where = ""
+    story_where = "true"
     if tags:
-        subquery_where = """
-        array(select unnest(normalized_tags)
-            from web_discussion wd
-            where
-                wd.canonical_story_url = web_discussion.canonical_story_url)
-                && array[%(tags)s]::varchar[]"""
+        story_where = "web_story.normalized_tags && %(tags)s::varchar[]"
     elif platform:
-        subquery_where = """
-        %(platform)s in (select platform
-            from web_discussion wd
-            where
-                wd.canonical_story_url = web_discussion.canonical_story_url)"""
+        story_where = "%(platform)s = any(web_story.platforms)"
+
+    if isinstance(category, str):
+        category = Category[category.upper()]
 
     return models.Discussion.objects.raw(
         f"""
  with web_discussion_quartile as (
     select
-        ntile(100) over(partition by platform order by score, comment_count) score_quartile,
-        web_discussion_total.total_comments,
-        web_discussion_total.total_discussions,
-        *
+        ntile(100) over(partition by _platform order by score, comment_count) score_quartile,
+        web_story.total_comments,
+        web_story.total_discussions,
+        web_discussion.*
     from web_discussion
-        left join lateral
-        (select sum(comment_count) as total_comments,
-                count(*) as total_discussions
-            from web_discussion wd
-                where
-                wd.canonical_story_url = web_discussion.canonical_story_url and
-                wd.comment_count >= 2 and
-                wd.score >= 2
-        ) as web_discussion_total on true
+        join web_story
+            on web_story.canonical_url = web_discussion.canonical_story_url
      where
-    {subquery_where}
- and %(category)s in (select category
+    {story_where}
+ and %(category)s in (select _category
             from web_discussion wd
             where
                 wd.canonical_story_url = web_discussion.canonical_story_url)
@@ -60,9 +48,9 @@ select *
 from web_discussion_quartile
 where
 score_quartile = 100
-order by platform, score desc, comment_count desc
+order by _platform, score desc, comment_count desc
 """,  # noqa: S608
-        {"tags": tags, "platform": platform, "category": category},
+        {"tags": tags, "platform": platform, "category": category.value},
     )
 
 
@@ -1,6 +1,7 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import collections
 import datetime
-import io
+import itertools
 import json
 import logging
 import os
@@ -8,6 +9,7 @@ import re
 import shutil
 import statistics
 import time
+from http import HTTPStatus
 from pathlib import Path
 
 import cleanurl
@@ -25,10 +27,20 @@ from django_redis import get_redis_connection
 
 from discussions.settings import APP_CELERY_TASK_MAX_TIME
 
-from . import celery_util, http, models, util, worker
+from . import celery_util, http, ingest, models, util, worker
 
 logger = logging.getLogger(__name__)
 
+__update_fields = ingest.update_fields(
+    "created_at",
+    "scheme_of_story_url",
+    "schemeless_story_url",
+    "title",
+    "comment_count",
+    "score",
+    "tags",
+)
+
 
 # filled in apps.WebConfig.ready
 subreddit_blacklist: set[str] = set()
@@ -158,22 +170,22 @@ def _url_from_selftext(selftext, title=None):
     return None
 
 
-def __process_archive_line(line):
+def __parse_archive_line(line):
     p = json.loads(line)
     if p.get("subreddit") not in subreddit_whitelist:
-        return
+        return None
 
     if p.get("over_18"):
-        return
+        return None
     if p.get("is_reddit_media_domain"):
-        return
+        return None
     if p.get("hidden"):
-        return
+        return None
     # if p.get("media"):
     if (p.get("score") or 0) < 1:
-        return
+        return None
     if (p.get("num_comments") or 0) <= 2:
-        return
+        return None
 
     platform_id = "r" + p.get("id")
 
@@ -194,7 +206,7 @@ def __process_archive_line(line):
         story_url = u.schemeless_url
 
     if _url_blacklisted(story_url):
-        return
+        return None
 
     created_at = None
     if p.get("created_utc"):
@@ -206,20 +218,68 @@ def __process_archive_line(line):
     subreddit = p.get("subreddit") or ""
     if not subreddit:
         logger.warning(f"Reddi archive: no subreddit {platform_id}")
-        return
+        return None
 
-    _ = models.Discussion.objects.update_or_create(
-        pk=platform_id,
-        defaults={
-            "comment_count": p.get("num_comments") or 0,
-            "score": p.get("score") or 0,
-            "created_at": created_at,
-            "scheme_of_story_url": scheme,
-            "schemeless_story_url": story_url,
-            "title": p.get("title"),
-            "tags": [subreddit.lower()],
-        },
+    discussion = models.Discussion(
+        platform_id=platform_id,
+        comment_count=p.get("num_comments") or 0,
+        score=p.get("score") or 0,
+        created_at=created_at,
+        scheme_of_story_url=scheme,
+        schemeless_story_url=story_url,
+        title=p.get("title"),
+        tags=[subreddit.lower()],
     )
+    discussion.pre_save()
+
+    return discussion
+
+
+def __init_archive_worker(whitelist):
+    global subreddit_whitelist  # noqa: PLW0603
+    subreddit_whitelist = whitelist
+
+
+def __parse_archive_lines(data):
+    """Parse a chunk of archive lines in a worker process."""
+    discussions = []
+    for line in data.splitlines():
+        try:
+            discussion = __parse_archive_line(line)
+        except Exception:
+            logger.info(
+                "reddit archive: line failed: \n\n %s",
+                line,
+                exc_info=True,
+            )
+            continue
+
+        if discussion:
+            discussions.append(discussion)
+
+    return discussions
+
+
+def __archive_chunks(stream, offset, chunk_size=8 * 1024 * 1024):
+    """Yield (end offset, lines) reading stream from offset.
+
+    Each chunk contains only complete lines.
+    """
+    _ = stream.seek(offset)
+    rest = b""
+    while True:
+        data = stream.read(chunk_size)
+        if not data:
+            break
+        offset += len(data)
+        data = rest + data
+        end = data.rfind(b"\n") + 1
+        rest = data[end:]
+        if end:
+            yield offset - len(rest), data[:end]
+
+    if rest:
+        yield offset, rest
 
 
 def __get_reddit_archive_links(client, starting_from=None):
@@ -245,6 +305,92 @@ def __get_reddit_archive_links(client, starting_from=None):
     return chosen_files
 
 
+def __download_archive(client, file, file_name):
+    """Download file to file_name, resuming a partial download."""
+    size = file_name.stat().st_size if file_name.is_file() else 0
+    headers = {"Range": f"bytes={size}-"} if size else {}
+
+    with client.get(file, stream=True, headers=headers) as res:
+        if res.status_code == HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE:
+            return
+        res.raise_for_status()
+        mode = "ab" if res.status_code == HTTPStatus.PARTIAL_CONTENT else "wb"
+        logger.debug(f"reddit archive: start download {file} from {size}")
+        with file_name.open(mode) as f:
+            shutil.copyfileobj(res.raw, f)
+        logger.debug(f"reddit archive: end download {file}")
+
+
+def __import_archive(task, file, file_name, offset_key):
+    """Import the archive starting from the last checkpoint.
+
+    Return False if interrupted by a graceful exit.
+    """
+    offset = int(cache.get(offset_key) or 0)
+    workers = settings.APP_REDDIT_ARCHIVE_WORKERS
+    start_time = time.monotonic()
+    start_offset = offset
+    count = 0
+
+    with (
+        file_name.open("rb") as f,
+        zstandard.ZstdDecompressor(
+            max_window_size=2**31,
+        ).stream_reader(f, read_across_frames=True) as stream,
+        worker.process_pool(
+            workers,
+            initializer=__init_archive_worker,
+            initargs=(subreddit_whitelist,),
+        ) as executor,
+        ingest.DiscussionBatch(__update_fields, pre_save=False) as batch,
+    ):
+        chunks = __archive_chunks(stream, offset)
+        pending = collections.deque()
+
+        while True:
+            for end, data in itertools.islice(
+                chunks,
+                workers * 2 - len(pending),
+            ):
+                pending.append(
+                    (end, executor.submit(__parse_archive_lines, data)),
+                )
+
+            if not pending:
+                break
+
+            # keep the order so the checkpoint only moves forward
+            end, future = pending.popleft()
+            for discussion in future.result():
+                batch.add(discussion)
+                count += 1
+            batch.flush()
+
+            offset = end
+            cache.set(offset_key, offset, timeout=None)
+
+            if worker.graceful_exit(task):
+                logger.info(
+                    "reddit archive: graceful exit: %s at %s",
+                    file,
+                    offset,
+                )
+                for _, future in pending:
+                    _ = future.cancel()
+                return False
+
+    elapsed = time.monotonic() - start_time
+    logger.info(
+        "reddit archive: %s: %s discussions, %s MiB in %.1fs",
+        file,
+        count,
+        (offset - start_offset) // (1024 * 1024),
+        elapsed,
+    )
+
+    return True
+
+
 @shared_task(bind=True, ignore_result=True)
 def worker_fetch_reddit_archive(self):
     if celery_util.task_is_running(self.request.task, [self.request.id]):
@@ -253,6 +399,9 @@ def worker_fetch_reddit_archive(self):
     cache_prefix = "fetch_reddit_archive"
     cache_timeout = 60 * 60 * 24 * 90
 
+    archive_dir = Path(settings.APP_REDDIT_ARCHIVE_DIR)
+    archive_dir.mkdir(parents=True, exist_ok=True)
+
     for file in __get_reddit_archive_links(client):
         if cache.get(f"{cache_prefix}:processed:{file}"):
             continue
@@ -263,60 +412,31 @@ def worker_fetch_reddit_archive(self):
 
         logger.info(f"reddit archive: processing {file}")
 
-        file_name = "/tmp/discussions_reddit_archive_compressed"  # noqa: S108
+        file_name = archive_dir / file.rsplit("/", 1)[-1]
+        offset_key = f"{cache_prefix}:offset:{file}"
 
-        if not Path(file_name).is_file():
+        if not file_name.is_file():
             _ = cache.delete(f"{cache_prefix}:downloaded:{file}")
 
         if not cache.get(f"{cache_prefix}:downloaded:{file}"):
-            with client.get(file, stream=True) as res:
-                logger.debug(f"reddit archive: start download {file}")
-                with Path(file_name).open("wb") as f:
-                    shutil.copyfileobj(res.raw, f)
-                logger.debug(f"reddit archive: end download {file}")
-                cache.set(
-                    f"{cache_prefix}:downloaded:{file}",
-                    1,
-                    timeout=cache_timeout,
-                )
-
-        f = Path(file_name).open("rb")  # noqa: SIM115
-
-        stream = zstandard.ZstdDecompressor(
-            max_window_size=2**31,
-        ).stream_reader(f, read_across_frames=True)
-
-        text = io.TextIOWrapper(stream, encoding="utf-8")
-
-        graceful_exit = False
-
-        for line, c in enumerate(text):
-            if c % 1_000_000 == 0:
-                logger.info(f"reddit archive: File {file}, line {c}")
-                if worker.graceful_exit(self):
-                    logger.info("reddit archive: graceful exit")
-                    graceful_exit = True
-                    break
-
-            try:
-                __process_archive_line(line)
-            except Exception:  # noqa: BLE001
-                logger.info(
-                    "reddit archive: line failed: \n\n %s",
-                    line,
-                    exc_info=True,
-                )
-
-        stream.close()
-        f.close()
-        Path(file_name).unlink()
-
-        if not graceful_exit:
+            __download_archive(client, file, file_name)
             cache.set(
-                f"{cache_prefix}:processed:{file}",
+                f"{cache_prefix}:downloaded:{file}",
                 1,
                 timeout=cache_timeout,
             )
+            _ = cache.delete(offset_key)
+
+        if not __import_archive(self, file, file_name, offset_key):
+            break
+
+        file_name.unlink()
+        _ = cache.delete(offset_key)
+        cache.set(
+            f"{cache_prefix}:processed:{file}",
+            1,
+            timeout=cache_timeout,
+        )
 
         time.sleep(5)
 
@@ -390,7 +510,14 @@ def get_subreddit(
     return stories
 
 
-def __process_post(p):
+def __discussion_batch(size=500):
+    return ingest.DiscussionBatch(
+        (*__update_fields, "archived"),
+        size=size,
+    )
+
+
+def __process_post(p, batch):
     platform_id = f"r{p.id}"
 
     if p.over_18:
@@ -432,18 +559,7 @@ def __process_post(p):
 
     subreddit = p.subreddit.display_name.lower()
 
-    try:
-        discussion = models.Discussion.objects.get(pk=platform_id)
-        discussion.comment_count = p.num_comments or 0
-        discussion.score = p.score or 0
-        discussion.created_at = created_at
-        discussion.scheme_of_story_url = scheme
-        discussion.schemeless_story_url = story_url
-        discussion.title = p.title
-        discussion.archived = p.archived
-        discussion.tags = [subreddit]
-        discussion.save()
-    except models.Discussion.DoesNotExist:
+    batch.add(
         models.Discussion(
             platform_id=platform_id,
             comment_count=p.num_comments or 0,
@@ -454,7 +570,8 @@ def __process_post(p):
             title=p.title,
             archived=p.archived,
             tags=[subreddit],
-        ).save()
+        ),
+    )
 
 
 def search_url(
@@ -470,8 +587,9 @@ def search_url(
         sub = c.subreddit("all")
 
     submissions = sub.search(f'url:"{url}"')
-    for s in submissions:
-        __process_post(s)
+    with __discussion_batch() as batch:
+        for s in submissions:
+            __process_post(s, batch)
 
 
 def search_urls(url_pattern: str) -> None:
@@ -528,10 +646,11 @@ def fetch_discussions(index):
         created_at = []
 
         try:
-            for p in stories:
-                __process_post(p)
-                if p.created_utc:
-                    created_at.append(int(p.created_utc))
+            with __discussion_batch() as batch:
+                for p in stories:
+                    __process_post(p, batch)
+                    if p.created_utc:
+                        created_at.append(int(p.created_utc))
         except (
             prawcore.exceptions.Forbidden,
             prawcore.exceptions.NotFound,
@@ -702,9 +821,13 @@ def worker_stream(self):
 
     subs = "+".join(subreddit_whitelist)
 
-    for p in reddit.subreddit(subs).stream.submissions(pause_after=0):
-        if p:
-            __process_post(p)
-        if worker.graceful_exit(self):
-            logger.info("reddit stream: graceful exit")
-            break
+    with __discussion_batch(size=100) as batch:
+        for p in reddit.subreddit(subs).stream.submissions(pause_after=0):
+            if p:
+                __process_post(p, batch)
+            else:
+                # no new submissions for now
+                batch.flush()
+            if worker.graceful_exit(self):
+                logger.info("reddit stream: graceful exit")
+                break
@@ -0,0 +1,256 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+"""Discussions sitemap, pre-rendered to gzipped files.
+
+Discussions are split into shards by url_key, so that the discussions of
+the same canonical URL are always in the same shard. Ingestion marks the
+shards of the saved discussions as dirty, together with the shards of
+the URLs they moved away from and of the deleted discussions, and
+worker_generate_sitemaps rewrites only those.
+"""
+
+import datetime
+import gzip
+import logging
+import os
+import tempfile
+from collections.abc import Iterable
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from celery import shared_task
+from django.conf import settings
+from django.db.models import Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import FileResponse, Http404
+from django.views.decorators.http import condition
+from django_redis import get_redis_connection
+
+from web import celery_util, ingest, models, util, worker
+
+logger = logging.getLogger(__name__)
+
+redis_dirty_shards = "discussions:sitemap_shards:dirty"
+
+min_comment_count = 5
+# limit of the sitemap protocol
+max_urls = 50_000
+
+
+def shard_count() -> int:
+    return 1 << settings.APP_SITEMAP_SHARD_BITS
+
+
+def shard_of(url_key: int) -> int:
+    bits = settings.APP_SITEMAP_SHARD_BITS
+    return (url_key >> (64 - bits)) + (1 << (bits - 1))
+
+
+def _url_key_range(shard: int) -> tuple[int, int]:
+    """First and last url_key of shard."""
+    bits = settings.APP_SITEMAP_SHARD_BITS
+    first = (shard - (1 << (bits - 1))) << (64 - bits)
+    return first, first + (1 << (64 - bits)) - 1
+
+
+def _shard_path(shard: int) -> Path:
+    return Path(settings.APP_SITEMAP_DIR) / f"discussions-{shard}.xml.gz"
+
+
+def _index_path() -> Path:
+    return Path(settings.APP_SITEMAP_DIR) / "discussions.xml"
+
+
+def __relevant(d):
+    return (
+        d.url_key is not None
+        and d.scheme_of_story_url
+        and d.canonical_story_url
+        and d.comment_count >= min_comment_count
+    )
+
+
+def __mark_dirty(discussions, previous_urls=()):
+    """Mark the shards of discussions and of their previous URLs.
+
+    previous_urls are canonical URLs that may have left a shard, their
+    shard is marked even if no relevant discussion is left.
+    """
+    shards = {shard_of(d.url_key) for d in discussions if __relevant(d)}
+    keys = {util.url_key(u) for u in previous_urls} - {None}
+    shards |= {shard_of(k) for k in keys}
+    if shards:
+        r = get_redis_connection()
+        _ = r.sadd(redis_dirty_shards, *shards)
+
+
+@receiver(ingest.discussions_saved)
+def sitemap_discussions_saved(
+    sender,
+    discussions,
+    created,
+    previous_urls,
+    **kwargs,
+):
+    _ = (sender, created, kwargs)
+    __mark_dirty(
+        discussions,
+        previous_urls - {d.canonical_story_url for d in discussions},
+    )
+
+
+@receiver(post_save, sender=models.Discussion)
+def sitemap_discussion_saved(sender, instance, created, **kwargs):
+    _ = (sender, created, kwargs)
+    previous_url = instance.saved_canonical_story_url
+    if previous_url == instance.canonical_story_url:
+        previous_url = None
+    __mark_dirty([instance], [previous_url])
+
+
+@receiver(post_delete, sender=models.Discussion)
+def sitemap_discussion_deleted(sender, instance, **kwargs):
+    _ = (sender, kwargs)
+    __mark_dirty([], [instance.saved_canonical_story_url])
+
+
+def __write_atomic(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            _ = f.write(data)
+        Path(tmp).replace(path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+def _render_shard(rows: Iterable[tuple[str, datetime.datetime]]) -> bytes:
+    """Sitemap XML of rows (story URL, last modification time)."""
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">',
+    ]
+    for url, lastmod in rows:
+        loc = escape(util.discussions_canonical_url(url))
+        lines.append(
+            f"<url><loc>{loc}</loc>"
+            f"<lastmod>{lastmod.date().isoformat()}</lastmod></url>",
+        )
+    lines.append("</urlset>\n")
+    return "\n".join(lines).encode()
+
+
+def write_shard(shard: int) -> int:
+    """Regenerate the file of shard, return the number of URLs."""
+    first, last = _url_key_range(shard)
+    stories = (
+        models.Discussion.objects.filter(url_key__gte=first)
+        .filter(url_key__lte=last)
+        .filter(comment_count__gte=min_comment_count)
+        .exclude(scheme_of_story_url__isnull=True)
+        .exclude(canonical_story_url__isnull=True)
+        .values("canonical_story_url")
+        .annotate(
+            scheme=Max("scheme_of_story_url"),
+            lastmod=Max("entry_updated_at"),
+        )
+        .order_by("canonical_story_url")
+    )
+
+    rows = [
+        (f"{s['scheme']}://{s['canonical_story_url']}", s["lastmod"])
+        for s in stories[:max_urls]
+    ]
+    if len(rows) >= max_urls:
+        logger.warning(
+            "sitemap: shard %s has too many URLs, "
+            "increase APP_SITEMAP_SHARD_BITS",
+            shard,
+        )
+
+    __write_atomic(
+        _shard_path(shard),
+        gzip.compress(_render_shard(rows), mtime=0),
+    )
+    return len(rows)
+
+
+def write_index() -> None:
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">',
+    ]
+    for shard in range(shard_count()):
+        path = _shard_path(shard)
+        if not path.exists():
+            continue
+        loc = util.path_with_domain(f"/sitemaps/discussions-{shard}.xml.gz")
+        lastmod = datetime.datetime.fromtimestamp(
+            path.stat().st_mtime,
+            tz=datetime.UTC,
+        )
+        lines.append(
+            f"<sitemap><loc>{escape(loc)}</loc>"
+            f"<lastmod>{lastmod.isoformat(timespec='seconds')}</lastmod>"
+            "</sitemap>",
+        )
+    lines.append("</sitemapindex>\n")
+    __write_atomic(_index_path(), "\n".join(lines).encode())
+
+
+@shared_task(bind=True, ignore_result=True)
+def worker_generate_sitemaps(self):
+    """Regenerate the dirty and the missing shards, then the index."""
+    if celery_util.task_is_running(self.request.task, [self.request.id]):
+        return
+
+    r = get_redis_connection()
+    shards = {int(s) for s in r.spop(redis_dirty_shards, shard_count()) or []}
+    shards |= {s for s in range(shard_count()) if not _shard_path(s).exists()}
+
+    count = 0
+    pending = sorted(shards)
+    while pending:
+        shard = pending.pop()
+        count += write_shard(shard)
+
+        if worker.graceful_exit(self):
+            logger.info("sitemap: graceful exit")
+            if pending:
+                _ = r.sadd(redis_dirty_shards, *pending)
+            break
+
+    write_index()
+    logger.info(f"sitemap: {len(shards) - len(pending)} shards, {count} URLs")
+
+
+def __serve(path, content_type):
+    def last_modified(request, **kwargs):
+        _ = request
+        try:
+            return datetime.datetime.fromtimestamp(
+                path(**kwargs).stat().st_mtime,
+                tz=datetime.UTC,
+            )
+        except FileNotFoundError:
+            return None
+
+    @condition(last_modified_func=last_modified)
+    def view(request, **kwargs):
+        _ = request
+        try:
+            return FileResponse(
+                path(**kwargs).open("rb"),
+                content_type=content_type,
+            )
+        except FileNotFoundError as e:
+            msg = "404"
+            raise Http404(msg) from e
+
+    return view
+
+
+sitemap_index = __serve(_index_path, "application/xml")
+sitemap_shard = __serve(_shard_path, "application/gzip")
@@ -1,4 +1,6 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+from collections import defaultdict
+
 from django.contrib.sitemaps import Sitemap
 from django.urls import reverse
 from typing_extensions import override
@@ -35,10 +37,18 @@ class WeeklySitemap(Sitemap):
 
     @override
     def items(self):
+        yearweeks = defaultdict(list)
+        rows = weekly.published_yearweeks().values_list("topic", "year", "week")
+        for topic_key, year, week in rows:
+            yearweeks[topic_key].append((year, week))
+
         its = []
         for topic_key in topics.topics:
             its.append(("web:weekly_topic", [topic_key]))
-            for yearweek in weekly.last_nth_yearweeks(topic_key, 3):
+            topic_yearweeks = yearweeks.get(topic_key)
+            if not topic_yearweeks:
+                topic_yearweeks = weekly.last_nth_yearweeks(topic_key, 3)
+            for yearweek in topic_yearweeks:
                 its.append(  # noqa: PERF401
                     (
                         "web:weekly_topic_week",
@@ -1,3 +1,5 @@
+var mentionPreviewController = null;
+
 function mentionFormOnInput(_) {
   const div = document.querySelector("#mention_live_preview");
   const formElement = document.querySelector("#dashboard_mentions_form form");
@@ -23,7 +25,15 @@ function mentionFormOnInput(_) {
 
   div.innerHTML = "<p>Looking results up...</p>";
 
+  // only the latest preview matters, cancel the previous request
+  if (mentionPreviewController) {
+    mentionPreviewController.abort();
+  }
+  const controller = new AbortController();
+  mentionPreviewController = controller;
+
   fetch("/mention_live_preview", {
+    signal: controller.signal,
     credentials: "same-origin",
     body: JSON.stringify(value),
     method: "POST",
@@ -34,7 +44,10 @@ function mentionFormOnInput(_) {
   })
     .then((response) => response.text())
     .then((body) => (div.innerHTML = body))
-    .catch((_) => {
+    .catch((err) => {
+      if (err.name === "AbortError") {
+        return;
+      }
       div.innerHTML =
         "<p>Something went wrong, please retry in a few moments...</p>";
     });
@@ -1,6 +1,22 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+"""Site-wide statistics.
+
+Discussions are rolled up per platform and day and per domain and day.
+Each run of discussions_statistics recomputes only the days of the
+discussions updated since the previous run (entry_updated_at is the
+watermark) and keeps a bounded list of candidate top stories, then
+stores the final statistics in models.Statistics. Deleted discussions
+and the stories that discussions moved away from don't show up in the
+watermark delta, their days and URLs are marked dirty in Redis instead.
+"""
+
+import datetime
+import itertools
+import logging
+
 from celery import shared_task
-from django.db.models import Count, Max, Min, Sum, Value
+from django.db import transaction
+from django.db.models import Count, Max, Min, Q, Sum, Value
 from django.db.models.functions import (
     Coalesce,
     Concat,
@@ -8,35 +24,110 @@ from django.db.models.functions import (
     Length,
     NullIf,
     StrIndex,
+    TruncDate,
 )
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.timezone import make_aware
+from django_redis import get_redis_connection
 
-from web import celery_util, models
+from web import celery_util, ingest, models, worker
 from web.platform import Platform
 
+logger = logging.getLogger(__name__)
 
-def discussions_platform_statistics():
-    stats = (
-        models.Discussion.objects.exclude(canonical_story_url__isnull=True)
-        .values("_platform")
+watermark_key = "statistics:watermark"
+top_stories_key = "statistics:top_stories"
+pending_days_key = "statistics:pending_days"
+redis_dirty_days = "discussions:statistics:days:dirty"
+redis_dirty_urls = "discussions:statistics:urls:dirty"
+
+top_stories_count = 17
+top_domains_count = 23
+# candidates kept for the top stories, stories out of the candidates are
+# reconsidered when one of their discussions is updated
+top_stories_candidates = 200
+# discussions are saved some time before their transaction commits
+watermark_overlap = datetime.timedelta(minutes=10)
+
+
+def __stories():
+    return models.Discussion.objects.exclude(canonical_story_url__isnull=True)
+
+
+def __day_filter(day):
+    if day is None:
+        return Q(created_at__isnull=True)
+
+    start = datetime.datetime.combine(
+        day,
+        datetime.time(),
+        tzinfo=timezone.get_current_timezone(),
+    )
+    return Q(created_at__gte=start) & Q(
+        created_at__lt=start + datetime.timedelta(days=1),
+    )
+
+
+def __rollup_filter(day):
+    if day is None:
+        return Q(day__isnull=True)
+    return Q(day=day)
+
+
+def _domain():
+    return Left(
+        "canonical_story_url",
+        Coalesce(
+            NullIf(StrIndex("canonical_story_url", Value("/")), 0) - 1,
+            Length("canonical_story_url"),
+        ),
+    )
+
+
+def rollup_day(day):
+    """Recompute the platform and domain rollups of day."""
+    stories = __stories().filter(__day_filter(day))
+
+    platforms = [
+        models.PlatformDayStatistics(day=day, **s)
+        for s in stories.values("_platform")
         .annotate(
             discussion_count=Count("platform_id"),
             comment_count=Sum("comment_count"),
-            date__oldest_discussion=Min("created_at"),
-            date__newest_discussion=Max("created_at"),
+            oldest_discussion=Min("created_at"),
+            newest_discussion=Max("created_at"),
         )
-        .order_by("-discussion_count")
-    )
+        .order_by()
+    ]
 
-    for s in stats:
-        s["platform"] = Platform(s["_platform"])
+    domains = [
+        models.DomainDayStatistics(day=day, **s)
+        for s in stories.filter(comment_count__gte=2)
+        .annotate(domain=_domain())
+        .values("domain")
+        .annotate(
+            discussion_count=Count("platform_id"),
+            comment_count=Sum("comment_count"),
+        )
+        .order_by()
+    ]
 
-    return stats
+    with transaction.atomic():
+        _ = models.PlatformDayStatistics.objects.filter(
+            __rollup_filter(day),
+        ).delete()
+        _ = models.PlatformDayStatistics.objects.bulk_create(platforms)
+        _ = models.DomainDayStatistics.objects.filter(
+            __rollup_filter(day),
+        ).delete()
+        _ = models.DomainDayStatistics.objects.bulk_create(domains)
 
 
-def discussions_top_stories():
-    stats = (
-        models.Discussion.objects.exclude(canonical_story_url__isnull=True)
-        .exclude(canonical_story_url__startswith="reddit.com/")
+def __story_statistics(discussions):
+    return (
+        discussions.exclude(canonical_story_url__startswith="reddit.com/")
         .values("canonical_story_url")
         .annotate(
             comment_count=Sum("comment_count"),
@@ -48,46 +139,208 @@ def discussions_top_stories():
                 Max("schemeless_story_url"),
             ),
         )
-        .order_by("-comment_count")
     )
 
-    return stats[:17]
 
+def __get_bag(key):
+    bag = models.DataBag.objects.filter(key=key).first()
+    return bag.value if bag else None
 
-def discussions_top_domains():
+
+def __set_bag(key, value):
+    # saving a new DataBag over an existing row would reset entry_created_at
+    bag = models.DataBag.objects.filter(key=key).first()
+    bag = bag or models.DataBag(key=key)
+    bag.value = value
+    bag.save()
+
+
+def _merge_top_stories(candidates, updated, k):
+    """Replace the updated stories in candidates and keep the top k."""
+    stories = {s["canonical_story_url"]: s for s in candidates}
+    for s in updated:
+        stories[s["canonical_story_url"]] = s
+
+    top = sorted(
+        stories.values(),
+        key=lambda s: s["comment_count"] or 0,
+        reverse=True,
+    )
+    return top[:k]
+
+
+def update_top_stories(changed, previous_urls=()):
+    """Update the candidate top stories.
+
+    changed are the discussions updated since the last run or None to
+    rebuild the candidates from all the discussions. previous_urls are
+    the stories that lost discussions since the last run.
+    """
+    if changed is None:
+        candidates = list(
+            __story_statistics(__stories()).order_by("-comment_count")[
+                :top_stories_candidates
+            ],
+        )
+    else:
+        candidates = __get_bag(top_stories_key) or []
+        urls = changed.values_list("canonical_story_url", flat=True)
+        urls = urls.distinct().order_by()
+        for batch in itertools.batched(
+            itertools.chain(urls.iterator(), previous_urls),
+            1_000,
+        ):
+            updated = __story_statistics(
+                __stories().filter(canonical_story_url__in=batch),
+            ).order_by()
+            # stories left without discussions are not in updated
+            recomputed = set(batch)
+            candidates = _merge_top_stories(
+                [
+                    c
+                    for c in candidates
+                    if c["canonical_story_url"] not in recomputed
+                ],
+                updated,
+                top_stories_candidates,
+            )
+
+    __set_bag(top_stories_key, candidates)
+
+    return candidates
+
+
+def discussions_platform_statistics():
     stats = (
-        models.Discussion.objects.exclude(canonical_story_url__isnull=True)
-        .filter(comment_count__gte=2)
+        models.PlatformDayStatistics.objects.values("_platform")
         .annotate(
-            domain=Left(
-                "canonical_story_url",
-                Coalesce(
-                    NullIf(StrIndex("canonical_story_url", Value("/")), 0) - 1,
-                    Length("canonical_story_url"),
-                ),
-            ),
+            discussion_count=Sum("discussion_count"),
+            comment_count=Sum("comment_count"),
+            date__oldest_discussion=Min("oldest_discussion"),
+            date__newest_discussion=Max("newest_discussion"),
         )
-        .values("domain")
+        .order_by("-discussion_count")
+    )
+
+    for s in stats:
+        s["platform"] = Platform(s["_platform"])
+
+    return stats
+
+
+def discussions_top_domains():
+    stats = (
+        models.DomainDayStatistics.objects.values("domain")
         .annotate(
             comment_count=Sum("comment_count"),
-            discussion_count=Count("platform_id"),
+            discussion_count=Sum("discussion_count"),
         )
         .order_by("-discussion_count")
     )
 
-    return stats[:23]
+    return stats[:top_domains_count]
 
 
 @shared_task(bind=True, ignore_result=True)
 def discussions_statistics(self):
     if celery_util.task_is_running(self.request.task, [self.request.id]):
         return
+
+    started_at = timezone.now()
+    watermark = __get_bag(watermark_key)
+
+    r = get_redis_connection()
+    dirty_days = r.spop(redis_dirty_days, 10_000) or []
+    dirty_urls = [u.decode() for u in r.spop(redis_dirty_urls, 10_000) or []]
+
+    stories = __stories()
+    changed = None
+    if watermark:
+        changed = stories.filter(entry_updated_at__gt=watermark)
+
+    days = set(
+        (changed if changed is not None else stories)
+        .annotate(day=TruncDate("created_at"))
+        .values_list("day", flat=True)
+        .distinct()
+        .order_by(),
+    )
+    # days left over by a graceful exit and days of deleted discussions
+    days |= {
+        datetime.date.fromisoformat(d) if d else None
+        for d in (__get_bag(pending_days_key) or [])
+        + [d.decode() for d in dirty_days]
+    }
+
+    logger.info(f"statistics: {len(days)} days to roll up since {watermark}")
+
+    top_stories = update_top_stories(changed, dirty_urls)
+
+    pending = sorted(days, key=lambda d: d or datetime.date.min)
+    while pending:
+        rollup_day(pending.pop())
+
+        if pending and worker.graceful_exit(self):
+            logger.info("statistics: graceful exit")
+            break
+
+    __set_bag(pending_days_key, pending)
+    __set_bag(watermark_key, started_at - watermark_overlap)
+
     models.Statistics.update_platform_statistics(
         list(discussions_platform_statistics()),
     )
     models.Statistics.update_top_stories_statistics(
-        list(discussions_top_stories()),
+        top_stories[:top_stories_count],
     )
     models.Statistics.update_top_domains_statistics(
         list(discussions_top_domains()),
     )
+
+
+def __day(d):
+    """Day of d as computed by TruncDate("created_at"), as a string."""
+    if not d.created_at:
+        return ""
+    created_at = d.created_at
+    if timezone.is_naive(created_at):
+        created_at = make_aware(created_at)
+    return timezone.localdate(created_at).isoformat()
+
+
+def __mark_dirty(days=(), urls=()):
+    r = get_redis_connection()
+    if days:
+        _ = r.sadd(redis_dirty_days, *days)
+    urls = set(urls) - {None}
+    if urls:
+        _ = r.sadd(redis_dirty_urls, *urls)
+
+
+@receiver(post_delete, sender=models.Discussion)
+def statistics_discussion_deleted(sender, instance, **kwargs):
+    _ = (sender, kwargs)
+    if instance.saved_canonical_story_url is not None:
+        __mark_dirty([__day(instance)], [instance.saved_canonical_story_url])
+
+
+@receiver(post_save, sender=models.Discussion)
+def statistics_discussion_saved(sender, instance, created, **kwargs):
+    _ = (sender, created, kwargs)
+    previous_url = instance.saved_canonical_story_url
+    if previous_url != instance.canonical_story_url:
+        __mark_dirty(urls=[previous_url])
+
+
+@receiver(ingest.discussions_saved)
+def statistics_discussions_saved(
+    sender,
+    discussions,
+    created,
+    previous_urls,
+    **kwargs,
+):
+    _ = (sender, created, kwargs)
+    __mark_dirty(
+        urls=previous_urls - {d.canonical_story_url for d in discussions},
+    )
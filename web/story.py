@@ -0,0 +1,76 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import itertools
+import logging
+import operator
+import time
+
+from celery import shared_task
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from web import celery_util
+
+from . import ingest, models, worker
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=models.Discussion)
+@receiver(post_delete, sender=models.Discussion)
+def process_discussion(sender, instance, **kwargs):
+    _ = (sender, kwargs)
+    # the story the discussion left, if its canonical URL changed
+    models.Story.refresh(
+        [instance.canonical_story_url, instance.saved_canonical_story_url],
+    )
+
+
+@receiver(ingest.discussions_saved)
+def process_discussions(sender, discussions, created, previous_urls, **kwargs):
+    _ = (sender, created, kwargs)
+    models.Story.refresh(
+        {d.canonical_story_url for d in discussions} | previous_urls,
+    )
+
+
+@shared_task(bind=True, ignore_result=True)
+def worker_refresh_all_stories(self):
+    """Rebuild the Story table from scratch."""
+    if celery_util.task_is_running(self.request.task, [self.request.id]):
+        return
+
+    start_time = time.monotonic()
+    batch_size = 1000
+    stories = []
+    count = 0
+
+    discussions = (
+        models.Story.story_discussions()
+        .values(*models.Story.DISCUSSION_FIELDS)
+        .order_by("canonical_story_url")
+    )
+
+    for url, ds in itertools.groupby(
+        discussions.iterator(chunk_size=10_000),
+        key=operator.itemgetter("canonical_story_url"),
+    ):
+        stories.append(models.Story.from_discussions(url, list(ds)))
+        if len(stories) < batch_size:
+            continue
+
+        models.Story.upsert(stories)
+        count += len(stories)
+        stories = []
+
+        if worker.graceful_exit(self):
+            logger.info("refresh all stories: graceful exit")
+            break
+
+    models.Story.upsert(stories)
+    count += len(stories)
+
+    logger.info(
+        "refresh all stories: %s stories in %ss",
+        count,
+        time.monotonic() - start_time,
+    )
@@ -1,7 +1,9 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import collections
 import re
 
 import cleanurl
+from typing_extensions import override
 
 from web import title as web_title, util
 from web.platform import Platform
@@ -34,8 +36,64 @@ def __augment_tags(
     tags.add(new_tag)
 
 
+__fedora_re = re.compile(r"\bFedora\b")
+__cors_re = re.compile(r"\bCORS\b")
+__tailwind_css_re = re.compile(r"\btailwind css\b", re.IGNORECASE)
+__htmx_re = re.compile(r"\bhtmx\b", re.IGNORECASE)
+__jvm_re = re.compile(r"\bJVM\b")
+__go_re = re.compile(r"\bGo\b")
+__monty_re = re.compile(r"\bMonty\b")
+__ghc_re = re.compile(r"\bGHC\b")
+__apl_re = re.compile(r"\bAPL\b")
+__k_re = re.compile(r"\bK\b")
+__j_re = re.compile(r"\bJ\b")
+__docker_re = re.compile(r"\bdocker\b", re.IGNORECASE)
+__ci_cd_re = re.compile(r"\bCI/CD\b")
+__k8s_re = re.compile(r"\bk8s\b", re.IGNORECASE)
+__microk8s_re = re.compile(r"\bmicrok8s\b", re.IGNORECASE)
+__heroku_re = re.compile(r"\bHeroku\b")
+__risc_re = re.compile(r"\bRISC\b")
+__ai_re = re.compile(r"\bAI\b")
+__cpp_version_re = re.compile(r"\bC\+\+\d+\b")
+__release_re = re.compile(r".*(^v?|\sv?)(\d+\.?){2,4}[^ ]* release")
+
+
+class _Title(collections.UserList):
+    """Tokens of the normalized title.
+
+    Membership tests use a set, the rules do a lot of them.
+    """
+
+    def __init__(self, tokens: list[str]) -> None:
+        super().__init__(tokens)
+        self.tokens = frozenset(tokens)
+        self.programming_related = None
+
+    @override
+    def __contains__(self, token: object) -> bool:
+        return token in self.tokens
+
+
+class _URL:
+    """The parts of cleanurl.Result used by the rules, parsed once."""
+
+    def __init__(self, url: cleanurl.Result) -> None:
+        self.hostname = url.hostname
+        self.path = url.path.lower() if url.path else url.path
+
+
 def __is_programming_related(title, url=None):
-    return (
+    # title and url are the same for all the rules of a normalize call
+    if isinstance(title, _Title):
+        if title.programming_related is None:
+            title.programming_related = __programming_related(title, url)
+        return title.programming_related
+
+    return __programming_related(title, url)
+
+
+def __programming_related(title, url=None):
+    return bool(
         (
             set(title)
             & {
@@ -55,7 +113,7 @@ def __is_programming_related(title, url=None):
             url
             and url.hostname
             and ("github.com" in url.hostname or "gitlab.com" in url.hostname)
-        )
+        ),
     )
 
 
@@ -66,30 +124,24 @@ def __programming_keyword(tags, title, url, keyword, new_tag=None):
         tags.add(new_tag)
 
 
-def __is_nim_game(title, url=None):
-    if util.is_sublist(title, ["nim", "game"]) or util.is_sublist(
+def __is_nim_game(title):
+    return util.is_sublist(title, ["nim", "game"]) or util.is_sublist(
         title,
         ["game", "of", "nim"],
-    ):
-        return True
-
-    if url:
-        pass
-
-    return False
+    )
 
 
 def __topic_nim(tags, title, url, platform):
     if platform in {
         Platform.HACKER_NEWS,
         Platform.LAMBDA_THE_ULTIMATE,
-    } and not __is_nim_game(title, url):
+    } and not __is_nim_game(title):
         __augment_tags(title, tags, "nim", None, "nimlang")
         __augment_tags(title, tags, "nim", None, "nimlang")
 
     __augment_tags(title, tags, "nimlang")
 
-    if not __is_nim_game(title, url):
+    if not __is_nim_game(title):
         __augment_tags(
             title,
             tags,
@@ -127,7 +179,7 @@ def __topic_unix(tags, title, url, platform, original_title):
     __augment_tags(title, tags, "ubuntu")
     __augment_tags(title, tags, "unix")
 
-    if re.search(r"\bFedora\b", original_title):
+    if __fedora_re.search(original_title):
         tags.add("linux")
 
     __augment_tags(
@@ -193,16 +245,13 @@ def __topic_webdev(tags, title, url, platform, original_title):
 
     if (
         "programming" in tags or __is_programming_related(title, url)
-    ) and re.search(
-        r"\bCORS\b",
-        original_title,
-    ):
+    ) and __cors_re.search(original_title):
         tags.add("webdev")
 
-    if re.search(r"\btailwind css\b", original_title, re.IGNORECASE):
+    if __tailwind_css_re.search(original_title):
         tags.add("webdev")
 
-    if re.search(r"\bhtmx\b", original_title, re.IGNORECASE):
+    if __htmx_re.search(original_title):
         tags.add("htmx")
 
 
@@ -282,7 +331,7 @@ def __topic_java(tags, title, url, platform, original_title):
             title,
             url,
         )
-    ) and re.search(r"\bJVM\b", original_title):
+    ) and __jvm_re.search(original_title):
         tags.add("jvm")
 
     __augment_tags(
@@ -332,7 +381,7 @@ def __topic_golang(tags, title, url, platform, original_title):
 
     if (
         ("programming" in tags or __is_programming_related(title, url))
-        and re.search(r"\bGo\b", original_title)
+        and __go_re.search(original_title)
         and "game" not in title
     ):
         tags.add("golang")
@@ -353,7 +402,7 @@ def __topic_golang(tags, title, url, platform, original_title):
 
 
 def __topic_python(tags, title, url, platform, original_title):
-    if not re.search(r"\bMonty\b", original_title):
+    if not __monty_re.search(original_title):
         if platform in {Platform.HACKER_NEWS, Platform.LAMBDA_THE_ULTIMATE}:
             __augment_tags(title, tags, "python")
 
@@ -373,7 +422,7 @@ def __topic_haskell(tags, title, url, platform, original_title):
     _ = platform
     __augment_tags(title, tags, "haskell")
 
-    if re.search(r"\bGHC\b", original_title) and (
+    if __ghc_re.search(original_title) and (
         __is_programming_related(title, url)
         or (url and url.hostname and "haskell.org" in url.hostname)
     ):
@@ -452,13 +501,12 @@ def __topic_apl(tags, title, url, platform, original_title):
         Platform.TILDE_NEWS,
         Platform.LOBSTERS,
     }:
-        if re.search(r"\bAPL\b", original_title):
+        if __apl_re.search(original_title):
             tags.add("apl")
         # if url and url.hostname and "github" in url.hostname:
         #     if re.search(r"\K\b", original_title):
         if (
-            re.search(r"\bK\b", original_title)
-            or re.search(r"\bJ\b", original_title)
+            __k_re.search(original_title) or __j_re.search(original_title)
         ) and ("programming" in title or "concatenative" in title):
             tags.add("apl")
 
@@ -470,21 +518,17 @@ def __topic_devops(tags, title, url, platform, original_title):
     if (
         platform == Platform.REDDIT
         and "selfhosted" in tags
-        and re.search(r"\bdocker\b", original_title, re.IGNORECASE)
+        and __docker_re.search(original_title)
     ):
         tags.add("docker")
 
     __augment_tags(title, tags, "devops")
 
-    if re.search(r"\bCI/CD\b", original_title):
+    if __ci_cd_re.search(original_title):
         tags.add("devops")
 
     __augment_tags(title, tags, "kubernetes")
-    if re.search(r"\bk8s\b", original_title, re.IGNORECASE) or re.search(
-        r"\bmicrok8s\b",
-        original_title,
-        re.IGNORECASE,
-    ):
+    if __k8s_re.search(original_title) or __microk8s_re.search(original_title):
         tags.add("kubernetes")
 
     if (
@@ -496,7 +540,7 @@ def __topic_devops(tags, title, url, platform, original_title):
         }
         or "programming" in tags
         or __is_programming_related(title, url)
-    ) and re.search(r"\bHeroku\b", original_title):
+    ) and __heroku_re.search(original_title):
         tags.add("devops")
 
     __augment_tags(
@@ -515,7 +559,7 @@ def __topic_compsci(tags, title, url, platform, original_title):
         "assembly" in tags
         or "programming" in tags
         or __is_programming_related(title, url)
-    ) and re.search(r"\bRISC\b", original_title):
+    ) and __risc_re.search(original_title):
         tags.add("compsci")
 
     if (
@@ -523,7 +567,7 @@ def __topic_compsci(tags, title, url, platform, original_title):
         or "programming" in tags
         or __is_programming_related(title, url)
     ) and (
-        re.search(r"\bAI\b", original_title)
+        __ai_re.search(original_title)
         and ({"model", "models", "robot", "robots"} & set(title))
     ):
         tags.add("machinelearning")
@@ -543,7 +587,7 @@ def __topic_cpp(tags, title, url, platform, original_title):
     _ = title
     _ = url
     _ = platform
-    if re.search(r"\bC\+\+\d+\b", original_title):
+    if __cpp_version_re.search(original_title):
         tags.add("c++")
 
 
@@ -714,85 +758,105 @@ def __from_title_url(tags, title, url):
     ):
         tags |= {"programming"}
 
-    if "programming" in tags and re.match(
-        r".*(^v?|\sv?)(\d+\.?){2,4}[^ ]* release",
-        " ".join(title),
-    ):
+    if "programming" in tags and __release_re.match(" ".join(title)):
         tags.add("release")
 
 
+__renames_table = [
+    ("ai", "machinelearning", "l"),
+    ("apljk", "apl", "r"),
+    ("aws", ["aws", "devops"], "r"),
+    ("azure", ["azure", "devops"], "r"),
+    ("azuredevops", ["azure", "devops"], "r"),
+    ("btc", "bitcoin", "r"),
+    ("c++", "cpp"),
+    ("c#", "csharp"),
+    ("c_language", "c", "r"),
+    ("coding", "programming", "r"),
+    ("common_lisp", "lisp", "r"),
+    ("computerscience", "compsci", "r"),
+    ("cplusplus", "cpp", "r"),
+    ("cprog", "c", "r"),
+    ("c_programming", "c", "r"),
+    ("cprogramming", "c", "r"),
+    ("crypto", "cryptography", "r"),
+    ("d", "dlang", "l"),
+    ("d_language", "dlang", "r"),
+    ("economics", "economy", "r"),
+    ("europes", "europe", "r"),
+    ("go", "golang"),
+    ("googlecloud", ["googlecloud", "devops"], "r"),
+    ("internationalpolitics", "politics", "r"),
+    ("languagetechnology", "nlp", "r"),
+    ("lc", "lambda-calculus", "u"),
+    ("linux_gaming", ["gaming", "linux"], "r"),
+    ("logic-declerative", "logic-declarative", "u"),
+    ("machinelearningnews", "machinelearning", "r"),
+    ("misc-books", "book", "u"),
+    ("ml", "ocaml", "l"),
+    ("moderatepolitics", "politics", "r"),
+    (".net", "dotnet"),
+    ("nim", "nimlang", "r"),
+    ("node", "nodejs", "r"),
+    ("reddit.com", "reddit", "r"),
+    ("rubylang", "ruby", "r"),
+    ("rust_gamedev", ["gamedev", "rustlang"], "r"),
+    ("rust", "rustlang"),
+    ("software-eng", "programming", "u"),
+    ("sports", "sport", "r"),
+    ("squaredcircle", "wrestling", "r"),
+    ("sveltejs", "svelte", "r"),
+    ("swift", "swiftlang"),
+    ("teaching-&-learning", "teaching/learning", "u"),
+    ("technews", ["technology", "news"], "r"),
+    ("theory", ["plt", "compsci"], "u"),
+    ("upliftingnews", "news", "r"),
+    ("wasm", "webassembly", "l"),
+    ("web_design", "webdesign", "r"),
+    ("web", "webdev", "l"),
+    ("worldevents", "news", "r"),
+    ("worldnews", "news", "r"),
+    ("zig", "ziglang", "l"),
+    ("zig", "ziglang", "r"),
+]
+
+
+def __compile_renames(table):
+    """For each platform map a tag to the tags that replace it.
+
+    Replacements are applied in table order, tag by tag, so the result for
+    a set of tags is the union of the results for each of its tags.
+    """
+    tuple_platform_len = 3
+    renames = {}
+    for platform in [None, *Platform]:
+        steps = [
+            (p[0], set(p[1]) if isinstance(p[1], list) else {p[1]})
+            for p in table
+            if len(p) != tuple_platform_len
+            or p[2] == (platform.value if platform else "")
+        ]
+        closure = {}
+        for tag, _ in steps:
+            replaced = {tag}
+            for from_tag, to_tags in steps:
+                if from_tag in replaced:
+                    replaced = (replaced - {from_tag}) | to_tags
+            closure[tag] = frozenset(replaced)
+        renames[platform] = closure
+    return renames
+
+
+__renames = __compile_renames(__renames_table)
+
+
 def __rename(tags, title, platform=None):
     _ = title
-    to_replace = [
-        ("ai", "machinelearning", "l"),
-        ("apljk", "apl", "r"),
-        ("aws", ["aws", "devops"], "r"),
-        ("azure", ["azure", "devops"], "r"),
-        ("azuredevops", ["azure", "devops"], "r"),
-        ("btc", "bitcoin", "r"),
-        ("c++", "cpp"),
-        ("c#", "csharp"),
-        ("c_language", "c", "r"),
-        ("coding", "programming", "r"),
-        ("common_lisp", "lisp", "r"),
-        ("computerscience", "compsci", "r"),
-        ("cplusplus", "cpp", "r"),
-        ("cprog", "c", "r"),
-        ("c_programming", "c", "r"),
-        ("cprogramming", "c", "r"),
-        ("crypto", "cryptography", "r"),
-        ("d", "dlang", "l"),
-        ("d_language", "dlang", "r"),
-        ("economics", "economy", "r"),
-        ("europes", "europe", "r"),
-        ("go", "golang"),
-        ("googlecloud", ["googlecloud", "devops"], "r"),
-        ("internationalpolitics", "politics", "r"),
-        ("languagetechnology", "nlp", "r"),
-        ("lc", "lambda-calculus", "u"),
-        ("linux_gaming", ["gaming", "linux"], "r"),
-        ("logic-declerative", "logic-declarative", "u"),
-        ("machinelearningnews", "machinelearning", "r"),
-        ("misc-books", "book", "u"),
-        ("ml", "ocaml", "l"),
-        ("moderatepolitics", "politics", "r"),
-        (".net", "dotnet"),
-        ("nim", "nimlang", "r"),
-        ("node", "nodejs", "r"),
-        ("reddit.com", "reddit", "r"),
-        ("rubylang", "ruby", "r"),
-        ("rust_gamedev", ["gamedev", "rustlang"], "r"),
-        ("rust", "rustlang"),
-        ("software-eng", "programming", "u"),
-        ("sports", "sport", "r"),
-        ("squaredcircle", "wrestling", "r"),
-        ("sveltejs", "svelte", "r"),
-        ("swift", "swiftlang"),
-        ("teaching-&-learning", "teaching/learning", "u"),
-        ("technews", ["technology", "news"], "r"),
-        ("theory", ["plt", "compsci"], "u"),
-        ("upliftingnews", "news", "r"),
-        ("wasm", "webassembly", "l"),
-        ("web_design", "webdesign", "r"),
-        ("web", "webdev", "l"),
-        ("worldevents", "news", "r"),
-        ("worldnews", "news", "r"),
-        ("zig", "ziglang", "l"),
-        ("zig", "ziglang", "r"),
-    ]
-    for p in to_replace:
-        tuple_platform_len = 3
-        if len(p) == tuple_platform_len and p[2] != (
-            platform.value if platform else ""
-        ):
-            continue
-        if p[0] not in tags:
-            continue
-        tags -= {p[0]}
-        if isinstance(p[1], list):
-            tags |= set(p[1])
-        else:
-            tags |= {p[1]}
+    closure = __renames[platform]
+    to_replace = [t for t in tags if t in closure]
+    tags.difference_update(to_replace)
+    for t in to_replace:
+        tags |= closure[t]
 
 
 def __enrich(tags, title):
@@ -851,24 +915,67 @@ def __special_cases(tags, platform, title, url):
         tags.discard("italy")
 
 
+__from_platform = {
+    Platform.LOBSTERS: __lobsters,
+    Platform.REDDIT: __reddit,
+    Platform.HACKER_NEWS: __hacker_news,
+    Platform.LAARC: __laarc,
+    Platform.LAMBDA_THE_ULTIMATE: __lambda_the_ultimate,
+}
+
+
 def normalize(
     tags: list[str] | set[str],
     platform: Platform | None = None,
     title: str | None = "",
     url: str | None = "",
 ) -> list[str]:
+    title = title or ""
+    url = (url or "").lower()
+
+    normalized_title = web_title.normalize(
+        title,
+        platform,
+        url,
+        tags,
+        stem=False,
+    )
+
+    return from_normalized(
+        tags,
+        platform,
+        title,
+        normalized_title,
+        cleanurl.cleanurl(url),
+    )
+
+
+def from_normalized(
+    tags: list[str] | set[str] | tuple[str, ...],
+    platform: Platform | None,
+    title: str,
+    normalized_title: str,
+    url: cleanurl.Result | None,
+) -> list[str]:
+    """Like normalize, for a title already normalized by title.normalize.
+
+    url is the parsed URL of the story, if any.
+    """
     tags = tags or []
     tags = {t.lower().strip() for t in tags}
-    title = title or ""
     original_title = title
-    url = (url or "").lower()
 
-    title = web_title.normalize(title, platform, url, tags, stem=False)
-    title_tokens = title.split()
+    curl = _URL(url) if url else None
+    title_tokens = _Title(normalized_title.split())
+    from_platform = __from_platform.get(platform)
 
-    curl = cleanurl.cleanurl(url)
+    # Rules feed each other, so apply them until nothing changes. A pass
+    # only depends on the tags, once they are stable the remaining passes
+    # would be no-ops.
+    max_passes = 3
+    for _ in range(max_passes):
+        previous_tags = set(tags)
 
-    for _ in range(3):
         __topic_java(tags, title_tokens, curl, platform, original_title)
         __topic_nim(tags, title_tokens, curl, platform)
         __topic_php(tags, title_tokens, curl, platform)
@@ -895,23 +1002,15 @@ def normalize(
 
         __from_title_url(tags, title_tokens, curl)
 
-        match platform:
-            case Platform.LOBSTERS:
-                __lobsters(tags, title_tokens)
-            case Platform.REDDIT:
-                __reddit(tags, title_tokens)
-            case Platform.HACKER_NEWS:
-                __hacker_news(tags, title_tokens)
-            case Platform.LAARC:
-                __laarc(tags, title_tokens)
-            case Platform.LAMBDA_THE_ULTIMATE:
-                __lambda_the_ultimate(tags, title_tokens)
-            case _:
-                pass
+        if from_platform:
+            from_platform(tags, title_tokens)
 
         __rename(tags, title_tokens, platform)
         __enrich(tags, title_tokens)
 
+        if tags == previous_tags:
+            break
+
     __special_cases(tags, platform, title_tokens, curl)
 
     return sorted(tags)
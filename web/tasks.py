@@ -11,6 +11,7 @@ from celery.utils.log import get_task_logger
 
 from web import (
     archiveis,
+    cache_util,
     crawler,
     db,
     discussions,
@@ -22,7 +23,9 @@ from web import (
     mastodon,
     mention,
     reddit,
+    sitemap_shards,
     statistics,
+    story,
     stripe_util,
     twitter,
     weekly,
@@ -36,6 +39,7 @@ task_logger = get_task_logger(__name__)
 
 # import all the modules containing Celery tasks
 _ = archiveis
+_ = cache_util
 _ = crawler
 _ = db
 _ = discussions
@@ -47,7 +51,9 @@ _ = ltu
 _ = mastodon
 _ = mention
 _ = reddit
+_ = sitemap_shards
 _ = statistics
+_ = story
 _ = stripe_util
 _ = twitter
 _ = weekly
@@ -0,0 +1,111 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import operator
+import threading
+import time
+import unittest
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from web import cache_util
+
+
+@cache_util.cached("test")
+def _double(x, *, y=1):
+    return x * 2 * y
+
+
+class UnitCacheUtil(unittest.TestCase):
+    def test_key(self):
+        assert _double.key(" ABC ") == "cache_util:test:abc"
+        assert _double.key(1, y=2) == "cache_util:test:1:2"
+        assert _double.name == f"{__name__}:_double"
+        assert _double.__name__ == "_double"
+
+
+class CacheUtil(SimpleTestCase):
+    """Needs Redis, like the other non Unit tests."""
+
+    def setUp(self):
+        self.calls = 0
+        _ = cache.delete_pattern("cache_util:test_*")
+
+    def __cached(self, prefix, value=42, sleep=0, **kwargs):
+        def f(x):
+            _ = x
+            self.calls += 1
+            time.sleep(sleep)
+            return value
+
+        f.__qualname__ = f"f_{prefix}"
+        return cache_util.cached(prefix, **kwargs)(f)
+
+    def test_stale(self):
+        f = self.__cached("test_stale", timeout=10, stale_timeout=60)
+        assert f(1) == 42
+
+        later = time.time() + 11
+        with (
+            mock.patch.object(cache_util.time, "time", return_value=later),
+            mock.patch.object(cache_util.refresh_cached, "delay") as delay,
+        ):
+            # the old value is served while a task refreshes it
+            assert f(1) == 42
+            assert f(1) == 42
+            delay.assert_called_once_with(f.name, (1,), {})
+
+        assert self.calls == 1
+
+    def test_empty(self):
+        f = self.__cached(
+            "test_empty",
+            value=[],
+            timeout=600,
+            empty_timeout=5,
+            is_empty=operator.not_,
+        )
+        assert f(1) == []
+        assert f(1) == []
+        assert self.calls == 1
+        # cached, but only for empty_timeout seconds
+        assert 0 < cache.ttl(f.key(1)) <= 5
+
+    def test_coalesce(self):
+        f = self.__cached("test_coalesce", sleep=0.5, lock_wait=5)
+        barrier = threading.Barrier(5)
+        results = []
+
+        def call():
+            _ = barrier.wait()
+            results.append(f(1))
+
+        threads = [threading.Thread(target=call) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        assert results == [42] * 5
+        assert self.calls == 1
+
+    def test_get_many_metrics(self):
+        f = self.__cached("test_metrics")
+        f.set(42, 1)
+        f.set(42, 2)
+        before = cache_util.metrics()
+
+        with mock.patch.object(
+            cache_util,
+            "get_redis_connection",
+            wraps=cache_util.get_redis_connection,
+        ) as get_redis_connection:
+            values = f.get_many([(1,), (2,), (3,)])
+            # one pipeline for all the counters
+            get_redis_connection.assert_called_once()
+
+        assert values == {(1,): 42, (2,): 42}
+        after = cache_util.metrics()
+        for event, n in [("hit", 2), ("miss", 1)]:
+            key = f"test_metrics:{event}"
+            assert after[key] - before.get(key, 0) == n
@@ -0,0 +1,236 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import io
+import time
+import unittest
+from unittest import mock
+
+import zstandard
+from bs4 import BeautifulSoup
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase
+from django_redis import get_redis_connection
+
+from web import crawler, models
+
+
+class UnitCrawler(unittest.TestCase):
+    def test_engine_add(self):
+        engine = crawler.Engine(workers=2)
+        engine.add("https://xojoc.pw/a", crawler.Priority.low)
+        engine.add("https://xojoc.pw/b", crawler.Priority.normal)
+        engine.add("https://github.com/xojoc", crawler.Priority.medium)
+        engine.add("ftp://xojoc.pw/c")
+        engine.add("https://www.reddit.com/r/programming")
+
+        assert engine.backlog == 3
+        assert len(engine.ready) == 2
+        assert [u for _, _, u in sorted(engine.hosts["xojoc.pw"])] == [
+            "https://xojoc.pw/b",
+            "https://xojoc.pw/a",
+        ]
+
+
+class Queue(SimpleTestCase):
+    """Needs Redis, like the other non Unit tests."""
+
+    def setUp(self):
+        prefix = "discussions:test_crawler:"
+        patches = [
+            mock.patch.object(crawler, "redis_seen", prefix + "seen"),
+            mock.patch.object(crawler, "redis_queued", prefix + "queued"),
+            mock.patch.dict(
+                crawler.queue_names,
+                {p: f"{prefix}queue:{p.name}" for p in crawler.Priority},
+            ),
+        ]
+        for p in patches:
+            _ = p.start()
+            self.addCleanup(p.stop)
+
+        self.r = get_redis_connection()
+        _ = self.r.delete(
+            crawler.redis_seen,
+            crawler.redis_queued,
+            *crawler.queue_names.values(),
+        )
+
+    def test_enqueue_pop(self):
+        low, normal = crawler.Priority.low, crawler.Priority.normal
+        assert crawler._enqueue(self.r, "https://xojoc.pw/a", low)
+        assert crawler._enqueue(self.r, "https://xojoc.pw/b", low)
+        # already queued
+        assert not crawler._enqueue(self.r, "https://xojoc.pw/a", low)
+        # promoted, the entry in the low queue is superseded
+        assert crawler._enqueue(self.r, "https://xojoc.pw/b", normal)
+
+        assert crawler._pop(self.r, 10) == [
+            ("https://xojoc.pw/b", normal),
+            ("https://xojoc.pw/a", low),
+        ]
+        assert crawler._pop(self.r, 10) == []
+
+        # in flight for a short time only
+        expires_at = self.r.zscore(crawler.redis_seen, "https://xojoc.pw/a")
+        assert expires_at <= time.time() + crawler.in_flight_ttl
+        assert not crawler._enqueue(self.r, "https://xojoc.pw/a", normal)
+
+        crawler._mark_fetched(self.r, ["https://xojoc.pw/a"])
+        expires_at = self.r.zscore(crawler.redis_seen, "https://xojoc.pw/a")
+        assert expires_at > time.time() + crawler.in_flight_ttl
+
+    def test_max_skipped(self):
+        for i in range(5):
+            url = f"https://xojoc.pw/{i}"
+            _ = crawler._enqueue(self.r, url, crawler.Priority.low)
+            _ = crawler._enqueue(self.r, url, crawler.Priority.normal)
+
+        low = crawler.queue_names[crawler.Priority.low]
+        with mock.patch.object(crawler, "max_skipped", 2):
+            assert len(crawler._pop(self.r, 10)) == 5
+            # the superseded entries of the low queue, 2 at a time
+            assert self.r.llen(low) == 3
+            assert crawler._pop(self.r, 10) == []
+            assert self.r.llen(low) == 1
+            assert crawler._pop(self.r, 10) == []
+            assert self.r.llen(low) == 0
+
+    def test_requeue(self):
+        medium = crawler.Priority.medium
+        for url in ["https://xojoc.pw/a", "https://xojoc.pw/b"]:
+            _ = crawler._enqueue(self.r, url, medium)
+        popped = crawler._pop(self.r, 1)
+        assert popped == [("https://xojoc.pw/a", medium)]
+
+        crawler._requeue(self.r, popped)
+        assert crawler._pop(self.r, 1) == popped
+
+        crawler._requeue(self.r, popped, head=False)
+        assert crawler._pop(self.r, 2) == [
+            ("https://xojoc.pw/b", medium),
+            ("https://xojoc.pw/a", medium),
+        ]
+
+    def test_engine_fill(self):
+        low = crawler.Priority.low
+        for i in range(5):
+            _ = crawler._enqueue(self.r, f"https://xojoc.pw/{i}", low)
+        _ = crawler._enqueue(self.r, "https://github.com/xojoc", low)
+
+        engine = crawler.Engine(workers=3, max_backlog=6)
+        engine._Engine__fill(self.r)
+
+        # at most max_backlog // workers URLs per host
+        assert len(engine.hosts["xojoc.pw"]) == 2
+        assert len(engine.hosts["github.com"]) == 1
+        assert self.r.lrange(crawler.queue_names[low], 0, -1) == [
+            f"https://xojoc.pw/{i}".encode() for i in range(2, 5)
+        ]
+
+        # the hosts with many URLs wait for a while
+        engine.hosts["xojoc.pw"].clear()
+        engine.backlog = 1
+        engine._Engine__fill(self.r)
+        assert engine.hosts["xojoc.pw"] == []
+
+        engine.fill_after = 0
+        engine._Engine__fill(self.r)
+        assert len(engine.hosts["xojoc.pw"]) == 2
+
+
+class SaveLinks(TestCase):
+    def test_save_links(self):
+        a, b, c = (
+            models.Resource.objects.create(scheme="https", url=f"xojoc.pw/{p}")
+            for p in "abc"
+        )
+
+        def links(html):
+            return BeautifulSoup(html, "html.parser").find_all("a")
+
+        crawler.save_links(
+            a,
+            links(
+                '<a href="https://xojoc.pw/b" rel="nofollow">b</a>'
+                '<a href="https://xojoc.pw/c">c</a>'
+                '<a href="https://xojoc.pw/c">c</a>'
+                '<a href="https://xojoc.pw/a">self</a>'
+                '<a href="https://example.com/unknown">unknown</a>',
+            ),
+        )
+        first = dict(
+            models.Link.objects.filter(to_resource=b).values_list(
+                "pk",
+                "anchor_rel",
+            ),
+        )
+        assert list(first.values()) == ["['nofollow']"]
+        assert models.Link.objects.filter(to_resource=c).count() == 2
+
+        crawler.save_links(
+            a,
+            links(
+                '<a href="https://xojoc.pw/b" rel="nofollow">b</a>'
+                '<a href="https://xojoc.pw/c">new c</a>',
+            ),
+        )
+        # unchanged links are kept
+        assert models.Link.objects.filter(pk__in=first).count() == 1
+        assert list(
+            models.Link.objects.filter(to_resource=c).values_list(
+                "anchor_text",
+                flat=True,
+            ),
+        ) == ["new c"]
+        assert models.Link.objects.filter(from_resource=a).count() == 2
+
+
+class ResourceContentTest(TestCase):
+    def test_clean_html(self):
+        html = "<html><body><p>discussions</p></body></html>"
+        r = models.Resource(scheme="https", url="xojoc.pw/a")
+        r.clean_html = html
+        r.save()
+
+        r = models.Resource.objects.get(pk=r.pk)
+        assert r.clean_html == html
+
+        _ = models.ZstdDictionary.objects.create(
+            data=zstandard.train_dictionary(
+                1024,
+                [f"<p>{i} discussions</p>".encode() * 20 for i in range(100)],
+            ).as_bytes(),
+        )
+        r.clean_html = html + "<p>more</p>"
+        r.save()
+
+        content = models.Resource.objects.select_related("content").get(
+            pk=r.pk,
+        )
+        assert content.content.dictionary_id is not None
+        assert content.clean_html == html + "<p>more</p>"
+
+        r.clean_html = ""
+        r.save()
+        assert not models.ResourceContent.objects.filter(resource=r).exists()
+
+    def test_copy_resource_content(self):
+        html = "<html><body><p>legacy</p></body></html>"
+        r = models.Resource.objects.create(
+            scheme="https",
+            url="xojoc.pw/b",
+            legacy_clean_html=html,
+        )
+
+        r = models.Resource.objects.get(pk=r.pk)
+        assert r.clean_html == html
+
+        call_command(
+            "copy_resource_content",
+            "--restart",
+            stdout=io.StringIO(),
+        )
+
+        assert models.ResourceContent.objects.get(resource=r).html == html
+
+    def test_train_few_contents(self):
+        assert models.ZstdDictionary.train() is None
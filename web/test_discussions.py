@@ -1,9 +1,24 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import io
+import unittest
 import urllib
 
+from django.core.management import call_command
 from django.test import Client, TestCase
 
-from web import http, models
+from web import http, models, util
+
+
+class UnitLookup(unittest.TestCase):
+    def test_is_story_of(self):
+        d = models.Discussion(
+            schemeless_story_url="www.Example.com/a?ref=x",
+            canonical_story_url="example.com/a",
+        )
+        assert d.is_story_of("www.example.com/a?ref=x", "example.com/a?ref=x")
+        assert d.is_story_of("", "example.com/a")
+        assert not d.is_story_of("www.example.com/b", "example.com/b")
+        assert not d.is_story_of("", "")
 
 
 class LookupTestCase(TestCase):
@@ -40,3 +55,83 @@ class LookupTestCase(TestCase):
         h = http.parse_html(response.content)
         submit_links = h.select(f".submit_links details ul li a[href*='{qu}']")
         assert len(submit_links) >= 1
+
+    def test_title_search(self):
+        models.Discussion.objects.create(
+            platform_id="h124",
+            scheme_of_story_url="https",
+            schemeless_story_url="carnap.info/release",
+            title="The Carnap Programming Language has been released",
+            comment_count=30,
+            score=100,
+        )
+
+        for title_search in models.TitleSearch:
+            ds, _, _ = models.Discussion.of_url_or_title(
+                "Carnap Programming Language released",
+                title_search,
+            )
+            assert "h124" in [d.platform_id for d in ds], title_search
+
+    def test_of_urls(self):
+        urls = ["https://example.com", "http://www.example.com/", "xyz"]
+        discussions = models.Discussion.of_urls(urls)
+
+        assert [d.platform_id for d in discussions[urls[0]]] == ["h123"]
+        assert [d.platform_id for d in discussions[urls[1]]] == ["h123"]
+        assert discussions[urls[2]] == []
+
+    def test_url_key_collision(self):
+        d = models.Discussion.objects.create(
+            platform_id="h124",
+            scheme_of_story_url="https",
+            schemeless_story_url="example.org",
+            title="Example title",
+            comment_count=30,
+            score=100,
+        )
+        # pretend example.org has the same keys as example.com
+        _ = models.Discussion.objects.filter(pk=d.pk).update(
+            url_key=util.url_key("example.com"),
+            schemeless_url_key=util.url_key("example.com"),
+        )
+
+        ds, _, _ = models.Discussion.of_url("https://example.com")
+        assert [d.platform_id for d in ds] == ["h123"]
+
+        discussions = models.Discussion.of_urls(["https://example.com"])
+        assert [d.platform_id for d in discussions["https://example.com"]] == [
+            "h123",
+        ]
+
+    def test_null_url_keys(self):
+        # rows saved before the keys were added, see fill_url_keys
+        _ = models.Discussion.objects.update(
+            url_key=None,
+            schemeless_url_key=None,
+        )
+        r = models.Resource.objects.create(scheme="https", url="example.com")
+        _ = models.Resource.objects.update(
+            url_key=None,
+            schemeless_url_key=None,
+        )
+
+        ds, _, _ = models.Discussion.of_url("https://example.com")
+        assert [d.platform_id for d in ds] == ["h123"]
+        discussions = models.Discussion.of_urls(["https://example.com"])
+        assert [d.platform_id for d in discussions["https://example.com"]] == [
+            "h123",
+        ]
+        assert models.Resource.by_url("https://example.com") == r
+        assert models.Resource.by_urls(["https://example.com"]) == {
+            "https://example.com": r,
+        }
+
+        call_command("fill_url_keys", "--restart", stdout=io.StringIO())
+
+        d = models.Discussion.objects.get(platform_id="h123")
+        assert d.url_key == util.url_key("example.com")
+        assert d.schemeless_url_key == util.url_key("example.com")
+        r = models.Resource.objects.get(pk=r.pk)
+        assert r.url_key == util.url_key(r.canonical_url)
+        assert r.schemeless_url_key == util.url_key("example.com")
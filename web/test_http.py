@@ -0,0 +1,56 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import unittest
+from unittest import mock
+
+from web import http
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class UnitAsyncTokenBucket(unittest.IsolatedAsyncioTestCase):
+    async def test_acquire(self):
+        clock = _Clock()
+
+        with (
+            mock.patch.object(http.time, "monotonic", clock.monotonic),
+            mock.patch.object(
+                http.asyncio,
+                "sleep",
+                mock.AsyncMock(side_effect=clock.sleep),
+            ),
+        ):
+            bucket = http.AsyncTokenBucket(rate=2, capacity=3)
+
+            # a burst of capacity goes through at once
+            for _ in range(3):
+                await bucket.acquire()
+            assert clock.sleeps == []
+
+            # then one every 1 / rate seconds
+            await bucket.acquire()
+            await bucket.acquire()
+            assert sum(clock.sleeps) == 1
+
+            # tokens refill while idle, up to capacity
+            clock.now += 60
+            clock.sleeps.clear()
+            for _ in range(3):
+                await bucket.acquire()
+            assert clock.sleeps == []
+            await bucket.acquire()
+            assert clock.sleeps == [0.5]
+
+    def test_default_capacity(self):
+        assert http.AsyncTokenBucket(rate=0.5).capacity == 1
+        assert http.AsyncTokenBucket(rate=50).capacity == 50
@@ -1,8 +1,18 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
-from django.test import TestCase
+import datetime
+import json
+import unittest
+
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from django.utils import timezone
+from django_redis import get_redis_connection
 
-from web import forms, models
+from web import email_util, forms, ingest, mention, models
 
 
 class Mention(TestCase):
@@ -104,3 +114,263 @@ class Mention(TestCase):
         )
 
         assert r4.mentionnotification_set.filter(discussion=d4).exists()
+
+    def test_batch(self):
+        r1 = models.Mention.objects.create(user=self.user, keyword="discu.eu")
+        update_fields = ingest.update_fields(
+            "created_at",
+            "title",
+            "comment_count",
+        )
+
+        with ingest.DiscussionBatch(update_fields) as batch:
+            batch.add(
+                models.Discussion(
+                    platform_id="h1",
+                    created_at=timezone.now(),
+                    title="Discussions around the web - discu.eu",
+                    comment_count=3,
+                ),
+            )
+            batch.add(
+                models.Discussion(
+                    platform_id="h2",
+                    created_at=timezone.now(),
+                    title="Something else",
+                ),
+            )
+
+        d1 = models.Discussion.objects.get(pk="h1")
+        assert d1.normalized_title
+        assert r1.mentionnotification_set.filter(discussion=d1).exists()
+        assert r1.mentionnotification_set.count() == 1
+
+        with ingest.DiscussionBatch(update_fields) as batch:
+            batch.add(
+                models.Discussion(
+                    platform_id="h1",
+                    created_at=timezone.now(),
+                    title="Discussions around the web - discu.eu",
+                    comment_count=5,
+                ),
+            )
+
+        assert models.Discussion.objects.get(pk="h1").comment_count == 5
+        assert r1.mentionnotification_set.count() == 1
+
+
+@override_settings(
+    EMAIL_BACKEND="django.core.mail.backends.locmem.EmailBackend",
+)
+class MentionEmail(TestCase):
+    def setUp(self):
+        _ = get_redis_connection().delete(email_util.redis_rate_bucket)
+        self.rules = {}
+        for username in ["jacob", "anna"]:
+            user = models.CustomUser.objects.create_user(
+                username=username,
+                email=f"{username}@example.com",
+                password="top_secret",
+            )
+            self.rules[username] = models.Mention.objects.create(
+                user=user,
+                keyword=username,
+            )
+        # the error reports of stripe_util.create_customer
+        mail.outbox = []
+
+    def __notify(self, username, title, email_sent_at=None):
+        d = models.Discussion.objects.create(
+            platform_id=f"h{models.Discussion.objects.count()}",
+            created_at=timezone.now(),
+            title=title,
+        )
+        return models.MentionNotification.objects.create(
+            mention=self.rules[username],
+            discussion=d,
+            email_sent=email_sent_at is not None,
+            email_sent_at=email_sent_at,
+        )
+
+    def test_email_notification(self):
+        _ = self.__notify("jacob", "First")
+        _ = self.__notify("jacob", "Second")
+        _ = self.__notify("anna", "Third")
+
+        _ = mention.email_notification.apply()
+
+        # one digest per user
+        assert sorted(m.to[0] for m in mail.outbox) == [
+            "anna@example.com",
+            "jacob@example.com",
+        ]
+        jacob = next(m for m in mail.outbox if m.to == ["jacob@example.com"])
+        assert jacob.subject == "[Discu] 2 new discussions for you"
+        assert "First" in jacob.body
+        assert "Second" in jacob.body
+        assert not models.MentionNotification.objects.filter(
+            email_sent=False,
+        ).exists()
+        assert (
+            models.CustomUser.objects.get(
+                username="jacob",
+            ).notifications_sent()
+            == 1
+        )
+
+    def test_rate_limit(self):
+        now = timezone.now()
+        for minutes in [1, 5, 10]:
+            _ = self.__notify(
+                "jacob",
+                f"Sent {minutes} minutes ago",
+                now - datetime.timedelta(minutes=minutes),
+            )
+        _ = self.__notify(
+            "anna",
+            "Sent long ago",
+            now - datetime.timedelta(minutes=20),
+        )
+        jacob = self.__notify("jacob", "Pending")
+        anna = self.__notify("anna", "Pending")
+
+        _ = mention.email_notification.apply()
+
+        # 3 digests in the last 15 minutes, jacob's notification waits
+        assert [m.to for m in mail.outbox] == [["anna@example.com"]]
+        jacob.refresh_from_db()
+        anna.refresh_from_db()
+        assert not jacob.email_sent
+        assert anna.email_sent
+
+
+class UnitRuleIndex(unittest.TestCase):
+    def __discussion(self, **kwargs):
+        d = models.Discussion(created_at=timezone.now(), **kwargs)
+        d.pre_save()
+        return d
+
+    def test_match(self):
+        index = mention.RuleIndex(
+            [
+                models.Mention(
+                    pk=1,
+                    base_url="m.xojoc.pw",
+                    keywords=["alexandru", "test1", "test2"],
+                    exclude_platforms=["l", "u"],
+                    subreddits_exclude=["programming"],
+                    min_comments=4,
+                    min_score=3,
+                ),
+                models.Mention(pk=2, base_url="twitter.com/xojoc"),
+                models.Mention(pk=3, keywords=["discu.eu"]),
+                models.Mention(pk=4, keywords=["keywords", "two"]),
+            ],
+        )
+
+        d1 = self.__discussion(
+            platform_id="r1",
+            scheme_of_story_url="https",
+            schemeless_story_url="www.xojoc.pw",
+            title="Alexandru Cojocaru",
+            comment_count=10,
+            score=20,
+            tags=["webdev"],
+        )
+        assert index.match(d1) == [1]
+
+        d1.tags = ["programming"]
+        assert index.match(d1) == []
+
+        d1.comment_count = 1
+        d1.tags = ["webdev"]
+        assert index.match(d1) == []
+
+        d2 = self.__discussion(
+            platform_id="h2",
+            scheme_of_story_url="https",
+            schemeless_story_url="twitter.com/xojoc/status/12345",
+        )
+        assert index.match(d2) == [2]
+
+        d3 = self.__discussion(
+            platform_id="h3",
+            scheme_of_story_url="https",
+            schemeless_story_url="discu.eu",
+            title="Discussions around the web - discu.eu",
+        )
+        assert index.match(d3) == [3]
+
+        d4 = self.__discussion(
+            platform_id="l4",
+            title="title with keywords, they are two.",
+        )
+        assert index.match(d4) == [4]
+
+        d5 = self.__discussion(platform_id="l5", title="two-thirds")
+        assert index.match(d5) == [4]
+
+        d6 = self.__discussion(platform_id="l6", title="twofold keywordsx")
+        assert index.match(d6) == []
+
+
+class MentionPreview(TestCase):
+    def setUp(self):
+        _ = cache.delete_pattern("cache_util:mention_preview:*")
+        for username in ["jacob", "anna"]:
+            _ = models.CustomUser.objects.create_user(
+                username=username,
+                email=f"{username}@example.com",
+                password="top_secret",
+            )
+        self.__discussion("h1", "Alexandru Cojocaru")
+        self.__discussion("h2", "Something else")
+
+    def __discussion(self, platform_id, title):
+        _ = models.Discussion.objects.create(
+            platform_id=platform_id,
+            created_at=timezone.now(),
+            title=title,
+            comment_count=10,
+            score=20,
+        )
+
+    def __preview(self, username, rule):
+        assert self.client.login(username=username, password="top_secret")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse("web:mention_live_preview"),
+                json.dumps(rule),
+                content_type="application/json",
+            )
+        assert response.status_code == 200
+        return response.content.decode(), queries
+
+    def test_live_preview(self):
+        rule = {
+            "keywords": ["AleXandru"],
+            "exclude_platforms": [],
+            "min_comments": 1,
+            "min_score": 1,
+        }
+
+        content, queries = self.__preview("jacob", rule)
+        assert "Alexandru Cojocaru" in content
+        assert "Something else" not in content
+        # the lowercase keyword is matched with contains, not icontains
+        title_queries = [
+            q["sql"] for q in queries if "normalized_title" in q["sql"]
+        ]
+        assert title_queries
+        assert not any("UPPER" in sql for sql in title_queries)
+
+        self.__discussion("h3", "Alexandru again")
+
+        # the preview is cached per user
+        content, queries = self.__preview("jacob", rule)
+        assert "Alexandru again" not in content
+        assert not any("normalized_title" in q["sql"] for q in queries)
+
+        content, _ = self.__preview("anna", rule)
+        assert "Alexandru Cojocaru" in content
+        assert "Alexandru again" in content
@@ -0,0 +1,62 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import unittest
+
+from web import models, normalize
+from web.category import Category
+from web.platform import Platform
+
+
+class UnitNormalize(unittest.TestCase):
+    def test_normalize_story(self):
+        ns = normalize.normalize_story(
+            "Discussions: find comments about an article",
+            "https",
+            "www.github.com/xojoc/discussions?utm_source=x",
+            ["Go"],
+            Platform.LOBSTERS,
+        )
+
+        assert ns.canonical_url == "github.com/xojoc/discussions"
+        assert (
+            ns.story_url
+            == "https://www.github.com/xojoc/discussions?utm_source=x"
+        )
+        assert ns.title == "discussions find comments about an article"
+        assert ns.tags == ("golang", "programming")
+        assert ns.category == Category.PROJECT
+
+        assert ns is normalize.normalize_story(
+            "Discussions: find comments about an article",
+            "https",
+            "www.github.com/xojoc/discussions?utm_source=x",
+            ["Go"],
+            Platform.LOBSTERS,
+        )
+
+    def test_url_max_len(self):
+        url = "xojoc.pw/" + "a" * 100
+        ns = normalize.normalize_story(
+            "A",
+            "https",
+            url,
+            [],
+            None,
+            url_max_len=50,
+        )
+
+        assert ns.scheme is None
+        assert ns.schemeless_url is None
+        assert ns.canonical_url is None
+        assert ns.story_url is None
+
+    def test_version(self):
+        d = models.Discussion(
+            platform_id="l123",
+            title="Discussions",
+            scheme_of_story_url="https",
+            schemeless_story_url="github.com/xojoc/discussions",
+        )
+        d.pre_save()
+
+        assert len(normalize.VERSION) == 16
+        assert d.normalizer_version == normalize.VERSION
@@ -0,0 +1,37 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import unittest
+
+import networkx as nx
+import numpy as np
+
+from web import rank
+
+
+class UnitRank(unittest.TestCase):
+    def test_pagerank_csr(self):
+        rng = np.random.default_rng(42)
+        src = rng.integers(1_000, 1_300, size=2_000)
+        dst = rng.integers(1_000, 1_400, size=2_000)
+
+        nodes, s, d = rank.compact(src, dst)
+        assert len(s) == len(set(zip(src.tolist(), dst.tolist(), strict=True)))
+        assert (nodes[s] == src[0]).any()
+
+        scores, _ = rank.pagerank_csr(len(nodes), s, d)
+
+        g = nx.DiGraph()
+        g.add_edges_from(zip(src.tolist(), dst.tolist(), strict=True))
+        expected = nx.pagerank(g)
+        expected = np.array([expected[n] for n in nodes.tolist()])
+        assert np.abs(scores - expected).max() < 1e-6
+
+        _, cold_iterations = rank.pagerank_csr(len(nodes), s, d, tol=1e-9)
+        warm, iterations = rank.pagerank_csr(
+            len(nodes),
+            s,
+            d,
+            x0=scores,
+            tol=1e-9,
+        )
+        assert iterations < cold_iterations
+        assert np.abs(warm - expected).max() < 1e-5
@@ -1,8 +1,51 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import io
+import tempfile
 import unittest
+from http import HTTPStatus
+from pathlib import Path
+
+import zstandard
 
 from web import reddit
 
+_archive_chunks = reddit.__archive_chunks
+_download_archive = reddit.__download_archive
+
+
+class _Response:
+    def __init__(self, status_code, data):
+        self.status_code = status_code
+        self.raw = io.BytesIO(data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        assert self.status_code < HTTPStatus.BAD_REQUEST
+
+
+class _Client:
+    """Serves data, honoring Range if ranges is True."""
+
+    def __init__(self, data, *, ranges=True):
+        self.data = data
+        self.ranges = ranges
+        self.headers = []
+
+    def get(self, url, *, stream, headers):
+        _ = (url, stream)
+        self.headers.append(headers)
+        if not self.ranges or "Range" not in headers:
+            return _Response(HTTPStatus.OK, self.data)
+        start = int(headers["Range"].removeprefix("bytes=").rstrip("-"))
+        if start >= len(self.data):
+            return _Response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE, b"")
+        return _Response(HTTPStatus.PARTIAL_CONTENT, self.data[start:])
+
 
 class UnitReddit(unittest.TestCase):
     def test_selftext_url(self):
@@ -63,3 +106,48 @@ class UnitReddit(unittest.TestCase):
         for h, u in zip(tests[0::2], tests[1::2], strict=True):
             hu = reddit._url_blacklisted(h)
             assert u == hu, h
+
+    def test_archive_chunks_resume(self):
+        lines = b"".join(b'{"id": "%d"}\n' % i for i in range(1000))
+        archive = zstandard.ZstdCompressor().compress(lines)
+
+        def chunks(offset):
+            stream = zstandard.ZstdDecompressor().stream_reader(
+                io.BytesIO(archive),
+                read_across_frames=True,
+            )
+            return list(_archive_chunks(stream, offset, chunk_size=1000))
+
+        all_chunks = chunks(0)
+        assert b"".join(data for _, data in all_chunks) == lines
+        assert all(data.endswith(b"\n") for _, data in all_chunks)
+
+        # resume from the checkpoint of a chunk in the middle
+        checkpoint, _ = all_chunks[len(all_chunks) // 2]
+        resumed = chunks(checkpoint)
+        assert b"".join(data for _, data in resumed) == lines[checkpoint:]
+        assert resumed[-1][0] == len(lines)
+
+    def test_download_archive_resume(self):
+        data = bytes(range(256)) * 100
+        with tempfile.TemporaryDirectory() as tmp:
+            file_name = Path(tmp) / "RS_2024-01.zst"
+            _ = file_name.write_bytes(data[:1000])
+
+            client = _Client(data)
+            _download_archive(client, "RS_2024-01.zst", file_name)
+            assert client.headers == [{"Range": "bytes=1000-"}]
+            assert file_name.read_bytes() == data
+
+            # already complete
+            _download_archive(client, "RS_2024-01.zst", file_name)
+            assert file_name.read_bytes() == data
+
+            # the server ignores Range, the file is downloaded again
+            _ = file_name.write_bytes(data[:1000])
+            _download_archive(
+                _Client(data, ranges=False),
+                "RS_2024-01.zst",
+                file_name,
+            )
+            assert file_name.read_bytes() == data
@@ -0,0 +1,119 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import gzip
+import tempfile
+import unittest
+
+from django.test import TestCase, override_settings
+from django_redis import get_redis_connection
+
+from web import ingest, models, sitemap_shards, util
+
+
+class UnitSitemapShards(unittest.TestCase):
+    def test_shard_of(self):
+        n = sitemap_shards.shard_count()
+        for url in ["example.com", "xojoc.pw/blog/x", "a.b/c?d=e"]:
+            key = util.url_key(url)
+            shard = sitemap_shards.shard_of(key)
+            assert 0 <= shard < n
+            first, last = sitemap_shards._url_key_range(shard)
+            assert first <= key <= last
+
+        assert sitemap_shards._url_key_range(0)[0] == -(2**63)
+        assert sitemap_shards._url_key_range(n - 1)[1] == 2**63 - 1
+
+
+class SitemapShards(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        settings = override_settings(APP_SITEMAP_DIR=tmp.name)
+        _ = settings.enable()
+        self.addCleanup(settings.disable)
+
+        _ = get_redis_connection().delete(sitemap_shards.redis_dirty_shards)
+
+    def __discussion(self, platform_id, url, comment_count):
+        return models.Discussion.objects.create(
+            platform_id=platform_id,
+            scheme_of_story_url="https",
+            schemeless_story_url=url,
+            title=url,
+            comment_count=comment_count,
+        )
+
+    def __shard(self, url):
+        return sitemap_shards.shard_of(util.url_key(url))
+
+    def __dirty(self):
+        r = get_redis_connection()
+        shards = r.smembers(sitemap_shards.redis_dirty_shards)
+        _ = r.delete(sitemap_shards.redis_dirty_shards)
+        return {int(s) for s in shards}
+
+    def test_write_shard(self):
+        _ = self.__discussion("h1", "example.com/a", 10)
+        _ = self.__discussion("r2", "www.example.com/a", 6)
+        # below min_comment_count
+        _ = self.__discussion("h3", "example.com/b", 3)
+
+        # a single URL for the discussions of the same canonical URL
+        shard = self.__shard("example.com/a")
+        assert sitemap_shards.write_shard(shard) == 1
+        with gzip.open(sitemap_shards._shard_path(shard)) as f:
+            xml = f.read().decode()
+        assert xml.count("<url>") == 1
+        assert "example.com/a" in xml
+
+        assert sitemap_shards.write_shard(self.__shard("example.com/b")) == 0
+
+    def test_mark_dirty(self):
+        d = self.__discussion("h1", "example.com/a", 10)
+        assert self.__dirty() == {self.__shard("example.com/a")}
+
+        d = models.Discussion.objects.get(pk=d.pk)
+        d.schemeless_story_url = "example.org/a"
+        d.save()
+        assert self.__dirty() == {
+            self.__shard("example.com/a"),
+            self.__shard("example.org/a"),
+        }
+
+        update_fields = ingest.update_fields("schemeless_story_url")
+        with ingest.DiscussionBatch(update_fields) as batch:
+            batch.add(
+                models.Discussion(
+                    platform_id="h1",
+                    scheme_of_story_url="https",
+                    schemeless_story_url="example.com/b",
+                    comment_count=10,
+                ),
+            )
+        assert self.__dirty() == {
+            self.__shard("example.org/a"),
+            self.__shard("example.com/b"),
+        }
+
+        models.Discussion.objects.filter(pk=d.pk).delete()
+        assert self.__dirty() == {self.__shard("example.com/b")}
+
+    def test_view(self):
+        _ = self.__discussion("h1", "example.com/a", 10)
+        shard = self.__shard("example.com/a")
+        _ = sitemap_shards.write_shard(shard)
+        url = f"/sitemaps/discussions-{shard}.xml.gz"
+
+        response = self.client.get(url)
+        assert response.status_code == 200
+        assert response["Content-Type"] == "application/gzip"
+        last_modified = response["Last-Modified"]
+
+        response = self.client.get(
+            url,
+            headers={"If-Modified-Since": last_modified},
+        )
+        assert response.status_code == 304
+
+        missing = (shard + 1) % sitemap_shards.shard_count()
+        response = self.client.get(f"/sitemaps/discussions-{missing}.xml.gz")
+        assert response.status_code == 404
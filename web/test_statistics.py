@@ -0,0 +1,106 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import datetime
+import unittest
+
+from django.test import TestCase
+from django.utils import timezone
+
+from web import models, statistics
+
+
+class UnitStatistics(unittest.TestCase):
+    def test_merge_top_stories(self):
+        def story(url, comment_count):
+            return {"canonical_story_url": url, "comment_count": comment_count}
+
+        candidates = [story("a", 10), story("b", 5), story("c", 3)]
+        top = statistics._merge_top_stories(
+            candidates,
+            [story("c", 20), story("d", 4), story("e", None)],
+            3,
+        )
+        assert [s["canonical_story_url"] for s in top] == ["c", "a", "b"]
+        assert top[0]["comment_count"] == 20
+
+
+class StatisticsTestCase(TestCase):
+    def setUp(self):
+        self.day = datetime.date(2024, 1, 10)
+        created_at = timezone.make_aware(
+            datetime.datetime.combine(self.day, datetime.time(12)),
+        )
+        for platform_id, url, comment_count in [
+            ("h1", "example.com/a", 10),
+            ("h2", "example.com/b", 5),
+            ("r3", "example.org/c", 1),
+        ]:
+            _ = models.Discussion.objects.create(
+                platform_id=platform_id,
+                scheme_of_story_url="https",
+                schemeless_story_url=url,
+                title=url,
+                comment_count=comment_count,
+                score=10,
+                created_at=created_at,
+            )
+
+    def test_rollup_day(self):
+        statistics.rollup_day(self.day)
+
+        platforms = {
+            s._platform: s
+            for s in models.PlatformDayStatistics.objects.filter(day=self.day)
+        }
+        assert platforms["h"].discussion_count == 2
+        assert platforms["h"].comment_count == 15
+        assert platforms["r"].discussion_count == 1
+
+        # domains of the discussions with at least 2 comments
+        domains = models.DomainDayStatistics.objects.filter(day=self.day)
+        assert [(d.domain, d.discussion_count) for d in domains] == [
+            ("example.com", 2),
+        ]
+
+    def test_watermark_delta(self):
+        def top_stories():
+            return [
+                s["canonical_story_url"]
+                for s in statistics.update_top_stories(
+                    models.Discussion.objects.none(),
+                )
+            ]
+
+        _ = statistics.discussions_statistics.apply()
+        assert top_stories() == [
+            "example.com/a",
+            "example.com/b",
+            "example.org/c",
+        ]
+
+        # only the deletion is left out of the watermark delta
+        models.Discussion.objects.filter(platform_id="h2").delete()
+        watermark = models.DataBag.objects.get(key=statistics.watermark_key)
+        watermark.value = timezone.now()
+        watermark.save()
+
+        _ = statistics.discussions_statistics.apply()
+
+        assert top_stories() == ["example.com/a", "example.org/c"]
+        h = models.PlatformDayStatistics.objects.get(
+            day=self.day,
+            _platform="h",
+        )
+        assert h.discussion_count == 1
+        assert h.comment_count == 10
+
+        d = models.Discussion.objects.get(platform_id="h1")
+        d.schemeless_story_url = "example.net/a"
+        d.save()
+
+        _ = statistics.discussions_statistics.apply()
+
+        assert top_stories() == ["example.net/a", "example.org/c"]
+        domains = models.DomainDayStatistics.objects.filter(day=self.day)
+        assert [(d.domain, d.discussion_count) for d in domains] == [
+            ("example.net", 1),
+        ]
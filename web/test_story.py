@@ -0,0 +1,106 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import datetime
+import unittest
+
+from django.test import TestCase
+
+from web import models
+
+
+class UnitStory(unittest.TestCase):
+    def test_from_discussions(self):
+        d1 = datetime.datetime(2022, 1, 1, tzinfo=datetime.UTC)
+        d2 = datetime.datetime(2022, 2, 1, tzinfo=datetime.UTC)
+        discussions = [
+            {
+                "scheme_of_story_url": "https",
+                "schemeless_story_url": "www.xojoc.pw/a",
+                "title": "A",
+                "comment_count": 3,
+                "score": 10,
+                "created_at": d2,
+                "normalized_tags": ["go", "programming"],
+                "_platform": "h",
+            },
+            {
+                "scheme_of_story_url": "http",
+                "schemeless_story_url": "xojoc.pw/a",
+                "title": "Top A",
+                "comment_count": 7,
+                "score": 2,
+                "created_at": d1,
+                "normalized_tags": ["golang"],
+                "_platform": "r",
+            },
+            # not relevant, counted only in all_comments
+            {
+                "scheme_of_story_url": "https",
+                "schemeless_story_url": "xojoc.pw/a",
+                "title": "A",
+                "comment_count": 1,
+                "score": None,
+                "created_at": d2,
+                "normalized_tags": ["rust"],
+                "_platform": "l",
+            },
+        ]
+
+        s = models.Story.from_discussions("xojoc.pw/a", discussions)
+
+        assert s.canonical_url == "xojoc.pw/a"
+        assert s.story_url == "http://xojoc.pw/a"
+        assert s.title == "Top A"
+        assert s.total_comments == 10
+        assert s.total_score == 12
+        assert s.total_discussions == 2
+        assert s.all_comments == 11
+        assert s.first_discussion_at == d1
+        assert s.last_discussion_at == d2
+        assert s.normalized_tags == ["go", "golang", "programming"]
+        assert s.platforms == ["h", "r"]
+
+    def test_from_irrelevant_discussions(self):
+        discussions = [
+            {
+                "scheme_of_story_url": "https",
+                "schemeless_story_url": "xojoc.pw/b",
+                "title": "B",
+                "comment_count": 1,
+                "score": 3,
+                "created_at": None,
+                "normalized_tags": [],
+                "_platform": "h",
+            },
+        ]
+
+        s = models.Story.from_discussions("xojoc.pw/b", discussions)
+
+        assert s.story_url == "https://xojoc.pw/b"
+        assert s.total_comments == 0
+        assert s.total_discussions == 0
+        assert s.all_comments == 1
+        assert s.platforms == []
+
+
+class StoryTestCase(TestCase):
+    def test_refresh(self):
+        d = models.Discussion.objects.create(
+            platform_id="h123",
+            scheme_of_story_url="https",
+            schemeless_story_url="example.com/a",
+            title="A",
+            comment_count=1,
+            score=1,
+        )
+        a = d.canonical_story_url
+        assert models.Story.objects.get(canonical_url=a).all_comments == 1
+
+        d = models.Discussion.objects.get(pk="h123")
+        d.schemeless_story_url = "example.com/b"
+        d.save()
+        b = d.canonical_story_url
+        assert not models.Story.objects.filter(canonical_url=a).exists()
+        assert models.Story.objects.filter(canonical_url=b).exists()
+
+        _ = d.delete()
+        assert not models.Story.objects.filter(canonical_url=b).exists()
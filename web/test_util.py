@@ -22,3 +22,15 @@ class UnitTitle(unittest.TestCase):
         for u, r in zip(tests[0::2], tests[1::2], strict=True):
             rr = util.url_root(u)
             assert r == rr, u
+
+    def test_url_key(self):
+        assert util.url_key(None) is None
+        assert util.url_key("") is None
+        assert util.url_key("xojoc.pw/a") == util.url_key("XOJOC.pw/a")
+        assert util.url_key("xojoc.pw/a") != util.url_key("xojoc.pw/b")
+        # first 8 bytes of md5('xojoc.pw')
+        assert util.url_key("xojoc.pw") == int.from_bytes(
+            bytes.fromhex("e034693a02c80f93"),
+            "big",
+            signed=True,
+        )
@@ -0,0 +1,292 @@
+# Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import socketserver
+import threading
+import unittest
+from unittest import mock
+
+import django.template.loader as template_loader
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from web import ingest, models, topics, weekly
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Bare bones SMTP server, rejects the recipients in server.reject."""
+
+    def __reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.__reply("220 localhost")
+        rcpt = []
+        while line := self.rfile.readline():
+            command = line[:4].upper()
+            if command in {b"EHLO", b"HELO"}:
+                self.__reply("250 localhost")
+            elif command == b"RCPT":
+                to = line.decode().split(":", 1)[1].strip(" <>\r\n")
+                if to in self.server.reject:
+                    self.__reply("550 rejected")
+                else:
+                    rcpt.append(to)
+                    self.__reply("250 ok")
+            elif command == b"DATA":
+                self.__reply("354 go ahead")
+                while self.rfile.readline() != b".\r\n":
+                    pass
+                with self.server.lock:
+                    self.server.received.extend(rcpt)
+                rcpt = []
+                self.__reply("250 ok")
+            elif command == b"QUIT":
+                self.__reply("221 bye")
+                return
+            else:
+                rcpt = [] if command == b"RSET" else rcpt
+                self.__reply("250 ok")
+
+
+class UnitWeekly(unittest.TestCase):
+    def __story(self, platform_id, url):
+        d = models.Discussion(
+            platform_id=platform_id,
+            title="Go <generics> & more",
+            scheme_of_story_url="https" if url else None,
+            schemeless_story_url=url,
+            comment_count=3,
+            score=5,
+            created_at=timezone.now(),
+        )
+        d.pre_save()
+        d.__dict__["total_comments"] = 10
+        d.__dict__["total_discussions"] = 2
+        return d
+
+    def test_rendered_email(self):
+        ctx = {
+            "topic": topics.topics["golang"],
+            "topic_key": "golang",
+            "digest": [
+                (
+                    1,
+                    "Articles",
+                    [
+                        self.__story("h1", "go.dev/blog?a=1&b=2"),
+                        self.__story("h2", None),
+                    ],
+                ),
+            ],
+            "web_link": "https://discu.eu/weekly/golang/2024/1",
+        }
+        rendered = weekly._RenderedEmail(ctx, "golang", 2024, 1)
+
+        subscriber = models.Subscriber(
+            pk=42,
+            topic="golang",
+            email="a+b@example.com",
+            verification_code="x&y",
+        )
+        ctx = {**ctx, "subscriber": subscriber}
+        weekly._rewrite_urls(ctx, subscriber, "golang", 2024, 1)
+
+        text, html = rendered.fill(subscriber)
+
+        assert text == template_loader.render_to_string(
+            "web/weekly_topic_digest.txt",
+            {"ctx": ctx},
+        )
+        assert html == template_loader.render_to_string(
+            "web/weekly_topic_week_email.html",
+            {"ctx": ctx},
+        )
+        assert "subscriber=42" in html
+
+    def test_discussion_topics(self):
+        d = models.Discussion(
+            platform_id="h1",
+            _platform="h",
+            schemeless_story_url="go.dev/blog",
+            normalized_tags=["golang"],
+        )
+        found = weekly._discussion_topics(d)
+        assert "golang" in found
+        assert "hackernews" in found
+
+        d.normalized_tags = []
+        found = weekly._discussion_topics(d)
+        assert "golang" not in found
+        assert "hackernews" in found
+
+        # topics without a platform need a story URL
+        d = models.Discussion(
+            platform_id="r1",
+            _platform="r",
+            normalized_tags=["golang"],
+        )
+        assert weekly._discussion_topics(d) == []
+
+
+class TopicWeeks(TestCase):
+    def setUp(self):
+        _ = get_redis_connection().delete(weekly.redis_dirty_topic_weeks)
+
+    def __discussion(self, platform_id, created_at, url="go.dev/blog"):
+        return models.Discussion.objects.create(
+            platform_id=platform_id,
+            title="Go 2",
+            scheme_of_story_url="https",
+            schemeless_story_url=url,
+            score=5,
+            created_at=created_at,
+        )
+
+    def __dirty(self):
+        r = get_redis_connection()
+        members = r.smembers(weekly.redis_dirty_topic_weeks)
+        _ = r.delete(weekly.redis_dirty_topic_weeks)
+        return {m.decode() for m in members if m.startswith(b"golang:")}
+
+    def __story_counts(self):
+        return {
+            (year, week): count
+            for year, week, count in models.TopicWeek.objects.filter(
+                topic="golang",
+                story_count__gt=0,
+            ).values_list("year", "week", "story_count")
+        }
+
+    def test_refresh_topic_weeks(self):
+        d = self.__discussion("h1", weekly.week_start(2024, 1))
+        _ = self.__discussion("h2", weekly.week_start(2024, 1))
+        _ = self.__discussion("h3", weekly.week_start(2024, 2))
+
+        weekly.refresh_topic_weeks("golang")
+        assert self.__story_counts() == {(2024, 1): 2, (2024, 2): 1}
+
+        _ = models.Discussion.objects.filter(platform_id="h3").delete()
+        _ = models.Discussion.objects.filter(pk=d.pk).update(
+            normalized_tags=[],
+        )
+
+        # only the weeks asked for are recomputed
+        weekly.refresh_topic_weeks("golang", [(2024, 1)])
+        assert self.__story_counts() == {(2024, 1): 1, (2024, 2): 1}
+
+        weekly.refresh_topic_weeks("golang")
+        assert self.__story_counts() == {(2024, 1): 1}
+
+    def test_mark_topic_weeks(self):
+        d = self.__discussion("h1", weekly.week_start(2024, 1))
+        assert self.__dirty() == {"golang:2024:1"}
+
+        # the discussion leaves the topic
+        d.title = "Rust 2"
+        d.schemeless_story_url = "rust-lang.org/blog"
+        d.save()
+        assert "golang" not in d.normalized_tags
+        assert self.__dirty() == {"golang:2024:1"}
+
+        d = self.__discussion("h2", weekly.week_start(2024, 2))
+        _ = self.__dirty()
+        update_fields = ingest.update_fields("title", "schemeless_story_url")
+        with ingest.DiscussionBatch(update_fields) as batch:
+            batch.add(
+                models.Discussion(
+                    platform_id="h2",
+                    title="Rust 2",
+                    scheme_of_story_url="https",
+                    schemeless_story_url="rust-lang.org/blog",
+                ),
+            )
+        assert self.__dirty() == {"golang:2024:2"}
+
+        d = self.__discussion("h3", weekly.week_start(2024, 3))
+        _ = self.__dirty()
+        d.delete()
+        assert self.__dirty() == {"golang:2024:3"}
+
+
+class WeeklyDispatch(TestCase):
+    def setUp(self):
+        self.server = socketserver.ThreadingTCPServer(
+            ("127.0.0.1", 0),
+            _SMTPHandler,
+        )
+        self.server.daemon_threads = True
+        self.server.lock = threading.Lock()
+        self.server.received = []
+        self.server.reject = {"reject@example.com"}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.discussion = models.Discussion.objects.create(
+            platform_id="h1",
+            title="Go 2",
+            scheme_of_story_url="https",
+            schemeless_story_url="go.dev/blog",
+            created_at=timezone.now(),
+        )
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __send(self):
+        d = self.discussion
+        d.__dict__["total_comments"] = 1
+        d.__dict__["total_discussions"] = 1
+        ctx = {
+            "topic": topics.topics["golang"],
+            "topic_key": "golang",
+            "digest": [(1, "Articles", [d])],
+            "web_link": "https://discu.eu/weekly/golang/2024/1",
+        }
+        with (
+            mock.patch.object(weekly, "topic_week_context", return_value=ctx),
+            override_settings(
+                EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+                EMAIL_HOST="127.0.0.1",
+                EMAIL_PORT=self.server.server_address[1],
+                EMAIL_USE_SSL=False,
+            ),
+        ):
+            weekly.send_mass_email(
+                "golang",
+                2024,
+                1,
+                testing=False,
+                backoff=0,
+            )
+
+    def test_resume(self):
+        emails = [f"s{i}@example.com" for i in range(10)]
+        for email in [*emails, "reject@example.com"]:
+            _ = models.Subscriber.objects.create(
+                email=email,
+                topic="golang",
+                confirmed=True,
+            )
+
+        models.WeeklyDelivery.objects.create(
+            subscriber=models.Subscriber.objects.get(email=emails[0]),
+            topic="golang",
+            year=2024,
+            week=1,
+            status=models.WeeklyDelivery.Status.SENT,
+            attempts=1,
+        )
+
+        self.__send()
+
+        assert sorted(self.server.received) == emails[1:]
+        deliveries = models.WeeklyDelivery.objects.filter(week=1)
+        assert deliveries.filter(status="sent").count() == len(emails)
+        failed = deliveries.get(status="failed")
+        assert failed.subscriber.email == "reject@example.com"
+        assert failed.attempts == 3
+
+        self.__send()
+
+        assert sorted(self.server.received) == emails[1:]
+        assert deliveries.get(status="failed").attempts == 6
@@ -1,5 +1,6 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
 import datetime
+import hashlib
 import operator
 import os
 import unicodedata
@@ -136,6 +137,18 @@ def url_root(url: str | cleanurl.Result | None) -> str | None:
     return url.hostname
 
 
+def url_key(url: str | None) -> int | None:
+    """64 bit key of a schemeless URL, used for indexed lookups.
+
+    Case insensitive, different URLs can have the same key so lookups
+    must compare the URLs too.
+    """
+    if not url:
+        return None
+    digest = hashlib.md5(url.lower().encode(), usedforsecurity=False)
+    return int.from_bytes(digest.digest()[:8], "big", signed=True)
+
+
 def is_sublist(lst, sublist):
     for i in range(len(lst) - len(sublist) + 1):
         for j in range(len(sublist)):
@@ -1,4 +1,5 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
+import hashlib
 import itertools
 import json
 import logging
@@ -14,7 +15,6 @@ import urllib3
 from crawlerdetect import CrawlerDetect
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.core.cache import cache
 from django.http import (
     Http404,
     HttpRequest,
@@ -35,6 +35,7 @@ from web import email_util, mention, spam
 from web.platform import Platform
 
 from . import (
+    cache_util,
     forms,
     mastodon,
     models,
@@ -71,6 +72,14 @@ def __log_query(q):
         logger.warning("__log_query failed", exc_info=True)
 
 
+@cache_util.cached(
+    "discussions_context",
+    is_empty=lambda ctx: not ctx or ctx["nothing_found"],
+)
+def __discussions_context(q):
+    return discussions_context(q)
+
+
 def discussions_context_cached(q):
     if util.is_dev():
         return discussions_context(q)
@@ -78,24 +87,7 @@ def discussions_context_cached(q):
     if not q:
         return discussions_context(q)
 
-    suffix = (q or "").lower().strip()
-
-    key = "discussions_context:" + suffix
-    touch_key = "touch:" + key
-    ctx = cache.get(key)
-
-    timeout = 5 * 60
-
-    if ctx:
-        if cache.get(touch_key):
-            _ = cache.touch(key, timeout)
-    else:
-        ctx = discussions_context(q)
-        if ctx and ctx["nothing_found"] is False:
-            cache.set(key, ctx, timeout)
-            cache.set(touch_key, 1, 3 * timeout)
-
-    return ctx
+    return __discussions_context(q)
 
 
 def discussions_context(q):
@@ -917,6 +909,34 @@ def aws_bounce_handler(request):
     return JsonResponse({})
 
 
+__mention_preview_fields = (
+    "base_url",
+    "keywords",
+    "exclude_platforms",
+    "subreddits_exclude",
+    "min_comments",
+    "min_score",
+)
+
+
+def __mention_preview_key(user_pk, rule):
+    h = hashlib.sha1(rule.encode(), usedforsecurity=False).hexdigest()
+    return f"{user_pk}:{h}"
+
+
+@cache_util.cached(
+    "mention_preview",
+    timeout=60,
+    stale_timeout=0,
+    key=__mention_preview_key,
+)
+def __mention_preview(user_pk, rule):
+    """Preview of the rule, rule are the MentionForm fields as JSON."""
+    _ = user_pk
+    rule_model = models.Mention(**json.loads(rule))
+    return (mention.discussions(rule_model) or [])[:10]
+
+
 @csrf_exempt
 @login_required
 def mention_live_preview(request):
@@ -927,10 +947,13 @@ def mention_live_preview(request):
     ctx["form"] = rule_form
     ctx["discussions"] = []
     if rule_form.is_valid():
-        rule_model = rule_form.save(commit=False)
-        ctx["discussions"] = mention.discussions(rule_model) or []
-
-    ctx["discussions"] = ctx["discussions"][:10]
+        fields = {
+            f: rule_form.cleaned_data.get(f) for f in __mention_preview_fields
+        }
+        ctx["discussions"] = __mention_preview(
+            request.user.pk,
+            json.dumps(fields, sort_keys=True),
+        )
 
     return render(
         request,
@@ -1,38 +1,53 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
 import datetime
+import functools
 import itertools
 import logging
+import operator
 import random
+import secrets
+import threading
 import time
 from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from types import SimpleNamespace
 
 import django.template.loader as template_loader
-import sentry_sdk
 from celery import shared_task
-from django.core import mail
 from django.core.cache import cache
 from django.core.mail import EmailMultiAlternatives
-from django.db.models import Count, OuterRef, Subquery, Sum, Value
-from django.db.models.functions import Coalesce, TruncDay
+from django.db import transaction
+from django.db.models import Count, F, Q, Value
+from django.db.models.functions import Coalesce, ExtractIsoYear, ExtractWeek
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.html import escape
 from django.utils.timezone import make_aware
+from django_redis import get_redis_connection
 
 from discussions import settings
 from web.category import Category
 
 from . import (
     celery_util,
+    email_util,
+    ingest,
     mastodon,
     models,
     tags,
     topics,
     twitter,
     util,
+    worker,
 )
 
 logger = logging.getLogger(__name__)
 
+# topic:year:week of the TopicWeek rows to recompute
+redis_dirty_topic_weeks = "discussions:weekly:topic_weeks:dirty"
+
 
 def base_query(topic):
     qs = (
@@ -77,19 +92,182 @@ def week_end(year, week=None):
 
 
 def all_yearweeks(topic):
-    yearweeks = set()
-    stories = (
-        base_query(topic)
-        .annotate(created_at_date=TruncDay("created_at"))
-        .values("created_at_date")
-        .distinct()
-        .order_by()
+    """Weeks with stories of topic, most recent first, see TopicWeek."""
+    return list(
+        models.TopicWeek.objects.filter(topic=topic)
+        .filter(story_count__gt=0)
+        .order_by("-year", "-week")
+        .values_list("year", "week"),
     )
-    for s in stories.iterator():
-        ic = s["created_at_date"].isocalendar()
-        yearweeks.add((ic.year, ic.week))
 
-    return sorted(yearweeks, reverse=True)
+
+def published_yearweeks(topic=None):
+    """TopicWeek rows with stories of the weeks already over."""
+    ic = timezone.now().isocalendar()
+    qs = (
+        models.TopicWeek.objects.filter(story_count__gt=0)
+        .filter(Q(year__lt=ic.year) | Q(year=ic.year, week__lt=ic.week))
+        .order_by("topic", "-year", "-week")
+    )
+    if topic:
+        qs = qs.filter(topic=topic)
+    return qs
+
+
+def _discussion_topics(d):
+    """Topics whose base_query may include discussion d."""
+    normalized_tags = set(d.normalized_tags or [])
+    found = []
+    for key, topic in topics.topics.items():
+        if topic.get("platform"):
+            if d.platform != topic["platform"]:
+                continue
+        elif not d.schemeless_story_url:
+            continue
+        topic_tags = topic.get("tags")
+        if topic_tags and not normalized_tags & set(topic_tags):
+            continue
+        found.append(key)
+    return found
+
+
+def __mark_topic_weeks(discussions):
+    members = set()
+    for d in discussions:
+        if not d.created_at:
+            continue
+        created_at = d.created_at
+        if timezone.is_naive(created_at):
+            created_at = make_aware(created_at)
+        ic = timezone.localtime(created_at).isocalendar()
+        members.update(
+            f"{topic}:{ic.year}:{ic.week}" for topic in _discussion_topics(d)
+        )
+
+    if members:
+        r = get_redis_connection()
+        _ = r.sadd(redis_dirty_topic_weeks, *members)
+
+
+@receiver(ingest.discussions_saved)
+def topic_weeks_discussions_saved(
+    sender,
+    discussions,
+    created,
+    previous=(),
+    **kwargs,
+):
+    _ = (sender, created, kwargs)
+    # the weeks of the topics the discussions left too
+    __mark_topic_weeks([*discussions, *previous])
+
+
+@receiver(pre_save, sender=models.Discussion)
+def topic_weeks_discussion_saving(sender, instance, **kwargs):
+    _ = (sender, kwargs)
+    previous = (
+        models.Discussion.objects.filter(pk=instance.pk)
+        .only(*ingest.PREVIOUS_FIELDS)
+        .first()
+    )
+    if previous:
+        __mark_topic_weeks([previous])
+
+
+@receiver(post_save, sender=models.Discussion)
+def topic_weeks_discussion_saved(sender, instance, created, **kwargs):
+    _ = (sender, created, kwargs)
+    __mark_topic_weeks([instance])
+
+
+@receiver(post_delete, sender=models.Discussion)
+def topic_weeks_discussion_deleted(sender, instance, **kwargs):
+    _ = (sender, kwargs)
+    __mark_topic_weeks([instance])
+
+
+def refresh_topic_weeks(topic, yearweeks=None):
+    """Recompute the TopicWeek rows of topic.
+
+    Only the weeks in yearweeks are recomputed, all of them if None.
+    """
+    stories = base_query(topic)
+    if yearweeks is not None:
+        yearweeks = set(yearweeks)
+        if not yearweeks:
+            return
+        stories = stories.filter(
+            functools.reduce(
+                operator.or_,
+                (
+                    Q(created_at__gte=week_start(yw))
+                    & Q(created_at__lt=week_end(yw))
+                    for yw in yearweeks
+                ),
+            ),
+        )
+
+    counts = {
+        (year, week): count
+        for year, week, count in stories.annotate(
+            year=ExtractIsoYear("created_at"),
+            week=ExtractWeek("created_at"),
+        )
+        .values_list("year", "week")
+        .annotate(story_count=Count("pk"))
+        .order_by()
+    }
+
+    if yearweeks is not None:
+        counts = {yw: counts.get(yw, 0) for yw in yearweeks}
+
+    rows = [
+        models.TopicWeek(topic=topic, year=year, week=week, story_count=count)
+        for (year, week), count in counts.items()
+    ]
+
+    with transaction.atomic():
+        if yearweeks is None:
+            _ = models.TopicWeek.objects.filter(topic=topic).update(
+                story_count=0,
+            )
+        _ = models.TopicWeek.objects.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=["topic", "year", "week"],
+            update_fields=["story_count", "entry_updated_at"],
+        )
+
+
+@shared_task(bind=True, ignore_result=True)
+def worker_refresh_topic_weeks(self):
+    """Recompute the TopicWeek rows changed by the ingested discussions."""
+    if celery_util.task_is_running(self.request.task, [self.request.id]):
+        return
+
+    r = get_redis_connection()
+    yearweeks = defaultdict(set)
+    for member in r.spop(redis_dirty_topic_weeks, 10_000) or []:
+        topic, year, week = member.decode().rsplit(":", 2)
+        if topic in topics.topics:
+            yearweeks[topic].add((int(year), int(week)))
+
+    while yearweeks:
+        topic, yws = yearweeks.popitem()
+        refresh_topic_weeks(topic, yws)
+
+        if worker.graceful_exit(self):
+            logger.info("weekly: refresh topic weeks: graceful exit")
+            if yearweeks:
+                _ = r.sadd(
+                    redis_dirty_topic_weeks,
+                    *(
+                        f"{t}:{y}:{w}"
+                        for t, ys in yearweeks.items()
+                        for y, w in ys
+                    ),
+                )
+            break
 
 
 def last_nth_yearweeks(topic, n):
@@ -105,51 +283,101 @@ def last_nth_yearweeks(topic, n):
     return sorted(yearweeks, reverse=True)[:n]
 
 
-def __get_random_old_stories(topic, categories):
-    found_categories = defaultdict(list)
-    time_ago = timezone.now() - datetime.timedelta(days=365)
+def __old_stories_key(topic, category):
+    return f"weekly:old_stories:{topic}:{category.value}"
 
-    for cat, cat_count in categories.items():
-        stories = (
-            base_query(topic)
-            .filter(created_at__lt=time_ago)
-            .filter(comment_count__gte=100)
-            .filter(score__gte=100)
-            .filter(category=cat)
-        )
 
-        # if util.is_dev():
+def old_stories_pool(topic, category, size=1000):
+    """Sample of well discussed stories older than a year.
 
-        count = stories.count()
-        if count < cat_count * 2:
+    Returns a list of (platform_id, total_comments, total_discussions).
+    """
+    time_ago = timezone.now() - datetime.timedelta(days=365)
+    stories = (
+        base_query(topic)
+        .filter(created_at__lt=time_ago)
+        .filter(comment_count__gte=100)
+        .filter(score__gte=100)
+        .filter(_category=category)
+        .annotate(
+            total_comments=Coalesce(F("story__total_comments"), Value(0)),
+            total_discussions=Coalesce(
+                F("story__total_discussions"),
+                Value(0),
+            ),
+        )
+        .order_by("?")
+        .values_list(
+            "platform_id",
+            "canonical_story_url",
+            "total_comments",
+            "total_discussions",
+        )[: size * 2]
+    )
+
+    pool = []
+    urls = set()
+    for platform_id, url, total_comments, total_discussions in stories:
+        if url and url in urls:
             continue
+        urls.add(url)
+        pool.append((platform_id, total_comments, total_discussions))
 
-        for _ in range(cat_count * 2):
-            if len(found_categories[cat]) >= categories.get(cat, 0):
-                break
-            j = random.randint(0, count - 1)  # noqa: S311
-            rs = stories[j]
-            if rs in found_categories[cat]:
-                continue
+    return pool[:size]
 
-            discussions, _, _ = models.Discussion.of_url(
-                rs.story_url,
-                only_relevant_stories=True,
-            )
-            discussion_counts = (
-                discussions.aggregate(
-                    total_comments=Coalesce(Sum("comment_count"), 0),
-                    total_discussions=Coalesce(Count("platform_id"), 0),
-                )
-                or {}
-            )
-            rs.__dict__["total_comments"] = discussion_counts.get(
-                "total_comments",
-            )
-            rs.__dict__["total_discussions"] = discussion_counts.get(
-                "total_discussions",
-            )
-            found_categories[cat].append(rs)
+
+@shared_task(bind=True, ignore_result=True)
+def worker_refresh_old_stories(self, topic=None):
+    """Refresh the pools of old stories sampled by the weekly digests."""
+    if celery_util.task_is_running(self.request.task, [self.request.id]):
+        return
+
+    for t in [topic] if topic else topics.topics:
+        for category in Category:
+            bag = models.DataBag(key=__old_stories_key(t, category))
+            bag.value = old_stories_pool(t, category)
+            bag.save()
+
+        if worker.graceful_exit(self):
+            logger.info("weekly: refresh old stories: graceful exit")
+            break
+
+
+def __get_random_old_stories(topic, categories):
+    """Pick random old stories from the pools of the categories.
+
+    categories maps each category to the number of stories wanted.
+    """
+    found_categories = defaultdict(list)
+
+    keys = {__old_stories_key(topic, cat): cat for cat in categories}
+    pools = {
+        keys[bag.key]: bag.value or []
+        for bag in models.DataBag.objects.filter(key__in=keys)
+    }
+    if len(pools) < len(keys) and cache.add(
+        f"weekly:old_stories:refresh:{topic}",
+        1,
+        timeout=60 * 60,
+    ):
+        _ = worker_refresh_old_stories.delay(topic)
+
+    picked = {}
+    for cat, cat_count in categories.items():
+        pool = pools.get(cat, [])
+        if len(pool) < cat_count * 2:
+            continue
+        for platform_id, total_comments, total_discussions in random.sample(
+            pool,
+            cat_count,
+        ):
+            picked[platform_id] = (cat, total_comments, total_discussions)
+
+    for rs in models.Discussion.objects.filter(pk__in=picked):
+        cat, total_comments, total_discussions = picked[rs.pk]
+        rs.__dict__["total_comments"] = total_comments
+        rs.__dict__["total_discussions"] = total_discussions
+        found_categories[cat].append(rs)
 
     return found_categories
 
@@ -167,39 +395,9 @@ def __get_stories(topic, year, week):
         # .order_by("created_at")
     )
 
-    min_comments = 2
-    min_score = 1
-
-    stories = stories.annotate(
-        total_comments=Coalesce(
-            Subquery(
-                models.Discussion.objects.filter(
-                    canonical_story_url=OuterRef("canonical_story_url"),
-                )
-                .filter(score__gte=min_score)
-                .filter(comment_count__gte=min_comments)
-                .values("canonical_story_url")
-                .annotate(total_comments=Sum("comment_count"))
-                .values("total_comments"),
-            ),
-            Value(0),
-        ),
-    )
-
     stories = stories.annotate(
-        total_discussions=Coalesce(
-            Subquery(
-                models.Discussion.objects.filter(
-                    canonical_story_url=OuterRef("canonical_story_url"),
-                )
-                .filter(score__gte=min_score)
-                .filter(comment_count__gte=min_comments)
-                .values("canonical_story_url")
-                .annotate(total_discussions=Count("platform_id"))
-                .values("total_discussions"),
-            ),
-            Value(0),
-        ),
+        total_comments=Coalesce(F("story__total_comments"), Value(0)),
+        total_discussions=Coalesce(F("story__total_discussions"), Value(0)),
     )
 
     stories = stories.filter(total_discussions__lt=20)
@@ -316,9 +514,9 @@ def __generate_breadcrumbs(topic=None, year=None, week=None):
 
     for breadcrumb in breadcrumbs:
         if breadcrumb.get("url"):
-            breadcrumb[
-                "url"
-            ] = f'{settings.APP_SCHEME}://{settings.APP_DOMAIN}{breadcrumb["url"]}'
+            breadcrumb["url"] = (
+                f'{settings.APP_SCHEME}://{settings.APP_DOMAIN}{breadcrumb["url"]}'
+            )
 
     return breadcrumbs
 
@@ -337,7 +535,11 @@ def topic_context(topic):
     if not ctx["topic"]:
         return None
     ctx["yearweeks"] = []
-    yearweeks = last_nth_yearweeks(topic, 3)
+    yearweeks = list(
+        published_yearweeks(topic).values_list("year", "week")[:3],
+    )
+    if not yearweeks:
+        yearweeks = last_nth_yearweeks(topic, 3)
     for yearweek in yearweeks:
         ctx["yearweeks"].append(
             {
@@ -384,11 +586,12 @@ def topic_week_context(topic: str, year: int, week: int) -> dict | None:
         week=None,
     )
     ctx["breadcrumbs"] = __generate_breadcrumbs(topic, year, week)
-    ctx[
-        "web_link"
-    ] = f"{settings.APP_SCHEME}://{settings.APP_DOMAIN}" + reverse(
-        "web:weekly_topic_week",
-        args=[topic, year, week],
+    ctx["web_link"] = (
+        f"{settings.APP_SCHEME}://{settings.APP_DOMAIN}"
+        + reverse(
+            "web:weekly_topic_week",
+            args=[topic, year, week],
+        )
     )
     twitter = topics.topics[topic].get("twitter")
     if twitter.get("account"):
@@ -433,7 +636,7 @@ def topic_week_context_cached(topic, year, week):
     return ctx
 
 
-def __rewrite_urls(ctx, subscriber, topic, year, week):
+def _rewrite_urls(ctx, subscriber, topic, year, week):
     for _, _, stories in ctx.get("digest"):
         for story in stories:
             if story.story_url:
@@ -461,25 +664,135 @@ def __rewrite_urls(ctx, subscriber, topic, year, week):
                 )
 
 
-def send_mass_email(topic, year, week, *, testing=True, only_subscribers=None):
-    if only_subscribers:
-        subscribers = only_subscribers
-    else:
-        subscribers = list(models.Subscriber.mailing_list(topic))
+class _SubscriberSlots:
+    """Stands in for the subscriber while rendering the weekly email.
 
-    random.shuffle(subscribers)
+    Its attributes are placeholders replaced with the values of each
+    subscriber, they contain only characters left alone by URL quoting
+    and HTML escaping.
+    """
 
-    logger.info(
-        f"weekly: sending mail to {len(subscribers)} subscribers for {topic} {week}/{year}",
+    def __init__(self) -> None:
+        nonce = secrets.token_hex(8)
+        self.pk = f"subscriberpk{nonce}"
+        self.unsubscribe_url = f"unsubscribeurl{nonce}"
+
+
+class _RenderedEmail:
+    """Weekly email rendered once, filled in for each subscriber."""
+
+    def __init__(self, ctx: dict, topic: str, year: int, week: int) -> None:
+        slots = _SubscriberSlots()
+        ctx = {**ctx, "subscriber": slots}
+        _rewrite_urls(ctx, slots, topic, year, week)
+
+        self.slots = slots
+        self.text = template_loader.render_to_string(
+            "web/weekly_topic_digest.txt",
+            {"ctx": ctx},
+        )
+        self.html = template_loader.render_to_string(
+            "web/weekly_topic_week_email.html",
+            {"ctx": ctx},
+        )
+
+    def fill(self, subscriber):
+        """Text and HTML content for subscriber."""
+        pk = str(subscriber.pk)
+        unsubscribe_url = subscriber.unsubscribe_url()
+        text = self.text.replace(self.slots.pk, pk).replace(
+            self.slots.unsubscribe_url,
+            unsubscribe_url,
+        )
+        html = self.html.replace(self.slots.pk, pk).replace(
+            self.slots.unsubscribe_url,
+            escape(unsubscribe_url),
+        )
+        return text, html
+
+
+def __subscriber_chunks(topic, year, week, max_attempts, chunk_size=500):
+    """Subscribers that didn't receive the email yet, in primary key order.
+
+    Subscribers whose delivery failed max_attempts times are skipped.
+    """
+    delivered = models.WeeklyDelivery.objects.filter(
+        topic=topic,
+        year=year,
+        week=week,
+    ).filter(
+        Q(status=models.WeeklyDelivery.Status.SENT)
+        | Q(attempts__gte=max_attempts),
     )
+
+    last_pk = 0
+    while True:
+        chunk = list(
+            models.Subscriber.mailing_list(topic)
+            .filter(pk__gt=last_pk)
+            .exclude(pk__in=delivered.values("subscriber"))
+            .order_by("pk")[:chunk_size],
+        )
+        if not chunk:
+            return
+        last_pk = chunk[-1].pk
+        yield chunk
+
+
+def __deliver(senders, message, retries, backoff):
+    """Send message from a pool thread, retrying with exponential backoff.
+
+    Each thread keeps its own SMTP connection. Return the attempts and
+    the last error, if all of them failed.
+    """
+    sender = getattr(senders.local, "sender", None)
+    if sender is None:
+        sender = email_util.Sender()
+        senders.local.sender = sender
+        with senders.lock:
+            senders.all.append(sender)
+
+    error = ""
+    for attempt in range(retries):
+        if attempt:
+            time.sleep(backoff * 2 ** (attempt - 1))
+        try:
+            sender.send_message(message)
+        except Exception as e:  # noqa: BLE001
+            error = repr(e)
+            logger.debug(f"weekly: send failed: {message.to}: {error}")
+        else:
+            return attempt + 1, ""
+    return retries, error
+
+
+def send_mass_email(
+    topic,
+    year,
+    week,
+    *,
+    testing=True,
+    only_subscribers=None,
+    task=None,
+    retries=3,
+    backoff=5,
+    max_attempts=6,
+):
+    """Send the weekly email of topic to the subscribers.
+
+    Each delivery is stored in WeeklyDelivery, so that if the job is
+    interrupted the next run resumes with the subscribers that didn't
+    receive it yet. Emails are sent by APP_WEEKLY_EMAIL_WORKERS threads
+    with their own SMTP connection, within the shared rate budget of
+    email_util.Sender.
+    """
+    logger.info(f"weekly: sending mail for {topic} {week}/{year}")
     ctx = topic_week_context(topic, year, week)
 
     if not ctx or not ctx.get("digest"):
         logger.warning(f"weekly: no articles {topic} {week}/{year}")
         return
 
-    messages = []
-
     subject = f"{topics.topics[topic]['name']} recap for week {week}/{year}"
     if util.is_dev():
         subject = "[DEV] " + subject
@@ -489,21 +802,10 @@ def send_mass_email(topic, year, week, *, testing=True, only_subscribers=None):
         logger.error(f"weekly: {topic} missing from_email")
         return
 
-    for subscriber in subscribers:
-        ctx["subscriber"] = subscriber
-
-        __rewrite_urls(ctx, subscriber, topic, year, week)
-
-        text_content = template_loader.render_to_string(
-            "web/weekly_topic_digest.txt",
-            {"ctx": ctx},
-        )
-
-        html_content = template_loader.render_to_string(
-            "web/weekly_topic_week_email.html",
-            {"ctx": ctx},
-        )
+    rendered = _RenderedEmail(ctx, topic, year, week)
 
+    def __message(subscriber):
+        text_content, html_content = rendered.fill(subscriber)
         msg = EmailMultiAlternatives(
             subject,
             text_content,
@@ -511,35 +813,108 @@ def send_mass_email(topic, year, week, *, testing=True, only_subscribers=None):
             [subscriber.email],
         )
         msg.attach_alternative(html_content, "text/html")
+        return msg
 
-        messages.append(msg)
+    if only_subscribers:
+        chunks = [only_subscribers]
+    else:
+        chunks = __subscriber_chunks(topic, year, week, max_attempts)
 
     if testing:
-        logger.info(messages)
+        for subscriber in itertools.chain.from_iterable(chunks):
+            logger.info(__message(subscriber))
         return
 
-    if not messages:
-        return
+    workers = settings.APP_WEEKLY_EMAIL_WORKERS
+    senders = SimpleNamespace(
+        local=threading.local(),
+        lock=threading.Lock(),
+        all=[],
+    )
+    futures = {}
+    count_sent = 0
+    count_failed = 0
+
+    def __record(done):
+        nonlocal count_sent, count_failed
+        now = timezone.now()
+        deliveries = []
+        for future in done:
+            subscriber, previous_attempts = futures.pop(future)
+            attempts, error = future.result()
+            status = models.WeeklyDelivery.Status.SENT
+            if error:
+                status = models.WeeklyDelivery.Status.FAILED
+                count_failed += 1
+            else:
+                count_sent += 1
+            deliveries.append(
+                models.WeeklyDelivery(
+                    subscriber=subscriber,
+                    topic=topic,
+                    year=year,
+                    week=week,
+                    status=status,
+                    attempts=previous_attempts + attempts,
+                    error=error,
+                    sent_at=None if error else now,
+                ),
+            )
 
-    connection = mail.get_connection()
-    messages_it = iter(messages)
-    # current SES limit rate
-    limit_rate = 60 - 1
-    while batch := list(itertools.islice(messages_it, limit_rate)):
-        try:
-            connection.send_messages(batch)
-            time.sleep(1)
-        except BaseException:
-            logger.exception("send_messages: %s %s", topic, len(batch))
-            _ = sentry_sdk.capture_exception()
-            time.sleep(10)
+        _ = models.WeeklyDelivery.objects.bulk_create(
+            deliveries,
+            update_conflicts=True,
+            unique_fields=["subscriber", "topic", "year", "week"],
+            update_fields=["status", "attempts", "error", "sent_at"],
+        )
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for chunk in chunks:
+                previous_attempts = dict(
+                    models.WeeklyDelivery.objects.filter(
+                        subscriber__in=chunk,
+                        topic=topic,
+                        year=year,
+                        week=week,
+                    ).values_list("subscriber", "attempts"),
+                )
+                for subscriber in chunk:
+                    while len(futures) >= workers * 2:
+                        done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                        __record(done)
+
+                    future = executor.submit(
+                        __deliver,
+                        senders,
+                        __message(subscriber),
+                        retries,
+                        backoff,
+                    )
+                    futures[future] = (
+                        subscriber,
+                        previous_attempts.get(subscriber.pk, 0),
+                    )
+
+                if task and worker.graceful_exit(task):
+                    logger.info(f"weekly: graceful exit: {topic}")
+                    break
+
+            __record(wait(futures).done)
+    finally:
+        for sender in senders.all:
+            sender.connection.close()
+
+    logger.info(
+        f"weekly: {topic} {week}/{year}: "
+        f"{count_sent} sent, {count_failed} failed",
+    )
 
 
 @shared_task(bind=True, ignore_result=False)
 def worker_send_weekly_email(self):
     if celery_util.task_is_running(self.request.task, [self.request.id]):
         return
-    _ = self
     six_days_ago = timezone.now() - datetime.timedelta(days=6)
     year = six_days_ago.isocalendar().year
     week = six_days_ago.isocalendar().week
@@ -551,7 +926,7 @@ def worker_send_weekly_email(self):
         topics.topics.keys(),
     )
     for topic in topics.topics:
-        send_mass_email(topic, year, week, testing=False)
+        send_mass_email(topic, year, week, testing=False, task=self)
 
 
 @shared_task(bind=True, ignore_result=True)
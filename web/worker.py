@@ -1,8 +1,11 @@
 # Copyright 2021 Alexandru Cojocaru AGPLv3 or later - no warranty!
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 import celery
 import celery.signals
+import django
 
 # import gevent
 from django.core.cache import cache
@@ -54,3 +57,24 @@ def graceful_exit(task: celery.Task) -> bool:
     redis = get_redis_connection()
     redis.expire(k, 60 * 10)
     return False
+
+
+def __init_process(initializer, initargs):
+    django.setup()
+    if initializer:
+        initializer(*initargs)
+
+
+def process_pool(max_workers, initializer=None, initargs=()):
+    """ProcessPoolExecutor safe to use from a threaded Celery worker.
+
+    Forking a worker with many threads copies their database connections
+    and any lock held at that moment, so processes are started from a
+    forkserver instead and set up Django on their own.
+    """
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context("forkserver"),
+        initializer=__init_process,
+        initargs=(initializer, initargs),
+    )